@@ -0,0 +1,45 @@
+"""
+
+Compares the LEGACY (16 byte ascii) and BINARY_V1 (tag + varint)
+TCP framing modes: header bytes on the wire and the time taken
+by FrameBuffer to parse a frame back out of the stream.
+
+"""
+
+import time
+
+import pygame
+from scripts import packets
+from scripts.engine.network import Event, FrameBuffer, Framing, Utility
+
+FRAMES_PER_RUN = 20000
+
+packet_handler = packets.get_packet_handler()
+
+samples = {
+    'RTTPing': Event(packets.PacketDefinitions.RTTPing, True),
+    'EntityDestroy': Event(packets.PacketDefinitions.EntityDestroy, 812),
+    'ClientSetLocalEntity': Event(packets.PacketDefinitions.ClientSetLocalEntity, 812, True),
+    'EntityCreate': Event(packets.PacketDefinitions.EntityCreate, 812, 'tank'),
+    'EntityUpdatePhys': Event(packets.PacketDefinitions.EntityUpdatePhys, 812,
+        pygame.Vector2(100.5, 70.25), pygame.Vector2(3, -2), 1.5, 0.0),
+}
+
+def bench_parse(frame: bytes) -> float:
+    """returns the time in nanoseconds taken to parse one frame"""
+    stream = frame*FRAMES_PER_RUN
+    frame_buffer = FrameBuffer(len(stream))
+    frame_buffer.feed(stream)
+    start = time.perf_counter()
+    frames = frame_buffer.pop_frames()
+    elapsed = time.perf_counter() - start
+    assert len(frames) == FRAMES_PER_RUN
+    return elapsed/FRAMES_PER_RUN*1e9
+
+print(f'{"packet":<22}{"payload":>8}{"legacy":>8}{"binary":>8}{"legacy ns":>11}{"binary ns":>11}')
+for name, event in samples.items():
+    data = packet_handler.pack(event)
+    legacy = Utility.get_frame_header(data, Framing.LEGACY)+data
+    binary = Utility.get_frame_header(data, Framing.BINARY_V1)+data
+    print(f'{name:<22}{len(data):>8}{len(legacy):>8}{len(binary):>8}'
+          f'{bench_parse(legacy):>11.0f}{bench_parse(binary):>11.0f}')
@@ -0,0 +1,51 @@
+"""
+
+Microbenchmark of PacketHandler.pack / PacketHandler.unpack
+for every packet registered by scripts.packets.get_packet_handler.
+
+"""
+
+import timeit
+
+import pygame
+from scripts import packets
+from scripts.engine.network import Event, HEvents
+
+ITERATIONS = 100000
+
+packet_handler = packets.get_packet_handler()
+
+def phys_update(id: int):
+    return (id, 100.5, 70.25, 3.0, -2.0, 1.5, 0.0)
+
+samples = {
+    HEvents.INIT_TCP: (9281, 1),
+    HEvents.INIT_UDP: (9281,),
+    HEvents.INIT_FINAL: (),
+    packets.PacketDefinitions.RTTPing: (True,),
+    HEvents.INIT_FRAMING: (1,),
+    packets.PacketDefinitions.EntityCreate: (812, 'tank'),
+    packets.PacketDefinitions.EntityDestroy: (812,),
+    packets.PacketDefinitions.EntityUpdateAttr: ([(i, 0b11, bytes(8)) for i in range(8)],),
+    packets.PacketDefinitions.EntityUpdatePhys: (812,
+        pygame.Vector2(100.5, 70.25), pygame.Vector2(3, -2), 1.5, 0.0),
+    packets.PacketDefinitions.EntityUpdatePhysMulti: (12.5, 1, 0, 1, [phys_update(i) for i in range(16)]),
+    packets.PacketDefinitions.EntityUpdatePhysMultiQuantized: (12.5, 1, 0, 1, [phys_update(i) for i in range(16)]),
+    packets.PacketDefinitions.EntityUpdatePhysDelta: (2, 1, 12.5, 0, 1, [3, 4],
+        [phys_update(i) for i in range(8)] + [(i, 100.5, None, None, None, 1.5, None) for i in range(8, 16)]),
+    packets.PacketDefinitions.SnapshotAck: (2,),
+    packets.PacketDefinitions.PlayerInput: ([(i, 0.0, -1.0, i % 2 == 0, 0.017) for i in range(7, 11)],),
+    packets.PacketDefinitions.InputAck: (10, 100.5, 70.25, 3.0, -2.0, 1.5, 0.0),
+    packets.PacketDefinitions.ClientSetLocalEntity: (812, True),
+}
+
+missing = set(packet_handler.handlers) - set(samples)
+assert not missing, f"No benchmark sample for packet(s) {sorted(missing)}"
+
+print(f'{"packet":>6}{"bytes":>8}{"pack ns":>10}{"unpack ns":>11}')
+for type_, args in samples.items():
+    event = Event(type_, *args)
+    data = packet_handler.pack(event)
+    pack_time = timeit.timeit(lambda: packet_handler.pack(event), number=ITERATIONS)
+    unpack_time = timeit.timeit(lambda: packet_handler.unpack(data), number=ITERATIONS)
+    print(f'{type_:>6}{len(data):>8}{pack_time/ITERATIONS*1e9:>10.0f}{unpack_time/ITERATIONS*1e9:>11.0f}')
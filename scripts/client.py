@@ -8,6 +8,9 @@ from scripts.entity_registry import get_entity_registry
 from . import engine, packets
 from .tank import TankEntity
 
+# every PlayerInput packet repeats up to this many unacknowledged commands
+INPUT_REDUNDANCY = 4
+
 class ClientGame:
     def __init__(self):
         pygame.init()
@@ -35,6 +38,9 @@ class ClientGame:
         self.client_entity: Union[TankEntity, None] = None
         
         self.world = engine.World(get_entity_registry())
+        # the client's tank is moved by its inputs straight away, the server
+        # simulates the same inputs and corrects the prediction if needed
+        self.prediction = engine.PredictionBuffer()
         
         self.timer_rtt = engine.Timer(5, True)
         self.timer_world_update = engine.Timer(0.1)
@@ -56,6 +62,18 @@ class ClientGame:
         else:
             self.avg_rtt += (rtt - self.avg_rtt)*0.5
     
+    def simulate_input(self, command: tuple) -> tuple:
+        _, x, y, boost, dt = command
+        self.client_entity.simulate_input(dt, pygame.Vector2(x, y), boost)
+        return self.client_entity.get_phys_state()
+    
+    def reconcile(self, event: engine.network.Event):
+        if self.client_entity is None: return
+        sequence, *state = event.args
+        self.prediction.reconcile(
+            sequence, (self.client_entity.id, *state),
+            self.client_entity.update_from_snapshot, self.simulate_input)
+    
     def run(self):
         while self.running:
             dt = self.clock.tick(60) / 1000  # Delta time in seconds
@@ -77,17 +95,23 @@ class ClientGame:
                 
                 if event.type == packets.PacketDefinitions.ClientSetLocalEntity:
                     entity_id, value = event.args
-                    self.world.set_entity_local(entity_id, value)
+                    self.world.set_entity_predicted(entity_id, value)
                     self.client_entity = self.world.entities[entity_id]
             
             for event in r.events_udp:
+                if event.type == packets.PacketDefinitions.InputAck:
+                    self.reconcile(event)
+                    continue
                 self.world.handle_network_event(event)
 
             keys_held = pygame.key.get_pressed()
             input_vector = engine.input_utils.get_input_vector(keys_held, K_s, K_w, K_a, K_d)
             
             if self.client_entity is not None:
-                self.client_entity.process_inputs(dt, input_vector, keys_held)
+                command = packets.quantize_input(self.prediction.next_sequence(), input_vector, keys_held[K_LSHIFT], dt)
+                self.prediction.record(command, self.simulate_input(command))
+                self.client.send_event_udp(engine.network.Event(
+                    packets.PacketDefinitions.PlayerInput, self.prediction.unacked(INPUT_REDUNDANCY)))
 
             self.world.update(dt)
             
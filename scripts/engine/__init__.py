@@ -1,12 +1,20 @@
 from . import network
+from . import network_async
 
 from .timer import Timer
+from .tick import RollingHistogram, TickScheduler
 from . import spritesheet
-from .particle import Particle
+from .particle import Particle, ParticleSystem
 from .entity_registry import EntityRegistry
 from . import entity_renderer
-from .entity import Entity
-from .snapshot import Snapshot
+from .replication import Replicated
+from .entity import Entity, StoreVector
+from .entity_state import EntityStateStore
+from .history import StateHistory
+from .snapshot import Snapshot, SnapshotAssembler, SnapshotBuffer, SnapshotScheduler, DeltaSnapshotDecoder, DeltaSnapshotEncoder, IdleSuppressor
+from .spatial import SpatialHash
+from .interest import InterestScope
+from .prediction import InputReceiver, PredictionBuffer
 from .world import World
 
 from . import input_utils
\ No newline at end of file
@@ -6,21 +6,80 @@ import pygame
 
 from . import network
 from .entity_renderer import EntityRenderer
+from .replication import Replicated, collect_replicated_fields
 
 if typing.TYPE_CHECKING:
     from .world import World
+    from .entity_state import EntityStateStore
 
 id_chars = string.ascii_letters+string.digits
 def create_entity_id():
     return ''.join([random.choice(id_chars) for _ in range(16)])
 
+class StoreVector(pygame.Vector2):
+    """position / velocity of an entity attached to a state store, a copy
+    of its row which writes in place changes (`entity.position.x = 10`,
+    `entity.velocity.scale_to_length(5)`) back through the entity.
+    vectors computed from it (`entity.position * 2`) are not attached"""
+    _entity: "Entity" = None
+    _attribute: str = None
+
+    @classmethod
+    def attached(cls, x: float, y: float, entity: "Entity", attribute: str) -> "StoreVector":
+        vector = cls(x, y)
+        # skips __setattr__, this runs on every position / velocity read
+        attributes = vector.__dict__
+        attributes['_entity'] = entity
+        attributes['_attribute'] = attribute
+        return vector
+
+    def _write_back(self):
+        if self._entity is not None:
+            setattr(self._entity, self._attribute, pygame.Vector2(self))
+
+    def __setattr__(self, name: str, value: Any):
+        super().__setattr__(name, value)
+        # x, y and the swizzles (xy, yx, ...)
+        if name[0] != '_': self._write_back()
+
+def _writes_back(name: str):
+    method = getattr(pygame.Vector2, name)
+    def in_place(self: StoreVector, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._write_back()
+        return result
+    in_place.__name__ = name
+    return in_place
+
+for _name in (
+        '__setitem__', '__iadd__', '__isub__', '__imul__', '__itruediv__', '__ifloordiv__',
+        'update', 'from_polar', 'scale_to_length', 'normalize_ip', 'rotate_ip', 'rotate_rad_ip',
+        'rotate_ip_rad', 'reflect_ip', 'clamp_magnitude_ip', 'move_towards_ip'):
+    # not every pygame version has all of them
+    if hasattr(pygame.Vector2, _name):
+        setattr(StoreVector, _name, _writes_back(_name))
+del _name
+
 class Entity():
-    position: pygame.Vector2
-    velocity: pygame.Vector2
-    drag: float
+    """A world entity.
+
+    position, velocity, rotation, rotational_velocity and drag live on the
+    entity until it is attached to the world's EntityStateStore, after that
+    they read and write its slot in the store. position / velocity then
+    return a StoreVector, changing it in place writes through to the store.
+
+    Other state the clients need is declared as Replicated class
+    attributes, see replication.Replicated."""
     size: pygame.Vector2
     rect: pygame.Rect
     renderer: EntityRenderer
+    replicated_fields: Tuple[Replicated, ...] = ()
+    replicated_mask: int = 0
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.replicated_fields = collect_replicated_fields(cls)
+        cls.replicated_mask = (1 << len(cls.replicated_fields)) - 1
     
     def __init__(
             self,
@@ -34,7 +93,10 @@ class Entity():
         self.world: "World" = world
         self.id: int = self.world.assign_new_entity_id() if id == -1 else id
         self.type_id: str = type_id
+        # bits of the replicated fields changed since the world last sent them
+        self.dirty_attributes = 0
         
+        self.state_store: Union[None, "EntityStateStore"] = None
         self.position = position
         self.velocity = pygame.Vector2(0, 0)
         self.rotation = 0
@@ -47,16 +109,131 @@ class Entity():
         
         self.renderer = renderer
     
+    @property
+    def position(self) -> pygame.Vector2:
+        """a StoreVector while attached to a state store"""
+        store = self.state_store
+        if store is None: return self._position
+        slot = store.slot_by_id.item(self.id)
+        return StoreVector.attached(store.position.item(slot, 0), store.position.item(slot, 1), self, 'position')
+    
+    @position.setter
+    def position(self, value: pygame.Vector2):
+        store = self.state_store
+        if store is None: self._position = value
+        else:
+            slot = store.slot_by_id.item(self.id)
+            store.position[slot, 0], store.position[slot, 1] = value
+    
+    @property
+    def velocity(self) -> pygame.Vector2:
+        """a StoreVector while attached to a state store"""
+        store = self.state_store
+        if store is None: return self._velocity
+        slot = store.slot_by_id.item(self.id)
+        return StoreVector.attached(store.velocity.item(slot, 0), store.velocity.item(slot, 1), self, 'velocity')
+    
+    @velocity.setter
+    def velocity(self, value: pygame.Vector2):
+        store = self.state_store
+        if store is None: self._velocity = value
+        else:
+            slot = store.slot_by_id.item(self.id)
+            store.velocity[slot, 0], store.velocity[slot, 1] = value
+    
+    @property
+    def rotation(self) -> float:
+        store = self.state_store
+        if store is None: return self._rotation
+        return store.rotation.item(store.slot_by_id.item(self.id))
+    
+    @rotation.setter
+    def rotation(self, value: float):
+        store = self.state_store
+        if store is None: self._rotation = value
+        else: store.rotation[store.slot_by_id.item(self.id)] = value
+    
+    @property
+    def rotational_velocity(self) -> float:
+        store = self.state_store
+        if store is None: return self._rotational_velocity
+        return store.rotational_velocity.item(store.slot_by_id.item(self.id))
+    
+    @rotational_velocity.setter
+    def rotational_velocity(self, value: float):
+        store = self.state_store
+        if store is None: self._rotational_velocity = value
+        else: store.rotational_velocity[store.slot_by_id.item(self.id)] = value
+    
+    @property
+    def drag(self) -> float:
+        store = self.state_store
+        if store is None: return self._drag
+        return store.drag.item(store.slot_by_id.item(self.id))
+    
+    @drag.setter
+    def drag(self, value: float):
+        store = self.state_store
+        if store is None: self._drag = value
+        else: store.drag[store.slot_by_id.item(self.id)] = value
+    
+    def attach_state_store(self, store: "EntityStateStore"):
+        """move this entity's physics state into a slot of store"""
+        store.add(self)
+        self.state_store = store
+    
+    def detach_state_store(self):
+        """copy the physics state back out of the store and free the slot"""
+        store = self.state_store
+        if store is None: return
+        position, velocity = self.position, self.velocity
+        rotation, rotational_velocity, drag = self.rotation, self.rotational_velocity, self.drag
+        self.state_store = None
+        store.remove(self.id)
+        self.position, self.velocity = position, velocity
+        self.rotation, self.rotational_velocity, self.drag = rotation, rotational_velocity, drag
+    
+    def mark_dirty(self, bits: int):
+        self.dirty_attributes |= bits
+        self.world.dirty_entities.add(self.id)
+    
+    def pack_attributes(self, mask: int) -> bytes:
+        """the replicated fields whose bit is in mask, packed in bit order"""
+        return b''.join(
+            field.struct.pack(field.__get__(self))
+            for field in self.replicated_fields if mask & field.bit)
+    
+    def unpack_attributes(self, mask: int, data: bytes):
+        """set the fields packed by pack_attributes, without marking them dirty"""
+        values = self.__dict__
+        offset = 0
+        for field in self.replicated_fields:
+            if not mask & field.bit: continue
+            values[field.name], = field.struct.unpack_from(data, offset)
+            offset += field.struct.size
+    
     def _update_rect_position(self):
-        self.rect.centerx = self.position.x
-        self.rect.bottom = self.position.y
+        self.rect.centerx, self.rect.bottom = self.position
     
     def process_inputs(self, dt: float, input_vector: pygame.Vector2, keys_held: pygame.key.ScancodeWrapper):
         ...
     
-    def update(self, dt: float):
+    def apply_input(self, dt: float, input_vector: pygame.Vector2, boost: bool):
+        """apply one input command, must only depend on the entity's physics
+        state so the client's prediction matches the server"""
+        ...
+    
+    def simulate_input(self, dt: float, input_vector: pygame.Vector2, boost: bool):
+        """one input command worth of simulation, input then physics"""
+        self.apply_input(dt, input_vector, boost)
+        self.integrate(dt)
+    
+    def integrate(self, dt: float):
         self.position += self.velocity*dt 
         self.velocity -= self.velocity*self.drag*dt
+    
+    def update(self, dt: float):
+        self.integrate(dt)
         self.update_visuals(dt)
     
     def update_visuals(self, dt: float):
@@ -69,14 +246,17 @@ class Entity():
 
         self.renderer.draw(self, surface)
     
+    def get_phys_state(self) -> Tuple:
+        """(id, x, y, vx, vy, angle, vangle), the inverse of update_from_snapshot"""
+        position, velocity = self.position, self.velocity
+        return (self.id, position.x, position.y, velocity.x, velocity.y, self.rotation, self.rotational_velocity)
+    
     def update_from_snapshot(self, update: Tuple):
         (id_,
          position_x, position_y,
          velocity_x, velocity_y,
          rotation, rotational_velocity) = update
-        self.position.x = position_x
-        self.position.y = position_y
-        self.velocity.x = velocity_x
-        self.velocity.y = velocity_y
+        self.position = pygame.Vector2(position_x, position_y)
+        self.velocity = pygame.Vector2(velocity_x, velocity_y)
         self.rotation = rotation
         self.rotational_velocity = rotational_velocity
\ No newline at end of file
@@ -0,0 +1,152 @@
+import typing
+from typing import Iterable, List, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError: # optional, World keeps state on each Entity without it
+    np = None
+
+if typing.TYPE_CHECKING:
+    from .entity import Entity
+
+HAS_NUMPY = np is not None
+
+# entity ids are u16 on the wire, so the id -> slot index is a flat array
+MAX_ENTITY_ID = 65535
+
+
+class EntityStateStore:
+    """Columnar physics state of every entity in a World.
+
+    Each entity owns one slot (row) in contiguous arrays of position,
+    velocity, rotation, rotational velocity and drag. Entities read and
+    write their state through the store once they are added to it, so
+    integration, snapshot application and snapshot encoding can each be
+    done with one array operation over all entities.
+
+    Slots are kept packed: removing an entity moves the last slot into
+    the hole, so slots [0, count) are always live.
+    """
+
+    def __init__(self, capacity: int = 64):
+        assert HAS_NUMPY, "EntityStateStore requires numpy"
+        self.count = 0
+        self.capacity = 0
+        self.ids = np.zeros(0, np.uint16)
+        self.position = np.zeros((0, 2))
+        self.velocity = np.zeros((0, 2))
+        self.rotation = np.zeros(0)
+        self.rotational_velocity = np.zeros(0)
+        self.drag = np.zeros(0)
+        self.slot_by_id = np.full(MAX_ENTITY_ID+1, -1, np.int32)
+        self.entities: List["Entity"] = []
+        self._grow(capacity)
+
+    def _grow(self, capacity: int):
+        def grown(array):
+            new = np.zeros((capacity,)+array.shape[1:], array.dtype)
+            new[:self.count] = array[:self.count]
+            return new
+        self.ids = grown(self.ids)
+        self.position = grown(self.position)
+        self.velocity = grown(self.velocity)
+        self.rotation = grown(self.rotation)
+        self.rotational_velocity = grown(self.rotational_velocity)
+        self.drag = grown(self.drag)
+        self.capacity = capacity
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, entity_id: int) -> bool:
+        return self.slot_by_id[entity_id] >= 0
+
+    def add(self, entity: "Entity") -> int:
+        """give entity a slot, its current state is copied in.
+        returns the slot"""
+        assert self.slot_by_id[entity.id] < 0, f"Entity {entity.id} already has a slot"
+        if self.count == self.capacity:
+            self._grow(self.capacity*2)
+        slot = self.count
+        self.count += 1
+        self.ids[slot] = entity.id
+        self.position[slot] = entity.position
+        self.velocity[slot] = entity.velocity
+        self.rotation[slot] = entity.rotation
+        self.rotational_velocity[slot] = entity.rotational_velocity
+        self.drag[slot] = entity.drag
+        self.slot_by_id[entity.id] = slot
+        self.entities.append(entity)
+        return slot
+
+    def remove(self, entity_id: int):
+        """free the slot of entity_id, the last slot is moved into it"""
+        slot = self.slot_by_id[entity_id]
+        if slot < 0: return
+        last = self.count-1
+        if slot != last:
+            for array in (self.ids, self.position, self.velocity, self.rotation, self.rotational_velocity, self.drag):
+                array[slot] = array[last]
+            self.entities[slot] = self.entities[last]
+            self.slot_by_id[self.ids[slot]] = slot
+        self.entities.pop()
+        self.slot_by_id[entity_id] = -1
+        self.count = last
+
+    def slots_of(self, entity_ids: Iterable[int]) -> "np.ndarray":
+        """slots of the given entity ids, ids without a slot are skipped"""
+        slots = self.slot_by_id[np.fromiter(entity_ids, np.int64)]
+        return slots[slots >= 0]
+
+    def integrate(self, dt: float, slots: Union[None, "np.ndarray"] = None):
+        """Entity.update physics (move, then apply drag) for the given
+        slots, or every slot"""
+        if slots is None:
+            slots = slice(0, self.count)
+        velocity = self.velocity[slots]
+        self.position[slots] += velocity*dt
+        self.velocity[slots] = velocity - velocity*(self.drag[slots]*dt)[:, None]
+
+    def apply_states(self, entity_ids: "np.ndarray", states: "np.ndarray", skip: Union[None, "np.ndarray"] = None) -> "np.ndarray":
+        """write rows of (x, y, vx, vy, angle, vangle) into the slots of
+        entity_ids, unknown ids and ids in skip are ignored.
+        returns the slots which were written"""
+        slots = self.slot_by_id[entity_ids]
+        keep = slots >= 0
+        if skip is not None and len(skip):
+            keep &= ~np.isin(entity_ids, skip)
+        slots = slots[keep]
+        states = states[keep]
+        self.position[slots] = states[:, 0:2]
+        self.velocity[slots] = states[:, 2:4]
+        self.rotation[slots] = states[:, 4]
+        self.rotational_velocity[slots] = states[:, 5]
+        return slots
+
+    def apply_state_tuples(self, entity_states: List[Tuple], skip: Union[None, "np.ndarray"] = None) -> "np.ndarray":
+        """apply_states for (id, x, y, vx, vy, angle, vangle) tuples"""
+        if not entity_states:
+            return np.zeros(0, np.int32)
+        rows = np.array(entity_states, np.float64)
+        return self.apply_states(rows[:, 0].astype(np.int64), rows[:, 1:], skip)
+
+    def get_states(self, slots: "np.ndarray") -> "np.ndarray":
+        """rows of (x, y, vx, vy, angle, vangle) of the given slots, the
+        inverse of apply_states"""
+        return np.column_stack((
+            self.position[slots], self.velocity[slots],
+            self.rotation[slots], self.rotational_velocity[slots]))
+
+    def get_state_tuples(self, slots: Union[None, "np.ndarray"] = None) -> List[Tuple]:
+        """(id, x, y, vx, vy, angle, vangle) tuples of the given slots,
+        or every slot"""
+        if slots is None:
+            slots = slice(0, self.count)
+        position = self.position[slots]
+        velocity = self.velocity[slots]
+        return list(zip(
+            self.ids[slots].tolist(),
+            position[:, 0].tolist(), position[:, 1].tolist(),
+            velocity[:, 0].tolist(), velocity[:, 1].tolist(),
+            self.rotation[slots].tolist(),
+            self.rotational_velocity[slots].tolist()))
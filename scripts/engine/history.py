@@ -0,0 +1,96 @@
+from typing import Iterable, Tuple, Union
+
+from .entity_state import EntityStateStore, np
+from .snapshot import Snapshot, interpolate_arrays
+
+
+class StateHistory:
+    """Fixed size ring buffer of the physics state of every entity at the
+    end of each server tick, for lag compensation.
+
+    Each tick is one row of preallocated arrays, ids sorted so a tick can
+    be searched for a few entities without looking at the others. Rows
+    only grow when there are more entities than ever before, memory is
+    capacity * entities * 7 values.
+
+    sample interpolates between the two recorded ticks around a time,
+    times before the oldest tick are clamped to it, so a query never
+    rewinds further than capacity ticks.
+    """
+
+    def __init__(self, capacity: int = 64, entity_capacity: int = 64):
+        assert np is not None, "StateHistory requires numpy"
+        self.capacity = capacity
+        self.entity_capacity = entity_capacity
+        self.times = np.zeros(capacity)
+        self.counts = np.zeros(capacity, np.int64)
+        self.ids = np.zeros((capacity, entity_capacity), np.int64)
+        # x, y, vx, vy, angle, vangle
+        self.states = np.zeros((capacity, entity_capacity, 6))
+        self.head = 0 # row the next tick is written to
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _grow(self, entity_capacity: int):
+        ids = np.zeros((self.capacity, entity_capacity), np.int64)
+        states = np.zeros((self.capacity, entity_capacity, 6))
+        ids[:, :self.entity_capacity] = self.ids
+        states[:, :self.entity_capacity] = self.states
+        self.ids, self.states = ids, states
+        self.entity_capacity = entity_capacity
+
+    def record(self, time: float, store: EntityStateStore):
+        """store the state of every entity in store as the tick at time"""
+        count = store.count
+        if count > self.entity_capacity:
+            self._grow(max(count, self.entity_capacity*2))
+        order = np.argsort(store.ids[:count], kind='stable')
+        row = self.head
+        self.ids[row, :count] = store.ids[:count][order]
+        states = self.states[row]
+        states[:count, 0:2] = store.position[:count][order]
+        states[:count, 2:4] = store.velocity[:count][order]
+        states[:count, 4] = store.rotation[:count][order]
+        states[:count, 5] = store.rotational_velocity[:count][order]
+        self.times[row] = time
+        self.counts[row] = count
+        self.head = (row+1) % self.capacity
+        self.size = min(self.size+1, self.capacity)
+
+    def oldest_time(self) -> float:
+        return self.times[(self.head-self.size) % self.capacity]
+
+    def bracket(self, time: float) -> Union[None, Tuple[int, int, float]]:
+        """(row before, row after, t) of the ticks around time, None if
+        nothing has been recorded"""
+        if not self.size: return None
+        rows = (self.head - self.size + np.arange(self.size)) % self.capacity
+        i = int(np.searchsorted(self.times[rows], time, 'right'))
+        if i == 0: return int(rows[0]), int(rows[0]), 0.0
+        if i == self.size: return int(rows[-1]), int(rows[-1]), 0.0
+        row1, row2 = int(rows[i-1]), int(rows[i])
+        span = self.times[row2] - self.times[row1]
+        return row1, row2, (time - self.times[row1])/span if span > 0 else 1.0
+
+    def _tick(self, row: int, query: Union[None, "np.ndarray"]) -> Snapshot:
+        count = self.counts[row]
+        ids = self.ids[row, :count]
+        states = self.states[row, :count]
+        if query is not None:
+            rows = np.searchsorted(ids, query)
+            rows[rows == count] = 0
+            found = rows[ids[rows] == query] if count else rows[:0]
+            ids, states = ids[found], states[found]
+        return Snapshot(0, self.times[row], ids=ids, states=states)
+
+    def sample(self, time: float, entity_ids: Iterable[int] = None) -> Tuple["np.ndarray", "np.ndarray"]:
+        """(ids, states) of every entity, or of entity_ids, at time.
+        entities missing from either tick around time are left out"""
+        bracket = self.bracket(time)
+        if bracket is None:
+            return np.zeros(0, np.int64), np.zeros((0, 6))
+        row1, row2, t = bracket
+        query = None if entity_ids is None else np.unique(np.fromiter(entity_ids, np.int64))
+        return interpolate_arrays(self._tick(row1, query), self._tick(row2, query), t)
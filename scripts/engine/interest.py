@@ -0,0 +1,33 @@
+from typing import Iterable, List, Set, Tuple
+
+from .spatial import SpatialHash
+
+
+class InterestScope:
+    """The entities one client is told about (its area of interest).
+
+    Entities within view_radius of the client's viewpoint enter the scope,
+    they only leave it once they are further than view_radius+hysteresis
+    away, so entities near the edge do not flicker in and out. The server
+    sends EntityCreate / EntityDestroy for the ids update returns, and
+    only puts entities in scope into that client's snapshots.
+    """
+
+    def __init__(self, view_radius: float = 400.0, hysteresis: float = 50.0):
+        self.view_radius = view_radius
+        self.hysteresis = hysteresis
+        self.in_scope: Set[int] = set()
+
+    def update(self, spatial_hash: SpatialHash, center: Tuple[float, float], always: Iterable[int] = ()) -> Tuple[List[int], List[int]]:
+        """recompute the scope around center, returns (entered, left) ids.
+        ids in always are kept in scope regardless of distance, ids which
+        are no longer in spatial_hash (destroyed entities) leave the scope"""
+        scope = set(spatial_hash.query_radius(center, self.view_radius))
+        if self.in_scope:
+            keep = spatial_hash.query_radius(center, self.view_radius+self.hysteresis)
+            scope.update(entity_id for entity_id in keep if entity_id in self.in_scope)
+        scope.update(entity_id for entity_id in always if entity_id in spatial_hash)
+        entered = [entity_id for entity_id in scope if entity_id not in self.in_scope]
+        left = [entity_id for entity_id in self.in_scope if entity_id not in scope]
+        self.in_scope = scope
+        return entered, left
@@ -0,0 +1,184 @@
+"""
+
+This mmsg.py file wraps the linux sendmmsg(2) / recvmmsg(2)
+syscalls with ctypes, so many datagrams can be moved with
+one syscall. Python's socket module does not expose them.
+
+AVAILABLE is False on other platforms (or without glibc),
+callers are expected to fall back to sendto / recvfrom_into.
+Only IPv4 addresses are supported.
+
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import socket
+import struct
+import sys
+from typing import Dict, List, Tuple
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_hdr', msghdr),
+        ('msg_len', ctypes.c_uint)]
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_uint16),
+        ('sin_port', ctypes.c_uint16),   # network byte order
+        ('sin_addr', ctypes.c_uint8*4),  # network byte order
+        ('sin_zero', ctypes.c_uint8*8)]
+
+_libc = None
+if sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        _libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        _libc = None
+
+AVAILABLE = _libc is not None
+
+MSG_DONTWAIT = 0x40
+SOCKADDR_IN_SIZE = ctypes.sizeof(sockaddr_in)
+
+
+def _raise_errno():
+    error = ctypes.get_errno()
+    raise OSError(error, f"mmsg syscall failed: {errno.errorcode.get(error, error)}")
+
+
+class MultiSender:
+    """Sends one payload to many IPv4 addresses with sendmmsg.
+
+    Every message points at the same iovec, and address structs are
+    cached per address. When a broadcast goes to the same clients as the
+    previous one only the iovec is updated before the syscall."""
+
+    def __init__(self, max_batch: int = 256):
+        self.max_batch = max_batch
+        self.messages = (mmsghdr*max_batch)()
+        self.vector = iovec()
+        self.addresses: Dict[Tuple[str, int], sockaddr_in] = {}
+        # addresses currently filled into self.messages
+        self._filled: Tuple[Tuple[str, int], ...] = ()
+        vector_pointer = ctypes.pointer(self.vector)
+        for message in self.messages:
+            message.msg_hdr.msg_iov = vector_pointer
+            message.msg_hdr.msg_iovlen = 1
+            message.msg_hdr.msg_namelen = SOCKADDR_IN_SIZE
+
+    def _get_address(self, addr: Tuple[str, int]) -> sockaddr_in:
+        address = self.addresses.get(addr)
+        if address is None:
+            address = sockaddr_in()
+            address.sin_family = socket.AF_INET
+            address.sin_port = socket.htons(addr[1])
+            address.sin_addr[:] = socket.inet_aton(addr[0])
+            self.addresses[addr] = address
+        return address
+
+    def forget_address(self, addr: Tuple[str, int]):
+        self.addresses.pop(addr, None)
+        self._filled = ()
+
+    def _fill(self, batch: Tuple[Tuple[str, int], ...]):
+        if batch == self._filled:
+            return
+        for message, addr in zip(self.messages, batch):
+            message.msg_hdr.msg_name = ctypes.addressof(self._get_address(addr))
+        self._filled = batch
+
+    def send(self, fileno: int, data: bytes, addrs: List[Tuple[str, int]]) -> int:
+        """send data to every address, returns how many datagrams the kernel
+        took, stops early (without raising) if the socket buffer is full"""
+        buffer = ctypes.create_string_buffer(bytes(data), len(data))
+        self.vector.iov_base = ctypes.addressof(buffer)
+        self.vector.iov_len = len(data)
+        sent_total = 0
+        for batch_start in range(0, len(addrs), self.max_batch):
+            batch = tuple(addrs[batch_start:batch_start+self.max_batch])
+            self._fill(batch)
+            offset = 0
+            while offset < len(batch):
+                sent = _libc.sendmmsg(
+                    fileno,
+                    ctypes.byref(self.messages, offset*ctypes.sizeof(mmsghdr)),
+                    len(batch)-offset, MSG_DONTWAIT)
+                if sent < 0:
+                    if ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        return sent_total
+                    _raise_errno()
+                offset += sent
+                sent_total += sent
+        return sent_total
+
+
+_SOCKADDR_IN = struct.Struct('!2xH4s8x')
+
+class MultiReceiver:
+    """Receives up to batch_size datagrams per recvmmsg call into
+    a preallocated pool of buffers, one buffer per message.
+
+    Datagrams returned by datagram() are memoryviews into the pool,
+    they are only valid until the next recv() call."""
+
+    def __init__(self, batch_size: int = 32, buffer_size: int = 8096):
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.pool = bytearray(batch_size*buffer_size)
+        self.pool_view = memoryview(self.pool)
+        self.names = bytearray(batch_size*SOCKADDR_IN_SIZE)
+        self.messages = (mmsghdr*batch_size)()
+        self.vectors = (iovec*batch_size)()
+        # ip strings are reused for known (port, address) pairs
+        self.addresses: Dict[Tuple[int, bytes], Tuple[str, int]] = {}
+        pool_address = ctypes.addressof((ctypes.c_char*len(self.pool)).from_buffer(self.pool))
+        names_address = ctypes.addressof((ctypes.c_char*len(self.names)).from_buffer(self.names))
+        for i in range(batch_size):
+            self.vectors[i].iov_base = pool_address + i*buffer_size
+            self.vectors[i].iov_len = buffer_size
+            header = self.messages[i].msg_hdr
+            header.msg_iov = ctypes.pointer(self.vectors[i])
+            header.msg_iovlen = 1
+            header.msg_name = names_address + i*SOCKADDR_IN_SIZE
+            header.msg_namelen = SOCKADDR_IN_SIZE
+
+    def recv(self, fileno: int, max_count: int) -> int:
+        """receive up to max_count datagrams without blocking,
+        returns how many were received (0 if none are waiting)"""
+        received = _libc.recvmmsg(fileno, self.messages, min(max_count, self.batch_size), MSG_DONTWAIT, None)
+        if received < 0:
+            if ctypes.get_errno() in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return 0
+            _raise_errno()
+        return received
+
+    def datagram(self, index: int) -> Tuple[memoryview, Tuple[str, int]]:
+        """(payload, address) of a datagram from the last recv() call"""
+        port, raw_address = _SOCKADDR_IN.unpack_from(self.names, index*SOCKADDR_IN_SIZE)
+        addr = self.addresses.get((port, raw_address))
+        if addr is None:
+            if len(self.addresses) >= 4096: # arbitrary senders can't grow it forever
+                self.addresses.clear()
+            addr = (socket.inet_ntoa(raw_address), port)
+            self.addresses[(port, raw_address)] = addr
+        start = index*self.buffer_size
+        return self.pool_view[start:start+self.messages[index].msg_len], addr
@@ -11,17 +11,21 @@ v0.0.2
 
 """
 
+from collections import deque
 import errno
+from itertools import islice
 import logging
 import random
-import select
+import selectors
 import socket
 import string
 import struct
 import time
-from typing import Callable, Dict, Iterable, List, Tuple, Union
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Union
 from dataclasses import dataclass
 
+from . import mmsg
+
 logger = logging.getLogger('network')
 logger.setLevel(logging.WARN)
 
@@ -42,14 +46,60 @@ class UDPBase:
 class Constants:
     HEADER_SIZE = 16
     UDP_PACKET_SIZE = 8096
+    # payload size which fits in one datagram on common paths without IP fragmentation
+    UDP_SAFE_PAYLOAD = 1200
+    # datagrams received per recvmmsg call, each gets its own UDP_PACKET_SIZE buffer
+    UDP_RECV_BATCH = 32
+    # most datagrams drained by one UDPBase.pump, the rest wait for the next tick
+    UDP_MAX_DATAGRAMS_PER_PUMP = 512
+    # most frames handed to one gather write
+    TCP_MAX_GATHER = 256
+    # largest TCP frame a FrameBuffer accepts, bigger headers fail the connection
+    TCP_MAX_FRAME_SIZE = 16*1024*1024
     RANDOM_ID_CHARS = string.ascii_letters+string.digits
 
+class Framing:
+    """TCP frame header modes.
+
+    LEGACY frames are prefixed with a 16 byte zero padded ascii length.
+    BINARY_V1 frames are prefixed with a version tag byte followed by a
+    LEB128 varint length, so frames under 128 bytes carry a 2 byte header.
+    The tag can never be an ascii digit, which lets a receiver accept
+    both modes on the same stream. The mode a peer sends with is agreed
+    on during the HEvents.INIT_TCP handshake.
+    """
+    LEGACY = 0
+    BINARY_V1 = 1
+    LATEST = BINARY_V1
+
+    BINARY_V1_TAG = 0xB1
+
 class Utility():
     @staticmethod
     def get_header(data: bytes, headersize: int = 16):
         """generate header for byte data"""
         return str(len(data)).rjust(headersize, '0').encode()
 
+    @staticmethod
+    def get_binary_header(data: bytes) -> bytes:
+        """generate a BINARY_V1 header for byte data"""
+        length = len(data)
+        if length < 0x80:
+            return _SMALL_BINARY_HEADERS[length]
+        header = bytearray((Framing.BINARY_V1_TAG,))
+        while length >= 0x80:
+            header.append((length & 0x7F) | 0x80)
+            length >>= 7
+        header.append(length)
+        return bytes(header)
+
+    @staticmethod
+    def get_frame_header(data: bytes, framing: int = Framing.LEGACY) -> bytes:
+        """generate the header for byte data in the given framing mode"""
+        if framing == Framing.LEGACY:
+            return Utility.get_header(data, Constants.HEADER_SIZE)
+        return Utility.get_binary_header(data)
+
     @staticmethod
     def get_local_ip() -> str:
         """get local ipv4 address"""
@@ -67,22 +117,232 @@ class Utility():
             for _ in range(length))
 
 
+_SMALL_BINARY_HEADERS = [bytes((Framing.BINARY_V1_TAG, length)) for length in range(0x80)]
+
+
 class ConnException(Exception):
     def __init__(self, message, critical:bool=False):
         super().__init__(message)
         self.critical = critical
 
 
+class FrameBuffer:
+    """Per-connection receive buffer used to reassemble header
+    prefixed frames from a TCP byte stream.
+
+    Bytes are read straight into a growable bytearray with recv_into,
+    so one read never allocates, and a single read can yield any number
+    of complete frames. Partial frames stay in the buffer until the
+    rest of their bytes arrive. Both LEGACY and BINARY_V1 headers are
+    understood, see Framing. A malformed header, or one declaring more
+    than Constants.TCP_MAX_FRAME_SIZE bytes, raises ValueError and the
+    connection should be dropped.
+    """
+
+    def __init__(self, size: int = 4096):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0 # first byte which has not been consumed yet
+        self.end = 0   # end of the received data
+
+    def _make_room(self, needed: int = 1):
+        """compact unconsumed bytes to the front of the buffer, growing
+        it when there are still fewer than needed free bytes afterwards"""
+        pending = self.end - self.start
+        if self.start > 0:
+            self.view[:pending] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        if len(self.buffer) - self.end < needed:
+            size = max(2*len(self.buffer), pending+needed)
+            self.view.release()
+            self.buffer.extend(bytes(size-len(self.buffer)))
+            self.view = memoryview(self.buffer)
+
+    def recv_from(self, connection: socket.socket) -> int:
+        """receive available bytes from connection into the buffer,
+        raises ConnException if the peer closed the connection"""
+        if self.end == len(self.buffer):
+            self._make_room()
+        byte_count = connection.recv_into(self.view[self.end:])
+        if byte_count == 0:
+            raise ConnException(
+                "connection closed by peer in recv_from() call",
+                critical=True)
+        self.end += byte_count
+        return byte_count
+
+    def feed(self, data: bytes):
+        """copy already received bytes into the buffer, used by
+        transports which hand over data instead of a socket"""
+        if len(self.buffer) - self.end < len(data):
+            self._make_room(len(data))
+        self.view[self.end:self.end+len(data)] = data
+        self.end += len(data)
+
+    def _parse_header(self, start: int, end: int) -> Tuple[int, int]:
+        """parse the frame header at start, returns (frame_start, byte_count)
+        or (-1, 0) if the header has not been fully received yet"""
+        buffer = self.buffer
+        if buffer[start] == Framing.BINARY_V1_TAG:
+            byte_count = 0
+            shift = 0
+            position = start+1
+            while position < end:
+                byte = buffer[position]
+                position += 1
+                byte_count |= (byte & 0x7F) << shift
+                if byte < 0x80:
+                    return position, self._check_frame_size(byte_count)
+                shift += 7
+                if shift > 28:
+                    raise ValueError("frame length varint is too long")
+            return -1, 0
+        header_size = Constants.HEADER_SIZE
+        if end - start < header_size:
+            return -1, 0
+        header = buffer[start:start+header_size]
+        # int() would also take signs, spaces and underscores
+        if not header.isdigit():
+            raise ValueError(f"invalid legacy frame header {bytes(header)!r}")
+        return start+header_size, self._check_frame_size(int(header))
+
+    @staticmethod
+    def _check_frame_size(byte_count: int) -> int:
+        if byte_count > Constants.TCP_MAX_FRAME_SIZE:
+            raise ValueError(
+                f"frame length {byte_count} is over the {Constants.TCP_MAX_FRAME_SIZE} byte limit")
+        return byte_count
+
+    def pop_frames(self) -> List[bytes]:
+        """remove and return every complete frame in the buffer"""
+        frames = []
+        start, end = self.start, self.end
+        while start < end:
+            frame_start, byte_count = self._parse_header(start, end)
+            if frame_start == -1:
+                break
+            frame_end = frame_start+byte_count
+            if frame_end > end:
+                break
+            frames.append(bytes(self.view[frame_start:frame_end]))
+            start = frame_end
+        if start == end:
+            # everything was consumed, rewind instead of compacting
+            start = end = 0
+        self.start, self.end = start, end
+        return frames
+
+
+_HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+class OutboundQueue:
+    """Per-connection queue of frames waiting to be written.
+
+    Frames are queued without being copied or joined, and one flush
+    writes as many of them as the socket takes with a single gather
+    write (sendmsg, or one joined send where sendmsg does not exist).
+    A flush never blocks, whatever is left stays queued.
+    """
+
+    def __init__(self):
+        self.buffers: deque = deque()
+        self.queued_bytes = 0
+        # whether the selector is watching the connection for writability
+        self.write_registered = False
+        # time the queue went above the high water mark, None while below it
+        self.above_high_water_since: Union[None, float] = None
+        # backpressure metrics
+        self.bytes_sent = 0
+        self.writes = 0
+        self.partial_writes = 0
+        self.peak_queued_bytes = 0
+
+    def append(self, data: bytes):
+        self.buffers.append(data)
+        self.queued_bytes += len(data)
+        if self.queued_bytes > self.peak_queued_bytes:
+            self.peak_queued_bytes = self.queued_bytes
+
+    def flush(self, connection: socket.socket) -> int:
+        """write queued frames until the queue is empty or the socket
+        is full, returns the number of bytes written"""
+        buffers = self.buffers
+        total_sent = 0
+        while buffers:
+            batch = list(islice(buffers, Constants.TCP_MAX_GATHER))
+            try:
+                if _HAS_SENDMSG:
+                    sent = connection.sendmsg(batch)
+                else:
+                    sent = connection.send(b''.join(batch))
+            except BlockingIOError:
+                break
+            self.writes += 1
+            total_sent += sent
+            remaining = sent
+            # drop fully written frames, keep a view of a partly written one
+            while remaining:
+                head = buffers[0]
+                if len(head) <= remaining:
+                    buffers.popleft()
+                    remaining -= len(head)
+                else:
+                    buffers[0] = memoryview(head)[remaining:]
+                    remaining = 0
+            if sent < sum(len(buffer) for buffer in batch):
+                # the socket buffer is full
+                self.partial_writes += 1
+                break
+        self.queued_bytes -= total_sent
+        self.bytes_sent += total_sent
+        return total_sent
+
+
 class Event:
+    """A network event, the packet type and its args.
+
+    Events made by PacketHandler.unpack_lazy keep the raw packet and only
+    decode args when they are first accessed, so events which get filtered
+    out by type (or by peeking at the payload) are never fully decoded.
+    """
+    __slots__ = ('type', '_args', 'payload', '_unpacker', 'from_connection')
     type: int
-    args: Iterable
+    # raw packet including the type prefix, None once args are decoded
+    payload: Union[None, bytes, memoryview]
     from_connection: Union[None, socket.socket]
     
     def __init__(self, type: int, *args):
         self.type = type
-        self.args = args
+        self._args = args
+        self.payload = None
+        self._unpacker = None
         self.from_connection = None
     
+    @classmethod
+    def lazy(cls, type: int, payload: Union[bytes, memoryview], unpacker: Callable[[bytes], Iterable]) -> 'Event':
+        event = cls.__new__(cls)
+        event.type = type
+        event._args = None
+        event.payload = payload
+        event._unpacker = unpacker
+        event.from_connection = None
+        return event
+    
+    @property
+    def args(self) -> Tuple:
+        if self._args is None:
+            self._args = tuple(self._unpacker(self.payload))
+            self.payload = None
+            self._unpacker = None
+        return self._args
+    
+    @args.setter
+    def args(self, args: Iterable):
+        self._args = tuple(args)
+        self.payload = None
+        self._unpacker = None
+    
     def __repr__(self) -> str:
         return f'Event<{self.type}, {self.args}>'
         
@@ -92,22 +352,37 @@ class Event:
 Complex packet handlers can have packer and unpacker
 functions given as arguments instead of simple struct format str
 
-packet_handler.add_handler(
+packet_handler.add_custom_handler(
     4,
-    packer=lambda args: struct.pack('<?', *args),
+    packer=lambda *args: struct.pack('<?', *args),
     unpacker=lambda data: struct.unpack('<?', data)
 )
 
 '''
 
+TYPE_STRUCT = struct.Struct('<H')
+
 class PacketHandler:
-    """Pack and unpack events"""
+    """Pack and unpack events
+
+    Every handler is compiled once when it is added: simple handlers get a
+    struct.Struct which already includes the '<H' type prefix, so packing an
+    event is a single pack call. pack and unpack then dispatch straight
+    through the packers / unpackers tables."""
     
     def __init__(self):
         self.handlers: Dict[int, Union[
             Tuple[str, Callable, Callable], # Simple (format, pre/postprocess)
             Tuple[Callable, Callable]       # Custom (packer, unpacker)
         ]] = {}
+        # type -> callable(*args) returning the packed event, type prefix included
+        self.packers: Dict[int, Callable[..., bytes]] = {}
+        # type -> callable(data) returning the event args, data includes the type prefix
+        self.unpackers: Dict[int, Callable[[bytes], Iterable]] = {}
+        # type -> packet size, for fixed size (struct format) handlers
+        self.sizes: Dict[int, int] = {}
+        # fixed size types with a postprocess step, the only ones worth decoding lazily
+        self.lazy_types: Set[int] = set()
 
     def register(self, id: int):
         def decorator(func):
@@ -116,7 +391,7 @@ class PacketHandler:
             if isinstance(result[0], str) or result[0] is None:
                 self.add_handler(id, *result)
             else:
-                self.handlers[id] = result  # (packer, unpacker)
+                self.add_custom_handler(id, *result)  # (packer, unpacker[, reserves_type_prefix])
             return func
         return decorator
 
@@ -130,47 +405,108 @@ class PacketHandler:
         assert id not in self.handlers, f"Handler for id {id} already exists."
         self.handlers[id] = (format, preprocess, postprocess)
 
-    def pack(self, event: Event) -> bytes:
-        if event.type not in self.handlers:
-            raise ValueError(f"No handler for event type {event.type}")
-        handler = self.handlers[event.type]
+        type_prefix = TYPE_STRUCT.pack(id)
+        if not format:
+            self.packers[id] = lambda *args: type_prefix
+            self.unpackers[id] = lambda data: ()
+            self.sizes[id] = TYPE_STRUCT.size
+            return
+
+        if format[0] == '<':
+            # the type prefix and the body share one precompiled struct
+            full_struct = struct.Struct('<H'+format[1:])
+            body_struct = struct.Struct(format)
+            full_pack = full_struct.pack
+            if preprocess is None:
+                packer = lambda *args: full_pack(id, *args)
+            else:
+                packer = lambda *args: full_pack(id, *preprocess(*args))
+        else:
+            # other byte orders / alignments cannot be merged with '<H'
+            full_struct = None
+            body_struct = struct.Struct(format)
+            body_pack = body_struct.pack
+            if preprocess is None:
+                packer = lambda *args: type_prefix+body_pack(*args)
+            else:
+                packer = lambda *args: type_prefix+body_pack(*preprocess(*args))
+
+        size = TYPE_STRUCT.size+body_struct.size
+        self.sizes[id] = size
+        body_unpack_from = body_struct.unpack_from
+        def unpack(data: bytes) -> Tuple:
+            if len(data) != size:
+                raise struct.error(f"unpack requires a buffer of {size} bytes")
+            return body_unpack_from(data, 2)
+
+        self.packers[id] = packer
+        if postprocess is None:
+            self.unpackers[id] = unpack
+        else:
+            self.unpackers[id] = lambda data: postprocess(*unpack(data))
+            self.lazy_types.add(id)
 
-        if isinstance(handler[0], str) or handler[0] is None:
-            # Simple handler (format string or empty)
-            format, preprocess, _ = handler
-            args = event.args if preprocess is None else preprocess(*event.args)
-            body = struct.pack(format, *args) if format else b''
+    def add_custom_handler(
+        self,
+        id: int,
+        packer: Callable[..., bytes],
+        unpacker: Callable[[bytes], Iterable],
+        reserves_type_prefix: bool = False
+    ) -> None:
+        """reserves_type_prefix packers return a bytearray with its first
+        TYPE_STRUCT.size bytes left free, the type is packed into them
+        instead of copying the packet behind a new prefix"""
+        assert id not in self.handlers, f"Handler for id {id} already exists."
+        self.handlers[id] = (packer, unpacker)
+
+        if reserves_type_prefix:
+            type_pack_into = TYPE_STRUCT.pack_into
+            def prefixed_packer(*args) -> bytearray:
+                result = packer(*args)
+                type_pack_into(result, 0, id)
+                return result
+            self.packers[id] = prefixed_packer
         else:
-            # Custom packer
-            packer, _ = handler
-            body = packer(*event.args)
+            type_prefix = TYPE_STRUCT.pack(id)
+            self.packers[id] = lambda *args: type_prefix+packer(*args)
+        # pass data after event type, without copying it
+        self.unpackers[id] = lambda data: unpacker(memoryview(data)[TYPE_STRUCT.size:])
 
-        return struct.pack('<H', event.type) + body
+    def pack(self, event: Event) -> bytes:
+        packer = self.packers.get(event.type)
+        if packer is None:
+            raise ValueError(f"No handler for event type {event.type}")
+        return packer(*event.args)
 
     def unpack(self, data: bytes) -> Event:
-        type_ = struct.unpack_from('<H', data, 0)[0]
-        if type_ not in self.handlers:
+        type_ = TYPE_STRUCT.unpack_from(data, 0)[0]
+        unpacker = self.unpackers.get(type_)
+        if unpacker is None:
             raise ValueError(f"No handler for event type {type_}")
-        handler = self.handlers[type_]
-
-        if isinstance(handler[0], str) or handler[0] is None:
-            format, _, postprocess = handler
-            unpacked_args = struct.unpack(format, data[2:]) if format else ()
-            unpacked_args = unpacked_args if postprocess is None else postprocess(*unpacked_args)
-        else:
-            # Custom unpacker
-            _, unpacker = handler
-            unpacked_args = unpacker(data[2:]) # pass data after event type
-
-        return Event(type_, *unpacked_args)
+        return Event(type_, *unpacker(data))
+    
+    def unpack_lazy(self, data: Union[bytes, memoryview]) -> Event:
+        """unpack only the event type, args are decoded on first access.
+        data must stay valid (and unchanged) until then, fixed size
+        packets are length checked here, other decode errors are raised
+        when args is accessed"""
+        type_ = TYPE_STRUCT.unpack_from(data, 0)[0]
+        unpacker = self.unpackers.get(type_)
+        if unpacker is None:
+            raise ValueError(f"No handler for event type {type_}")
+        size = self.sizes.get(type_)
+        if size is not None and len(data) != size:
+            raise struct.error(f"unpack requires a buffer of {size} bytes")
+        return Event.lazy(type_, data, unpacker)
 
 def get_default_hybrid_packet_handler() -> PacketHandler:
     packet_handler = PacketHandler()
 
-    packet_handler.add_handler(1, '<H')  # init_tcp   (client_id)
-    packet_handler.add_handler(2, '<H')  # init_udp   (client_id)
-    packet_handler.add_handler(3)        # init_final ()
-    packet_handler.add_handler(4, '<?')  # rtt_ping   (return?)
+    packet_handler.add_handler(1, '<HB') # init_tcp     (client_id, framing)
+    packet_handler.add_handler(2, '<H')  # init_udp     (client_id)
+    packet_handler.add_handler(3)        # init_final   ()
+    packet_handler.add_handler(4, '<?')  # rtt_ping     (return?)
+    packet_handler.add_handler(5, '<B')  # init_framing (framing)
     
     return packet_handler
 
@@ -183,6 +519,8 @@ class TCPBase(object):
     def __init__(self, connection: socket.socket, packet_handler: PacketHandler) -> None:
         self.connection = connection
         self.packet_handler = packet_handler
+        self.frame_buffers: Dict[socket.socket, FrameBuffer] = {}
+        self.framings: Dict[socket.socket, int] = {}
 
     def is_valid_socket(self, socket_) -> socket.socket:
         """if socket_ is a socket.socket instance the function returns it,
@@ -207,23 +545,41 @@ class TCPBase(object):
         """receive a bytes payload of the provided buffer size"""
         return self.recv_bytes_from(buffersize, self.connection)
 
+    def get_framing(self, connection: socket.socket) -> int:
+        """get the framing mode used when sending to a connection"""
+        return self.framings.get(connection, Framing.LEGACY)
+
+    def set_framing(self, framing: int, connection: socket.socket = None):
+        """set the framing mode used when sending to a connection"""
+        self.framings[self.is_valid_socket(connection)] = framing
+
     def send_with_header(self, data: bytes, send_socket: socket.socket = None):
         """send data with a header"""
         use_socket = self.is_valid_socket(send_socket)
-        bytes = Utility.get_header(data, Constants.HEADER_SIZE)+data
+        bytes = Utility.get_frame_header(data, self.get_framing(use_socket))+data
         use_socket.send(bytes)
 
-    def recv_with_header(self, recv_socket: socket.socket = None):
-        """receive data with a header"""
+    def get_frame_buffer(self, connection: socket.socket) -> "FrameBuffer":
+        """get (or create) the receive buffer owned by a connection"""
+        frame_buffer = self.frame_buffers.get(connection)
+        if frame_buffer is None:
+            frame_buffer = FrameBuffer()
+            self.frame_buffers[connection] = frame_buffer
+        return frame_buffer
+
+    def discard_frame_buffer(self, connection: socket.socket):
+        """forget the receive buffer and framing of a closed connection"""
+        self.frame_buffers.pop(connection, None)
+        self.framings.pop(connection, None)
+
+    def recv_frames(self, recv_socket: socket.socket = None) -> List[bytes]:
+        """read whatever is available from the socket into its receive
+        buffer and return every complete frame, partial frames are kept
+        in the buffer until the rest of their bytes arrive"""
         use_socket = self.is_valid_socket(recv_socket)
-        header_recv = use_socket.recv(Constants.HEADER_SIZE)
-        if not header_recv:
-            raise ConnException(
-                "header received was empty in recv_with_header() call",
-                critical=True)
-        byte_count = int(header_recv.decode())
-        data_recv = use_socket.recv(byte_count)
-        return data_recv
+        frame_buffer = self.get_frame_buffer(use_socket)
+        frame_buffer.recv_from(use_socket)
+        return frame_buffer.pop_frames()
 
     def send_event(self, event: Event = None, send_socket: socket.socket = None):
         """send an event using send_socket"""
@@ -231,13 +587,12 @@ class TCPBase(object):
         bytes = self.packet_handler.pack(event)
         return self.send_with_header(bytes, use_socket)
 
-    def recv_event(self, recv_socket: socket.socket = None) -> Event:
-        """attempt to receive and return an event object, if the object
-        received is not an event object, the function returns None"""
+    def recv_events(self, recv_socket: socket.socket = None) -> List[Event]:
+        """receive and return every complete event currently
+        available on recv_socket"""
         use_socket = self.is_valid_socket(recv_socket)
-        bytes = self.recv_with_header(use_socket)
-        event = self.packet_handler.unpack(bytes)
-        return event
+        unpack = self.packet_handler.unpack
+        return [unpack(frame) for frame in self.recv_frames(use_socket)]
 
 
 class TCPServer(TCPBase):
@@ -290,10 +645,7 @@ class TCPClient(TCPBase):
 
         try:
             while True:
-                new_event = self.recv_event()
-                if new_event is None:
-                    return new_events, False
-                new_events.append(new_event)
+                new_events.extend(self.recv_events())
 
         except ConnectionResetError as e:
             logger.debug(f"connection reset error in get_new_events() {e}")
@@ -318,14 +670,42 @@ class TCPClient(TCPBase):
 
 
 class TCPSystem(object):
-    """a whole server-client system network"""
+    """a whole server-client system network
+
+    sockets are registered with a selectors.DefaultSelector (epoll on linux)
+    as they connect and disconnect, so a pump only touches the connections
+    which have something to do and is not limited to select()'s 1024 fds
+
+    sending never touches the socket, frames are queued per connection and
+    written by flush() (also run by every pump) with one gather write each.
+    a client whose queue stays above high_water_mark bytes for longer than
+    high_water_timeout seconds is disconnected"""
 
-    def __init__(self, server: TCPServer) -> None:
+    def __init__(
+            self,
+            server: TCPServer,
+            high_water_mark: int = 4*1024*1024,
+            high_water_timeout: float = 5.0) -> None:
         self.server = server
-        self.server.listen(5)
-        self.connections_list = [self.server.connection]
+        self.server.listen(128)
+        self.server.connection.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server.connection, selectors.EVENT_READ)
         self.clients = {}
+        self.outbound_queues: Dict[socket.socket, OutboundQueue] = {}
+        # connections with frames queued since the last flush
+        self.dirty_connections: Set[socket.socket] = set()
+        # connections waiting for the socket to become writable
+        self.backlogged_connections: Set[socket.socket] = set()
+        self.high_water_mark = high_water_mark
+        self.high_water_timeout = high_water_timeout
+        self.high_water_disconnects = 0
+        # connections which failed a read or write, reported and removed by
+        # the end of the pump
+        self.failed_connections: Set[socket.socket] = set()
         self.timeout = 0.0
+        # upper bound of reads from one connection per pump
+        self.max_reads_per_pump = 16
         self.packet_handler = server.packet_handler
 
     def pump(self) -> Tuple[List[Tuple], List[Event], List[Tuple]]:
@@ -337,59 +717,158 @@ class TCPSystem(object):
          - new_clients:list
          - new_events:list
          - disconnected_clients:list"""
-        
-        conn_list = self.connections_list
-        read_connections, _, exception_connections = select.select(
-            conn_list, [], conn_list, self.timeout)
 
         new_clients = []
         new_events = []
         disconnected_clients = []
+        failed_connections = self.failed_connections
 
-        for notified_connection in read_connections:
-            if notified_connection == self.server.connection:
-                client_connection, client_address = self.server.accept_connection()
-                self.connections_list.append(client_connection)
-                self.clients[client_connection] = client_address
-                new_clients.append((client_connection, client_address))
+        for key, mask in self.selector.select(self.timeout):
+            notified_connection = key.fileobj
+            if notified_connection is self.server.connection:
+                new_clients.extend(self.accept_connections())
+                continue
 
-            else:
-                try:
-                    event = self.server.recv_event(notified_connection)
-                except ConnectionResetError as e:
-                    event = None
-                    exception_connections.append(notified_connection)
-                except ValueError as e:
-                    event = None
-                    exception_connections.append(notified_connection)
-                except ConnException as e:
-                    event = None
-                    exception_connections.append(notified_connection)
-                if event is not None:
+            if mask & selectors.EVENT_WRITE:
+                self.flush_connection(notified_connection)
+
+            if mask & selectors.EVENT_READ:
+                for event in self.recv_events_from(notified_connection):
                     event.from_connection = notified_connection
                     new_events.append(event)
 
-        for notified_connection in exception_connections:
+        self.flush()
+        self.check_high_water()
+
+        for notified_connection in failed_connections:
+            if notified_connection not in self.clients:
+                continue
             disconnected_clients.append(
                 (notified_connection, self.clients[notified_connection]))
             self.remove_client(notified_connection)
+        failed_connections.clear()
 
         return new_clients, new_events, disconnected_clients
 
+    def accept_connections(self) -> List[Tuple]:
+        """accept every waiting connection without blocking"""
+        new_clients = []
+        while True:
+            try:
+                client_connection, client_address = self.server.accept_connection()
+            except BlockingIOError:
+                break
+            except OSError as e:
+                # e.g. out of file descriptors, try again next pump
+                logger.warning(f"accept error in accept_connections() {e}")
+                break
+            client_connection.setblocking(False)
+            self.selector.register(client_connection, selectors.EVENT_READ)
+            self.clients[client_connection] = client_address
+            self.outbound_queues[client_connection] = OutboundQueue()
+            new_clients.append((client_connection, client_address))
+        return new_clients
+
+    def recv_events_from(self, connection: socket.socket) -> List[Event]:
+        """read every available event from a connection, stops after
+        max_reads_per_pump reads so one client cannot starve the others.
+
+        a connection which is closed or sends something that cannot be
+        decoded is added to failed_connections, the events read from it
+        before that are still returned"""
+        events = []
+        unpack = self.packet_handler.unpack
+        try:
+            for _ in range(self.max_reads_per_pump):
+                for frame in self.server.recv_frames(connection):
+                    events.append(unpack(frame))
+        except BlockingIOError:
+            pass
+        except (OSError, ValueError, struct.error, ConnException) as e:
+            logger.debug(f"read error in recv_events_from() {e}")
+            self.failed_connections.add(connection)
+        return events
+
     def remove_client(self, client_connection):
         """remove a client from the server"""
-        self.connections_list.remove(client_connection)
+        self.selector.unregister(client_connection)
         del self.clients[client_connection]
+        self.outbound_queues.pop(client_connection, None)
+        self.dirty_connections.discard(client_connection)
+        self.backlogged_connections.discard(client_connection)
+        self.server.discard_frame_buffer(client_connection)
+        client_connection.close()
+
+    def flush_connection(self, connection: socket.socket):
+        """write as much queued output as the connection takes, the
+        selector watches for writability while anything is left"""
+        queue = self.outbound_queues.get(connection)
+        if queue is None or connection in self.failed_connections:
+            return
+        try:
+            queue.flush(connection)
+        except OSError as e:
+            logger.debug(f"send error in flush_connection() {e}")
+            self.failed_connections.add(connection)
+            return
+        backlogged = queue.queued_bytes > 0
+        if backlogged != queue.write_registered:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE if backlogged else selectors.EVENT_READ
+            self.selector.modify(connection, events)
+            queue.write_registered = backlogged
+            if backlogged:
+                self.backlogged_connections.add(connection)
+            else:
+                self.backlogged_connections.discard(connection)
+
+    def flush(self):
+        """write the output queued since the last flush, never blocks"""
+        for connection in self.dirty_connections:
+            self.flush_connection(connection)
+        self.dirty_connections.clear()
+
+    def check_high_water(self):
+        """mark clients whose queue stayed above the high water mark for
+        too long as failed, they are disconnected by the pump"""
+        now = time.monotonic()
+        for connection in self.backlogged_connections:
+            queue = self.outbound_queues[connection]
+            if queue.queued_bytes <= self.high_water_mark:
+                queue.above_high_water_since = None
+            elif queue.above_high_water_since is None:
+                queue.above_high_water_since = now
+            elif now - queue.above_high_water_since > self.high_water_timeout:
+                logger.warning(
+                    f"disconnecting {self.clients[connection]}, "
+                    f"{queue.queued_bytes} bytes queued for {self.high_water_timeout}s")
+                self.high_water_disconnects += 1
+                self.failed_connections.add(connection)
+
+    def get_backpressure_stats(self) -> Dict[str, int]:
+        """outbound queue metrics across every client"""
+        queued = [queue.queued_bytes for queue in self.outbound_queues.values()]
+        return {
+            'queued_bytes': sum(queued),
+            'max_queued_bytes': max(queued, default=0),
+            'backlogged_connections': len(self.backlogged_connections),
+            'bytes_sent': sum(queue.bytes_sent for queue in self.outbound_queues.values()),
+            'partial_writes': sum(queue.partial_writes for queue in self.outbound_queues.values()),
+            'high_water_disconnects': self.high_water_disconnects,
+        }
 
     def send_bytes_to(self, connection: socket.socket, data: bytes):
-        """send byte data to a client"""
-        connection.send(data)
+        """queue byte data for a client, it is written by the next flush"""
+        queue = self.outbound_queues.get(connection)
+        if queue is None or connection in self.failed_connections:
+            return
+        queue.append(data)
+        self.dirty_connections.add(connection)
 
     def send_event_to(self, connection: socket.socket, event: Event):
         """send an event to a client"""
         try:
             data = self.packet_handler.pack(event)
-            header = Utility.get_header(data)
+            header = Utility.get_frame_header(data, self.server.get_framing(connection))
             self.send_bytes_to(connection, header+data)
         except Exception as e:
             raise e
@@ -399,9 +878,14 @@ class TCPSystem(object):
         """send an event to all clients"""
         try:
             data = self.packet_handler.pack(event)
-            header = Utility.get_header(data)
-            full_bytes = header+data
+            # the body is packed once, with one framed copy per framing mode in use
+            full_bytes_by_framing = {}
             for connection in self.clients:
+                framing = self.server.get_framing(connection)
+                full_bytes = full_bytes_by_framing.get(framing)
+                if full_bytes is None:
+                    full_bytes = Utility.get_frame_header(data, framing)+data
+                    full_bytes_by_framing[framing] = full_bytes
                 self.send_bytes_to(connection, full_bytes)
         except Exception as e:
             return False
@@ -409,6 +893,13 @@ class TCPSystem(object):
 
 #region UDP
 
+@dataclass
+class UDPSendStats:
+    datagrams_sent:int=0
+    bytes_sent:int=0
+    # datagrams not sent because the socket buffer was full
+    datagrams_dropped:int=0
+
 class UDPBase(socket.socket):
     """Basic UDP socket wrapper.
     """
@@ -417,9 +908,73 @@ class UDPBase(socket.socket):
         self.settimeout(0)
         self.setblocking(False)
         self.packet_handler = packet_handler
+        self.send_stats = UDPSendStats()
+        # batch fan-out sends into sendmmsg syscalls where the platform has it
+        self.use_sendmmsg = mmsg.AVAILABLE
+        self._multi_sender: Union[None, mmsg.MultiSender] = None
+        # receives go into preallocated buffers, batched with recvmmsg where available
+        self.use_recvmmsg = mmsg.AVAILABLE
+        self._multi_receiver: Union[None, mmsg.MultiReceiver] = None
+        self.recv_buffer = bytearray(Constants.UDP_PACKET_SIZE)
+        self.recv_view = memoryview(self.recv_buffer)
+        self.max_datagrams_per_pump = Constants.UDP_MAX_DATAGRAMS_PER_PUMP
+        # pump returns lazily decoded events for PacketHandler.lazy_types,
+        # see PacketHandler.unpack_lazy
+        self.lazy_events = True
+        self.datagrams_malformed = 0
     
     def _send_bytes(self, packet: bytes, addr: Tuple[str,int]):
         self.sendto(packet, addr)
+        self.send_stats.datagrams_sent += 1
+        self.send_stats.bytes_sent += len(packet)
+    
+    def send_bytes_many(self, packet: bytes, addrs: List[Tuple[str,int]]):
+        """Send the same datagram to several addresses.
+
+        Args:
+            packet (bytes): Datagram payload.
+            addrs (List[Tuple[str,int]]): UDP addresses to send to.
+        """
+        if not addrs: return
+        if self.use_sendmmsg and len(addrs) > 1:
+            if self._multi_sender is None:
+                self._multi_sender = mmsg.MultiSender()
+            sent = self._multi_sender.send(self.fileno(), packet, addrs)
+        else:
+            sent = 0
+            for addr in addrs:
+                try: self.sendto(packet, addr)
+                except BlockingIOError: break
+                sent += 1
+        self.send_stats.datagrams_sent += sent
+        self.send_stats.bytes_sent += sent*len(packet)
+        self.send_stats.datagrams_dropped += len(addrs)-sent
+    
+    def send_event_many(self, event: Event, addrs: List[Tuple[str,int]]):
+        """Send an event to several UDP addresses, the event
+        is packed once no matter how many addresses there are.
+
+        Args:
+            event (Event): Event to send.
+            addrs (List[Tuple[str,int]]): UDP addresses to send to.
+        """
+        self.send_bytes_many(self.packet_handler.pack(event), addrs)
+    
+    def forget_address(self, addr: Tuple[str,int]):
+        """Drop cached state for an address which will not be sent to again."""
+        if self._multi_sender is not None:
+            self._multi_sender.forget_address(addr)
+    
+    def take_send_stats(self) -> UDPSendStats:
+        """Get the send counters collected since the last call and
+        reset them, call once per tick for per tick numbers.
+
+        Returns:
+            UDPSendStats: Datagrams / bytes sent and dropped.
+        """
+        stats = self.send_stats
+        self.send_stats = UDPSendStats()
+        return stats
     
     def _recv_bytes(self, bufsize: int=...) -> Tuple[Union[bytes, None], Union[Tuple[str,int], None]]:
         if bufsize == ...:
@@ -450,18 +1005,55 @@ class UDPBase(socket.socket):
         event = self.packet_handler.unpack(bytes)
         return event, addr
     
+    def _unpack_datagram(self, data: memoryview, addr: Tuple[str,int]) -> Union[Event, None]:
+        packet_handler = self.packet_handler
+        try:
+            if self.lazy_events and TYPE_STRUCT.unpack_from(data, 0)[0] in packet_handler.lazy_types:
+                # length checked fixed size packets, only their postprocess is
+                # deferred. the receive buffers are reused, so the (small)
+                # packet is copied out
+                return packet_handler.unpack_lazy(bytes(data))
+            # everything else is decoded straight from the receive buffer, here,
+            # so a malformed packet is dropped instead of raising from Event.args
+            return packet_handler.unpack(data)
+        except (ValueError, struct.error) as e:
+            # one bad datagram should not take the whole pump down with it
+            self.datagrams_malformed += 1
+            logger.debug(f"Dropped malformed datagram from {addr}: {e}")
+            return None
+    
     def pump(self) -> List[Tuple[Event, Tuple[str,int]]]:
         """Retrieve a list of new events and the address(es)
-        said events were sent by.
+        said events were sent by. At most max_datagrams_per_pump
+        datagrams are read, anything left stays queued in the socket.
 
         Returns:
             List[Tuple[Event, Tuple[str,int]]]: List of (Event, address) pairs.
         """
         events = []
-        while True:
-            event, addr = self.recv_event()
-            if event is None: break
-            events.append((event, addr))
+        budget = self.max_datagrams_per_pump
+        if self.use_recvmmsg:
+            if self._multi_receiver is None:
+                self._multi_receiver = mmsg.MultiReceiver(Constants.UDP_RECV_BATCH, Constants.UDP_PACKET_SIZE)
+            receiver = self._multi_receiver
+            while budget > 0:
+                count = receiver.recv(self.fileno(), budget)
+                for i in range(count):
+                    data, addr = receiver.datagram(i)
+                    event = self._unpack_datagram(data, addr)
+                    if event is not None:
+                        events.append((event, addr))
+                budget -= count
+                if count < receiver.batch_size: break # drained
+        else:
+            view = self.recv_view
+            while budget > 0:
+                try: size, addr = self.recvfrom_into(view)
+                except BlockingIOError: break
+                event = self._unpack_datagram(view[:size], addr)
+                if event is not None:
+                    events.append((event, addr))
+                budget -= 1
         return events
 
 class UDPServer(UDPBase):
@@ -503,6 +1095,7 @@ class HEvents:
     INIT_TCP = 1
     INIT_UDP = 2
     INIT_FINAL = 3
+    INIT_FRAMING = 5
 
 class HSystemClient():
     def __init__(
@@ -547,7 +1140,8 @@ class HSystem():
             port_tcp:int,
             port_udp:int,
             client_model,
-            packet_handler: PacketHandler):
+            packet_handler: PacketHandler,
+            framing: int = Framing.LATEST):
         self.addr_tcp = (ip, port_tcp)
         self.addr_udp = (ip, port_udp)
         self.client_model = client_model
@@ -558,6 +1152,7 @@ class HSystem():
         self.cid_by_udp: Dict[Tuple[str, int], int] = {}
         self.cid_by_conn: Dict[socket.socket, int] = {}
         self.packet_handler = packet_handler
+        self.framing = framing
     
     def send_event_tcp(self, event:Event, conn:socket.socket=None):
         """Send an event to a client via TCP
@@ -572,14 +1167,21 @@ class HSystem():
         else:
             self.system_tcp.send_event_to(conn, event)
     
+    def flush(self):
+        """write every TCP event queued by send_event_tcp"""
+        self.system_tcp.flush()
+    
     def send_event_udp(self, event: Event, addr: Tuple[str, int]=None):
         if addr is None:
-            # send to all
-            for addr in self.cid_by_udp.keys():
-                self.server_udp.send_event(event, addr)
+            # send to all, packed once and fanned out
+            self.server_udp.send_event_many(event, list(self.cid_by_udp.keys()))
         else:
             self.server_udp.send_event(event, addr)
     
+    def take_udp_send_stats(self) -> UDPSendStats:
+        """UDP datagrams / bytes sent since the last call"""
+        return self.server_udp.take_send_stats()
+    
     def get_client_model(self, cid: int) -> Union[any, None]:
         """Gets a client model from a provided cid.
 
@@ -615,7 +1217,9 @@ class HSystem():
                 client_model=self.client_model)
             self.clients[cid] = client
             self.cid_by_conn[conn] = cid
-            self.send_event_tcp(Event(HEvents.INIT_TCP, cid), conn)
+            # the highest framing mode the server supports is offered,
+            # the client answers with HEvents.INIT_FRAMING if it can use it
+            self.send_event_tcp(Event(HEvents.INIT_TCP, cid, self.framing), conn)
             print(f"HS:INIT Client handshake begun... {client.addr_tcp} -> Assigned CID: {cid}")
 
         for conn, addr in d_clients_tcp:
@@ -629,6 +1233,7 @@ class HSystem():
                 self.cid_by_conn.pop(conn)
             if client.addr_udp in self.cid_by_udp:
                 self.cid_by_udp.pop(client.addr_udp)
+                self.server_udp.forget_address(client.addr_udp)
             if cid in self.clients:
                 self.clients.pop(cid)
             result.disconnected_clients.append(client)
@@ -638,6 +1243,10 @@ class HSystem():
             cid = self.cid_by_conn.get(conn, None)
             client = self.clients.get(cid, None)
             if client is None: continue
+            if event.type == HEvents.INIT_FRAMING:
+                framing = min(event.args[0], self.framing)
+                self.server_tcp.set_framing(framing, conn)
+                continue
             result.events_tcp.append((client, event),)
 
         udp_packets = self.server_udp.pump()
@@ -665,7 +1274,8 @@ class HClient():
             server_ip:str,
             server_port_tcp:int,
             server_port_udp:int,
-            packet_handler: PacketHandler):
+            packet_handler: PacketHandler,
+            framing: int = Framing.LATEST):
         self.ready = False
         self.connection_state = "A"
         self.server_addr_tcp = (server_ip, server_port_tcp)
@@ -674,6 +1284,7 @@ class HClient():
         self.client_udp = UDPClient(self.server_addr_udp, packet_handler)
         self.cid:str = None
         self.packet_handler = packet_handler
+        self.framing = framing
     
     def set_server_ip(
             self,
@@ -707,7 +1318,13 @@ class HClient():
             result.connected = False
             for event in events_tcp:
                 if event.type == HEvents.INIT_TCP:
-                    self.cid = event.args[0]
+                    self.cid, offered_framing = event.args
+                    framing = min(offered_framing, self.framing)
+                    if framing != Framing.LEGACY:
+                        # the server reads both framing modes, so the
+                        # switch can happen straight after this event
+                        self.client_tcp.send_event(Event(HEvents.INIT_FRAMING, framing))
+                        self.client_tcp.set_framing(framing)
                     # send a UDP packet
                     # to the server with the client cid
                     # so that the server can create a reference
@@ -0,0 +1,399 @@
+"""
+
+This network_async.py file is an asyncio variant of the
+UDP + TCP hybrid client-server connections in network.py.
+
+It speaks the same protocol (PacketHandler, framing and the
+INIT_TCP / INIT_UDP / INIT_FINAL handshake), so an AsyncHSystem
+can serve HClient instances and an AsyncHClient can join an HSystem.
+Nothing is busy polled, a server awaiting its next events idles at
+zero CPU and can share its event loop with other async services.
+
+async def main():
+    system = AsyncHSystem(ip, 9183, 9184, ClientModel, packet_handler)
+    await system.start()
+    async for result in system:
+        for client, event in result.events_tcp:
+            await system.send_event_tcp(event, client.conn)
+
+"""
+
+import asyncio
+import random
+import struct
+from typing import Callable, Dict, List, Tuple, Union
+
+from .network import (
+    Event,
+    FrameBuffer,
+    Framing,
+    HClientPumpResult,
+    HEvents,
+    HSystemClient,
+    HSystemPumpResult,
+    PacketHandler,
+    Utility,
+    logger)
+
+
+class TCPStreamProtocol(asyncio.Protocol):
+    """Framed TCP stream, every complete event received
+    is handed to on_event(protocol, event)."""
+
+    def __init__(
+            self,
+            packet_handler: PacketHandler,
+            on_event: Callable[["TCPStreamProtocol", Event], None],
+            on_connection_made: Callable[["TCPStreamProtocol"], None] = None,
+            on_connection_lost: Callable[["TCPStreamProtocol"], None] = None):
+        self.packet_handler = packet_handler
+        self.on_event = on_event
+        self.on_connection_made = on_connection_made
+        self.on_connection_lost = on_connection_lost
+        self.frame_buffer = FrameBuffer()
+        self.framing = Framing.LEGACY
+        self.transport: Union[None, asyncio.Transport] = None
+        self.peername: Union[None, Tuple[str, int]] = None
+        self._paused = False
+        self._drain_waiters: List[asyncio.Future] = []
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.peername = transport.get_extra_info('peername')
+        if self.on_connection_made is not None:
+            self.on_connection_made(self)
+
+    def data_received(self, data: bytes):
+        self.frame_buffer.feed(data)
+        try:
+            for frame in self.frame_buffer.pop_frames():
+                self.on_event(self, self.packet_handler.unpack(frame))
+        except (ValueError, struct.error) as e:
+            logger.debug(f"malformed frame in data_received() {e}")
+            self.transport.close()
+
+    def connection_lost(self, exc: Union[None, Exception]):
+        self._wake_drain_waiters()
+        if self.on_connection_lost is not None:
+            self.on_connection_lost(self)
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake_drain_waiters()
+
+    def _wake_drain_waiters(self):
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._drain_waiters.clear()
+
+    def write_frame(self, data: bytes):
+        """write an already packed event with this connection's framing"""
+        if self.transport is None or self.transport.is_closing():
+            return
+        self.transport.writelines((Utility.get_frame_header(data, self.framing), data))
+
+    def send_event(self, event: Event):
+        self.write_frame(self.packet_handler.pack(event))
+
+    async def drain(self):
+        """wait until the transport's write buffer is below its high water mark"""
+        if not self._paused or self.transport is None or self.transport.is_closing():
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+
+class UDPEventProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint, every event received is
+    handed to on_event(event, address)."""
+
+    def __init__(
+            self,
+            packet_handler: PacketHandler,
+            on_event: Callable[[Event, Tuple[str, int]], None]):
+        self.packet_handler = packet_handler
+        self.on_event = on_event
+        self.transport: Union[None, asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        try:
+            event = self.packet_handler.unpack(data)
+        except (ValueError, struct.error) as e:
+            logger.debug(f"malformed datagram in datagram_received() {e}")
+            return
+        self.on_event(event, addr)
+
+    def send_bytes(self, data: bytes, addr: Tuple[str, int] = None):
+        if self.transport is None or self.transport.is_closing():
+            return
+        self.transport.sendto(data, addr)
+
+    def send_event(self, event: Event, addr: Tuple[str, int] = None):
+        self.send_bytes(self.packet_handler.pack(event), addr)
+
+
+class AsyncHSystem():
+    def __init__(
+            self,
+            ip:str,
+            port_tcp:int,
+            port_udp:int,
+            client_model,
+            packet_handler: PacketHandler,
+            framing: int = Framing.LATEST):
+        """asyncio counterpart of HSystem. Iterate over it (or await pump())
+        to receive HSystemPumpResult batches, client.conn is the client's
+        TCPStreamProtocol."""
+        self.addr_tcp = (ip, port_tcp)
+        self.addr_udp = (ip, port_udp)
+        self.client_model = client_model
+        self.packet_handler = packet_handler
+        self.framing = framing
+        self.clients: Dict[int, HSystemClient] = {}
+        self.cid_by_udp: Dict[Tuple[str, int], int] = {}
+        self.cid_by_conn: Dict[TCPStreamProtocol, int] = {}
+        self.server_tcp: Union[None, asyncio.AbstractServer] = None
+        self.protocol_udp: Union[None, UDPEventProtocol] = None
+        self._result: Union[None, HSystemPumpResult] = None
+        self._wakeup = asyncio.Event()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.server_tcp = await loop.create_server(
+            lambda: TCPStreamProtocol(
+                self.packet_handler,
+                self._on_tcp_event,
+                self._on_tcp_connection_made,
+                self._on_tcp_connection_lost),
+            *self.addr_tcp)
+        _, self.protocol_udp = await loop.create_datagram_endpoint(
+            lambda: UDPEventProtocol(self.packet_handler, self._on_udp_event),
+            local_addr=self.addr_udp)
+
+    async def close(self):
+        for client in list(self.clients.values()):
+            client.conn.transport.close()
+        if self.server_tcp is not None:
+            self.server_tcp.close()
+            await self.server_tcp.wait_closed()
+        if self.protocol_udp is not None:
+            self.protocol_udp.transport.close()
+
+    def _get_result(self) -> HSystemPumpResult:
+        if self._result is None:
+            self._result = HSystemPumpResult([], [], [], [])
+            self._wakeup.set()
+        return self._result
+
+    def _on_tcp_connection_made(self, protocol: TCPStreamProtocol):
+        # same handshake as HSystem.pump, see there
+        cid = -1
+        while cid == -1 or cid in self.clients:
+            cid = random.randint(0, 65535)
+        client = HSystemClient(
+            conn=protocol,
+            cid=cid,
+            addr_tcp=protocol.peername,
+            client_model=self.client_model)
+        self.clients[cid] = client
+        self.cid_by_conn[protocol] = cid
+        protocol.send_event(Event(HEvents.INIT_TCP, cid, self.framing))
+
+    def _on_tcp_connection_lost(self, protocol: TCPStreamProtocol):
+        cid = self.cid_by_conn.pop(protocol, None)
+        client = self.clients.pop(cid, None)
+        if client is None: return
+        self.cid_by_udp.pop(client.addr_udp, None)
+        self._get_result().disconnected_clients.append(client)
+
+    def _on_tcp_event(self, protocol: TCPStreamProtocol, event: Event):
+        client = self.clients.get(self.cid_by_conn.get(protocol))
+        if client is None: return
+        if event.type == HEvents.INIT_FRAMING:
+            protocol.framing = min(event.args[0], self.framing)
+            return
+        event.from_connection = protocol
+        self._get_result().events_tcp.append((client, event))
+
+    def _on_udp_event(self, event: Event, addr: Tuple[str, int]):
+        if event.type == HEvents.INIT_UDP:
+            client = self.clients.get(event.args[0])
+            if client is None: return
+            self.cid_by_udp[addr] = client.cid
+            client.addr_udp = addr
+            # client is now ready
+            client.conn.send_event(Event(HEvents.INIT_FINAL))
+            self._get_result().new_clients.append(client)
+            return
+        client = self.clients.get(self.cid_by_udp.get(addr))
+        if client is None: return
+        self._get_result().events_udp.append((client, event))
+
+    async def pump(self, timeout: float = None) -> HSystemPumpResult:
+        """wait until something happened (or timeout seconds passed)
+        and return everything that happened since the last call"""
+        if self._result is None:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wakeup.clear()
+        result = self._result or HSystemPumpResult([], [], [], [])
+        self._result = None
+        return result
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> HSystemPumpResult:
+        return await self.pump()
+
+    async def send_event_tcp(self, event: Event, conn: TCPStreamProtocol = None):
+        """send an event to one client (or every client), waits
+        while the receiving transports are over their buffer limit"""
+        connections = [client.conn for client in self.clients.values()] if conn is None else [conn]
+        data = self.packet_handler.pack(event)
+        for connection in connections:
+            connection.write_frame(data)
+        for connection in connections:
+            await connection.drain()
+
+    async def send_event_udp(self, event: Event, addr: Tuple[str, int] = None):
+        data = self.packet_handler.pack(event)
+        addresses = list(self.cid_by_udp.keys()) if addr is None else [addr]
+        for address in addresses:
+            self.protocol_udp.send_bytes(data, address)
+
+
+class AsyncHClient():
+    def __init__(
+            self,
+            server_ip:str,
+            server_port_tcp:int,
+            server_port_udp:int,
+            packet_handler: PacketHandler,
+            framing: int = Framing.LATEST):
+        """asyncio counterpart of HClient. await connect(), then iterate
+        over it (or await pump()) to receive HClientPumpResult batches."""
+        self.ready = False
+        self.connected = False
+        self.server_addr_tcp = (server_ip, server_port_tcp)
+        self.server_addr_udp = (server_ip, server_port_udp)
+        self.packet_handler = packet_handler
+        self.framing = framing
+        self.cid: int = None
+        self.protocol_tcp: Union[None, TCPStreamProtocol] = None
+        self.protocol_udp: Union[None, UDPEventProtocol] = None
+        self._result: Union[None, HClientPumpResult] = None
+        self._wakeup = asyncio.Event()
+        self._init_tcp: Union[None, asyncio.Future] = None
+        self._init_final: Union[None, asyncio.Future] = None
+
+    async def connect(self, retries: int = 5, retry_interval: float = 1.0) -> bool:
+        """connect and run the hybrid handshake, returns whether it succeeded"""
+        loop = asyncio.get_running_loop()
+        self._init_tcp = loop.create_future()
+        self._init_final = loop.create_future()
+        try:
+            _, self.protocol_tcp = await loop.create_connection(
+                lambda: TCPStreamProtocol(
+                    self.packet_handler,
+                    self._on_tcp_event,
+                    on_connection_lost=self._on_tcp_connection_lost),
+                *self.server_addr_tcp)
+        except OSError as e:
+            logger.debug(f"connection error in connect() {e}")
+            return False
+        self.connected = True
+        _, self.protocol_udp = await loop.create_datagram_endpoint(
+            lambda: UDPEventProtocol(self.packet_handler, self._on_udp_event),
+            remote_addr=self.server_addr_udp)
+
+        try:
+            await asyncio.wait_for(self._init_tcp, retries*retry_interval)
+        except asyncio.TimeoutError:
+            return False
+        # the INIT_UDP datagram may get lost, resend it until INIT_FINAL arrives
+        for retries_left in range(retries-1, -1, -1):
+            self.protocol_udp.send_event(Event(HEvents.INIT_UDP, self.cid))
+            try:
+                await asyncio.wait_for(asyncio.shield(self._init_final), retry_interval)
+                self.ready = True
+                return True
+            except asyncio.TimeoutError:
+                if retries_left:
+                    print(f"HS:INIT:B Retrying ({retries_left} left)")
+        return False
+
+    async def close(self):
+        if self.protocol_tcp is not None:
+            self.protocol_tcp.transport.close()
+        if self.protocol_udp is not None:
+            self.protocol_udp.transport.close()
+
+    def _get_result(self) -> HClientPumpResult:
+        if self._result is None:
+            self._result = HClientPumpResult([], [], self.connected)
+            self._wakeup.set()
+        return self._result
+
+    def _on_tcp_event(self, protocol: TCPStreamProtocol, event: Event):
+        if not self.ready:
+            if event.type == HEvents.INIT_TCP and not self._init_tcp.done():
+                self.cid, offered_framing = event.args
+                framing = min(offered_framing, self.framing)
+                if framing != Framing.LEGACY:
+                    protocol.send_event(Event(HEvents.INIT_FRAMING, framing))
+                    protocol.framing = framing
+                self._init_tcp.set_result(None)
+                return
+            if event.type == HEvents.INIT_FINAL and not self._init_final.done():
+                self._init_final.set_result(None)
+                return
+        self._get_result().events_tcp.append(event)
+
+    def _on_tcp_connection_lost(self, protocol: TCPStreamProtocol):
+        self.connected = False
+        result = self._get_result()
+        result.connected = False
+        result.connection_status = -1
+
+    def _on_udp_event(self, event: Event, addr: Tuple[str, int]):
+        if not self.ready: return
+        self._get_result().events_udp.append(event)
+
+    async def pump(self, timeout: float = None) -> HClientPumpResult:
+        """wait until something happened (or timeout seconds passed)
+        and return everything that happened since the last call"""
+        if self._result is None:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._wakeup.clear()
+        result = self._result or HClientPumpResult([], [], self.connected)
+        self._result = None
+        return result
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> HClientPumpResult:
+        if not self.connected and self._result is None:
+            raise StopAsyncIteration
+        return await self.pump()
+
+    async def send_event_tcp(self, event: Event):
+        self.protocol_tcp.send_event(event)
+        await self.protocol_tcp.drain()
+
+    async def send_event_udp(self, event: Event):
+        self.protocol_udp.send_event(event)
@@ -1,7 +1,10 @@
+from itertools import repeat
 import math
-from typing import Tuple
+from typing import Dict, Tuple
 import pygame
 
+from .entity_state import np
+
 
 class Particle():
     position: pygame.Vector2
@@ -34,4 +37,119 @@ class Particle():
         return self.lifetime > 0
     
     def draw(self, surface: pygame.Surface):
-        pygame.draw.circle(surface, self.color, self.position, math.ceil(3*self.lifetime/self.lifetime_max))
\ No newline at end of file
+        pygame.draw.circle(surface, self.color, self.position, math.ceil(3*self.lifetime/self.lifetime_max))
+
+
+class ParticleSystem:
+    """Fixed capacity pool of particles stored as arrays.
+
+    Same behaviour as a list of Particle objects, but spawning writes
+    into the next free row, update is a handful of array operations and
+    dead particles are swap-removed (the last live rows fill the holes).
+    Drawing blits cached circle sprites, bucketed by radius. When the
+    pool is full new particles are dropped. Requires numpy.
+    """
+    
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.count = 0
+        self.position = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.acceleration = np.zeros((capacity, 2))
+        self.drag = np.zeros(capacity)
+        self.lifetime = np.zeros(capacity)
+        self.lifetime_max = np.ones(capacity)
+        self.color = np.zeros((capacity, 3), np.uint8)
+        self._arrays = (self.position, self.velocity, self.acceleration,
+                        self.drag, self.lifetime, self.lifetime_max, self.color)
+        self._sprites: Dict[Tuple[int, int, int, int], pygame.Surface] = {}
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def spawn(self,
+              position: pygame.Vector2,
+              velocity: pygame.Vector2,
+              lifetime: float = 1,
+              drag: float = 1,
+              linear_acceleration: pygame.Vector2 = None,
+              color: Tuple[int, int, int] = (255, 255, 255)) -> bool:
+        """add a particle, same arguments as Particle.
+        returns False if the pool is full"""
+        i = self.count
+        if i == self.capacity:
+            return False
+        self.count += 1
+        # scalar writes, assigning whole rows from Vector2s is much slower
+        self.position[i, 0], self.position[i, 1] = position
+        self.velocity[i, 0], self.velocity[i, 1] = velocity
+        if linear_acceleration is None:
+            self.acceleration[i, 0], self.acceleration[i, 1] = 0, 5
+        else:
+            self.acceleration[i, 0], self.acceleration[i, 1] = linear_acceleration
+        self.drag[i] = drag
+        self.lifetime[i] = lifetime
+        self.lifetime_max[i] = lifetime
+        self.color[i, 0], self.color[i, 1], self.color[i, 2] = color
+        return True
+    
+    def remove(self, index: int):
+        """swap-remove a single particle"""
+        last = self.count-1
+        if index != last:
+            for array in self._arrays:
+                array[index] = array[last]
+        self.count = last
+    
+    def update(self, dt: float):
+        n = self.count
+        if n == 0: return
+        lifetime = self.lifetime[:n]
+        lifetime -= dt
+        velocity = self.velocity[:n]
+        self.position[:n] += velocity*dt
+        velocity -= velocity*(self.drag[:n]*dt)[:, None]
+        velocity += self.acceleration[:n]*dt
+        
+        alive = lifetime > 0
+        alive_count = int(np.count_nonzero(alive))
+        if alive_count == n: return
+        # batched swap-remove: dead rows below alive_count are filled
+        # with the live rows from above it
+        holes = np.flatnonzero(~alive[:alive_count])
+        movers = np.flatnonzero(alive[alive_count:]) + alive_count
+        for array in self._arrays:
+            array[holes] = array[movers]
+        self.count = alive_count
+    
+    def _get_sprite(self, radius: int, color: Tuple[int, int, int]) -> pygame.Surface:
+        key = (radius,)+color
+        sprite = self._sprites.get(key)
+        if sprite is None:
+            # colorkeyed sprites blit much faster than per pixel alpha ones
+            sprite = pygame.Surface((radius*2, radius*2))
+            key_color = (255, 0, 255) if color != (255, 0, 255) else (0, 0, 0)
+            sprite.fill(key_color)
+            sprite.set_colorkey(key_color, pygame.RLEACCEL)
+            pygame.draw.circle(sprite, color, (radius, radius), radius)
+            self._sprites[key] = sprite
+        return sprite
+    
+    def draw(self, surface: pygame.Surface):
+        n = self.count
+        if n == 0: return
+        radii = np.ceil(3*self.lifetime[:n]/self.lifetime_max[:n]).astype(np.int64)
+        color = self.color[:n].astype(np.int64)
+        # one bucket per (radius, colour), every bucket is blitted with one sprite
+        codes = (radii << 24) | (color[:, 0] << 16) | (color[:, 1] << 8) | color[:, 2]
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        corners = (self.position[:n][order]-radii[order][:, None]).tolist()
+        starts = np.flatnonzero(np.diff(codes, prepend=-1)).tolist()
+        ends = starts[1:]+[n]
+        blit = getattr(surface, 'fblits', None) or surface.blits # fblits is pygame-ce only
+        for start, end, code in zip(starts, ends, codes[starts].tolist()):
+            radius = code >> 24
+            if radius <= 0: continue
+            sprite = self._get_sprite(radius, ((code >> 16) & 255, (code >> 8) & 255, code & 255))
+            blit(zip(repeat(sprite), corners[start:end]))
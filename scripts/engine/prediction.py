@@ -0,0 +1,137 @@
+from typing import Callable, Iterable, List, Tuple, Union
+
+# (sequence, x, y, boost, dt), see packets.quantize_input
+InputCommand = Tuple[int, float, float, bool, float]
+# (id, x, y, vx, vy, angle, vangle), see Entity.get_phys_state
+PhysState = Tuple
+
+
+class PredictionBuffer:
+    """Client side prediction of the locally controlled entity.
+
+    Every input command is simulated straight away and recorded in a ring
+    buffer together with the state it produced. When the server
+    acknowledges a command with the state it produced there, the
+    prediction for that command is compared against it. On a mismatch
+    the entity is reset to the server's state and every command the
+    server has not processed yet is replayed on top of it.
+    """
+
+    def __init__(self, capacity: int = 256, tolerance: float = 0.01):
+        self.capacity = capacity
+        # largest difference in any state field which is not a mismatch,
+        # the server sends velocity / angles as f32
+        self.tolerance = tolerance
+        self.commands: List[Union[None, InputCommand]] = [None]*capacity
+        self.states: List[Union[None, PhysState]] = [None]*capacity
+        self.sequence = 0 # newest recorded command
+        self.acked_sequence = 0
+        self.corrections = 0
+
+    def next_sequence(self) -> int:
+        return self.sequence+1
+
+    def record(self, command: InputCommand, state: PhysState):
+        """store a command which was just simulated, and its result"""
+        sequence = command[0]
+        self.commands[sequence % self.capacity] = command
+        self.states[sequence % self.capacity] = state
+        self.sequence = sequence
+
+    def unacked(self, limit: int) -> List[InputCommand]:
+        """the newest commands the server has not acknowledged, at most
+        limit of them, oldest first"""
+        first = max(self.acked_sequence+1, self.sequence-limit+1, self.sequence-self.capacity+1)
+        return [self.commands[sequence % self.capacity] for sequence in range(first, self.sequence+1)]
+
+    def _matches(self, predicted: PhysState, server_state: PhysState) -> bool:
+        tolerance = self.tolerance
+        return all(abs(a-b) <= tolerance for a, b in zip(predicted[1:], server_state[1:]))
+
+    def reconcile(
+            self,
+            sequence: int,
+            server_state: PhysState,
+            reset: Callable[[PhysState], None],
+            step: Callable[[InputCommand], PhysState]) -> bool:
+        """handle the server's state after command sequence. reset puts the
+        entity into a state, step simulates one command and returns the new
+        state. returns True if the prediction was corrected"""
+        if sequence <= self.acked_sequence or sequence > self.sequence:
+            return False # old / reordered ack
+        self.acked_sequence = sequence
+        index = sequence % self.capacity
+        command = self.commands[index]
+        predicted = self.states[index]
+        # the ring can have wrapped past a very late ack
+        if command is not None and command[0] == sequence and self._matches(predicted, server_state):
+            return False
+
+        self.corrections += 1
+        reset(server_state)
+        self.states[index] = server_state
+        for replay_sequence in range(max(sequence+1, self.sequence-self.capacity+1), self.sequence+1):
+            replay_index = replay_sequence % self.capacity
+            self.states[replay_index] = step(self.commands[replay_index])
+        return True
+
+
+class InputReceiver:
+    """Server side input commands of one client. Commands arrive several
+    times (every PlayerInput packet repeats the unacknowledged ones), only
+    the ones newer than the last processed command are returned.
+
+    Clients are not trusted with time or sequence numbers. Processed
+    commands spend a simulation time budget which tick refills with the
+    server's own time (up to max_buffered_time of burst), commands past
+    it are left unprocessed, so a client cannot move faster by sending
+    more commands. A sequence can only be max_sequence_gap ahead of the
+    last processed one, plus max_command_rate commands for every second
+    since then, so one bogus huge sequence cannot lock out later input.
+    """
+
+    def __init__(
+            self,
+            max_dt: float = 0.255,
+            max_buffered_time: float = 0.25,
+            max_sequence_gap: int = 64,
+            max_command_rate: float = 1000.0):
+        self.last_sequence = 0
+        self.max_dt = max_dt
+        self.max_buffered_time = max_buffered_time
+        self.max_sequence_gap = max_sequence_gap
+        # commands are at least 1 ms long, see InputQuantization
+        self.max_command_rate = max_command_rate
+        self.time_budget = max_buffered_time
+        # server time since a command was last processed
+        self.idle_time = 0.0
+        # commands which never arrived before a newer one was processed
+        self.skipped = 0
+        # commands too far ahead, or over the time budget
+        self.rejected = 0
+
+    def tick(self, dt: float):
+        """advance by dt of server time, call every simulation tick"""
+        self.time_budget = min(self.time_budget+dt, self.max_buffered_time)
+        self.idle_time += dt
+
+    def receive(self, commands: Iterable[InputCommand]) -> List[InputCommand]:
+        """new commands in order, marked as processed"""
+        new = []
+        limit = self.last_sequence + self.max_sequence_gap + int(self.idle_time*self.max_command_rate)
+        for command in commands:
+            sequence = command[0]
+            if sequence <= self.last_sequence: continue
+            dt = min(command[4], self.max_dt)
+            if sequence > limit or dt > self.time_budget:
+                # commands are consecutive, the rest are rejected as well
+                self.rejected += 1
+                break
+            self.time_budget -= dt
+            self.skipped += sequence-self.last_sequence-1
+            self.last_sequence = sequence
+            self.idle_time = 0.0
+            if command[4] > self.max_dt:
+                command = command[:4] + (self.max_dt,)
+            new.append(command)
+        return new
@@ -0,0 +1,56 @@
+import struct
+from typing import Any, Dict, Tuple
+
+# the change mask of an entity is sent as a u16, record data length as a u8
+MAX_REPLICATED_FIELDS = 16
+MAX_REPLICATED_SIZE = 255
+
+
+class Replicated:
+    """A replicated attribute of an Entity subclass, declared on the class:
+
+        class TankEntity(Entity):
+            hp = Replicated('i', 100)
+
+    format is a struct format for one value, values it cannot pack raise
+    struct.error on assignment. Assigning a different value sets the
+    field's bit in entity.dirty_attributes, the server sends each client
+    the changed fields of the dirty entities in its scope in one
+    EntityUpdateAttr per tick (see World.take_attribute_updates). Fields
+    get their bit in declaration order, base class fields first.
+    """
+
+    def __init__(self, format: str, default: Any = 0):
+        self.struct = struct.Struct('<'+format)
+        self.default = default
+        self.name: str = None
+        self.bit = 0
+
+    def __set_name__(self, owner: type, name: str):
+        self.name = name
+
+    def __get__(self, entity, owner: type = None):
+        if entity is None: return self
+        return entity.__dict__.get(self.name, self.default)
+
+    def __set__(self, entity, value: Any):
+        values: Dict[str, Any] = entity.__dict__
+        if values.get(self.name, self.default) == value: return
+        # fail here rather than when the server packs it
+        self.struct.pack(value)
+        values[self.name] = value
+        entity.mark_dirty(self.bit)
+
+
+def collect_replicated_fields(cls: type) -> Tuple[Replicated, ...]:
+    """the Replicated fields of cls in bit order, assigning bits to new ones"""
+    fields = []
+    for klass in reversed(cls.__mro__):
+        for value in vars(klass).values():
+            if isinstance(value, Replicated) and value not in fields:
+                fields.append(value)
+    assert len(fields) <= MAX_REPLICATED_FIELDS, f"{cls.__name__} has more than {MAX_REPLICATED_FIELDS} replicated fields"
+    assert sum(field.struct.size for field in fields) <= MAX_REPLICATED_SIZE, f"{cls.__name__} replicated fields are too large"
+    for i, field in enumerate(fields):
+        field.bit = 1 << i
+    return tuple(fields)
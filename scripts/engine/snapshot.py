@@ -1,8 +1,462 @@
-from typing import List, Tuple
+import math
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+from .entity_state import np
 
 
 class Snapshot:
-    def __init__(self, reference_time: float, time: float, entity_states: List[Tuple]):
+    """Entity states at one point in time, as (id, x, y, vx, vy, angle, vangle)
+    tuples or as arrays: ids and an Nx6 matrix of the other fields."""
+
+    def __init__(self, reference_time: float, time: float, entity_states: List[Tuple] = None, ids=None, states=None):
         self.reference_time = reference_time
         self.time = time
-        self.entity_states = entity_states
\ No newline at end of file
+        self._entity_states = entity_states
+        self.ids = ids
+        self.states = states
+        # entity id -> row in entity_states, filled in by SnapshotBuffer.push
+        self.index: Union[None, Dict[int, int]] = None
+
+    @property
+    def entity_states(self) -> List[Tuple]:
+        if self._entity_states is None:
+            self._entity_states = list(zip(self.ids.tolist(), *self.states.T.tolist())) if self.ids is not None else []
+        return self._entity_states
+
+    def build_arrays(self):
+        """fill in ids (sorted) and states from entity_states"""
+        rows = np.array(self.entity_states, np.float64).reshape(-1, 7)
+        rows = rows[np.argsort(rows[:, 0], kind='stable')]
+        self.ids = rows[:, 0].astype(np.int64)
+        self.states = np.ascontiguousarray(rows[:, 1:])
+
+
+def interpolate_arrays(s1: Snapshot, s2: Snapshot, t: float) -> Tuple["np.ndarray", "np.ndarray"]:
+    """(ids, states) of the entities in both snapshots, lerped by t.
+    the angle takes the shortest arc, snapshot ids must be sorted"""
+    rows1 = np.searchsorted(s1.ids, s2.ids)
+    rows1[rows1 == len(s1.ids)] = 0
+    if len(s1.ids):
+        shared = s1.ids[rows1] == s2.ids
+    else:
+        shared = np.zeros(len(s2.ids), bool)
+    old = s1.states[rows1[shared]]
+    new = s2.states[shared]
+    states = old + (new-old)*t
+    # quantized snapshots wrap the angle, so take the shortest arc
+    states[:, 4] = old[:, 4] + ((new[:, 4]-old[:, 4]+math.pi) % math.tau - math.pi)*t
+    return s2.ids[shared], states
+
+
+class SnapshotBuffer:
+    """Fixed capacity ring buffer of received snapshots, ordered by time.
+    With numpy every pushed snapshot gets its arrays built once, without
+    it an entity id -> row index.
+
+    bracket finds the pair of snapshots around a render time with a binary
+    search. Snapshots which can no longer be part of a bracket are evicted
+    by evict_before, once the buffer is full the oldest one is overwritten.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.snapshots: List[Union[None, Snapshot]] = [None]*capacity
+        self.times: List[float] = [0.0]*capacity
+        self.start = 0
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> Snapshot:
+        if i < 0: i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("snapshot index out of range")
+        return self.snapshots[(self.start+i) % self.capacity]
+
+    def push(self, snapshot: Snapshot):
+        if np is not None:
+            snapshot.build_arrays()
+        else:
+            snapshot.index = {state[0]: row for row, state in enumerate(snapshot.entity_states)}
+        if self.count and snapshot.time < self[-1].time:
+            snapshot.time = self[-1].time # keep times sorted if the clock steps back
+        if self.count == self.capacity:
+            self.snapshots[self.start] = None
+            self.start = (self.start+1) % self.capacity
+            self.count -= 1
+        i = (self.start+self.count) % self.capacity
+        self.snapshots[i] = snapshot
+        self.times[i] = snapshot.time
+        self.count += 1
+
+    def _first_after(self, time: float) -> int:
+        """logical index of the first snapshot with a time after time"""
+        low, high = 0, self.count
+        times, start, capacity = self.times, self.start, self.capacity
+        while low < high:
+            middle = (low+high) // 2
+            if times[(start+middle) % capacity] <= time:
+                low = middle+1
+            else:
+                high = middle
+        return low
+
+    def bracket(self, time: float) -> Union[None, Tuple[Snapshot, Snapshot]]:
+        """(older, newer) snapshots with older.time <= time <= newer.time"""
+        i = self._first_after(time)
+        if i == 0:
+            return None
+        if i == self.count:
+            # exactly on the newest snapshot still counts
+            if self.count < 2 or self[-1].time != time: return None
+            i -= 1
+        return self[i-1], self[i]
+
+    def evict_before(self, time: float):
+        """drop snapshots which are older than the bracket of time,
+        render times only move forward so they are not needed again"""
+        # the newest pair is kept so bracket still works on the newest time
+        drop = min(self._first_after(time)-1, self.count-2)
+        for _ in range(max(drop, 0)):
+            self.snapshots[self.start] = None
+            self.start = (self.start+1) % self.capacity
+            self.count -= 1
+
+
+class SnapshotAssembler:
+    """Reassembles snapshots which were split over several datagrams.
+
+    Parts are collected by snapshot sequence number. A snapshot is handed
+    out once all of its parts arrived, or as a partial snapshot with the
+    parts that did arrive as soon as a part of a newer snapshot shows up.
+    Parts of snapshots older than the newest handed out one are dropped.
+    """
+
+    def __init__(self):
+        self.pending: Dict[int, List[Any]] = {}
+        self.sequence = 0
+
+    def add(self, sequence: int, part: int, part_count: int, payload: Any) -> List[Tuple[int, List[Any], bool]]:
+        """add one part, returns a list of finished
+        (sequence, payloads, complete) tuples in sequence order"""
+        if sequence <= self.sequence or part >= part_count:
+            return []
+
+        finished = []
+        for old_sequence in sorted(s for s in self.pending if s < sequence):
+            parts = self.pending.pop(old_sequence)
+            finished.append((old_sequence, [p for p in parts if p is not None], False))
+            self.sequence = old_sequence
+
+        parts = self.pending.get(sequence)
+        if parts is None:
+            parts = [None]*part_count
+            self.pending[sequence] = parts
+        parts[part] = payload
+        if all(p is not None for p in parts):
+            del self.pending[sequence]
+            finished.append((sequence, parts, True))
+            self.sequence = sequence
+        return finished
+
+
+class IdleSuppressor:
+    """Drops physics records of entities which have not changed since they
+    were last sent, for full snapshots (EntityUpdatePhysMulti and
+    EntityUpdatePhysMultiQuantized) where a missing entity means unchanged.
+
+    A field has changed when it moved more than its epsilon. Once an entity
+    is unchanged it is sent rest_repeats more times as a rest record, its
+    state with velocity and angular velocity zeroed, so clients stop
+    animating / moving it even if one is lost. After that it is only sent
+    as a keyframe every keyframe_interval.
+
+    What was sent is tracked for the sender, not per receiver: a receiver
+    which joins later has never seen the parked entities, so call forget
+    for every entity (World.request_keyframe) when one joins.
+
+    Delta snapshots (EntityUpdatePhysDelta) do not use it, unchanged
+    entities are already left out against each client's acknowledged
+    baseline.
+    """
+
+    def __init__(
+            self,
+            epsilon: Tuple[float, ...] = (0.01, 0.01, 0.01, 0.01, 0.001, 0.001),
+            keyframe_interval: float = 2.0,
+            rest_repeats: int = 3):
+        # per field of (x, y, vx, vy, angle, vangle)
+        self.epsilon = epsilon
+        self.keyframe_interval = keyframe_interval
+        self.rest_repeats = rest_repeats
+        # true state of each entity when it was last sent, not the rest record
+        self.last_sent: Dict[int, Tuple] = {}
+        self.sent_time: Dict[int, float] = {}
+        # id -> rest records sent since the entity stopped changing
+        self.at_rest: Dict[int, int] = {}
+
+    def filter(self, phys_states: List[Tuple], time: float) -> List[Tuple]:
+        """the records of phys_states which need sending at time"""
+        epsilon = self.epsilon
+        last_sent, sent_time, at_rest = self.last_sent, self.sent_time, self.at_rest
+        result = []
+        for state in phys_states:
+            entity_id = state[0]
+            last = last_sent.get(entity_id)
+            if last is not None and all(abs(a-b) <= e for a, b, e in zip(state[1:], last[1:], epsilon)):
+                rest_records = at_rest.get(entity_id, 0)
+                if rest_records >= self.rest_repeats:
+                    if time - sent_time[entity_id] < self.keyframe_interval: continue
+                    last = state # keyframe, compare against it from now on
+                else:
+                    at_rest[entity_id] = rest_records+1
+                result.append((entity_id, state[1], state[2], 0.0, 0.0, state[5], 0.0))
+                last_sent[entity_id] = last
+            else:
+                at_rest.pop(entity_id, None)
+                result.append(state)
+                last_sent[entity_id] = state
+            sent_time[entity_id] = time
+        
+        # every id in phys_states is in last_sent now, anything extra is gone
+        if len(last_sent) > len(phys_states):
+            present = {state[0] for state in phys_states}
+            for entity_id in [entity_id for entity_id in last_sent if entity_id not in present]:
+                del last_sent[entity_id]
+                del sent_time[entity_id]
+                at_rest.pop(entity_id, None)
+        return result
+
+    def forget(self, entity_ids: Iterable[int] = None):
+        """treat entity_ids (or every entity) as never sent, so they are
+        sent in full next time. for records filter returned which did not
+        make it into the snapshot after all, or for a new receiver"""
+        if entity_ids is None:
+            entity_ids = list(self.last_sent)
+        for entity_id in entity_ids:
+            self.last_sent.pop(entity_id, None)
+            self.sent_time.pop(entity_id, None)
+            self.at_rest.pop(entity_id, None)
+
+
+class DeltaSnapshotEncoder:
+    """Server side delta snapshot state, one per client.
+
+    Every encoded snapshot is kept by sequence number until the client
+    acknowledges a newer one. Snapshots are encoded against the last
+    acknowledged snapshot (the baseline), only entities with changed
+    fields are included and unchanged fields are replaced with None.
+    Without a usable baseline every field of every entity is sent.
+
+    encode can be given only some of the entities (see SnapshotScheduler),
+    entities listed in present_ids but not passed in are left out of the
+    snapshot instead of being removed, and the client keeps the newest
+    state it has for them (see DeltaSnapshotDecoder).
+    """
+
+    def __init__(self, history_size: int = 32):
+        self.history_size = history_size
+        self.history: Dict[int, Dict[int, Tuple]] = {}
+        self.sequence = 0
+        self.acked_sequence = 0
+
+    def acknowledge(self, sequence: int):
+        """the client has received and decoded snapshot sequence"""
+        if sequence <= self.acked_sequence or sequence not in self.history:
+            return
+        self.acked_sequence = sequence
+        # older snapshots can never become the baseline again
+        for old_sequence in [s for s in self.history if s < sequence]:
+            del self.history[old_sequence]
+
+    def delta(self, state: Tuple) -> Union[None, Tuple]:
+        """the update encode would send for state against the current
+        baseline, None if the baseline already has it"""
+        old = self.history.get(self.acked_sequence, {}).get(state[0])
+        if old is None:
+            return state
+        if old == state:
+            return None
+        return (state[0],) + tuple(
+            None if new_value == old_value else new_value
+            for new_value, old_value in zip(state[1:], old[1:]))
+
+    def removed_ids(self, present_ids: Iterable[int]) -> List[int]:
+        """the ids encode will send as removed for present_ids"""
+        baseline = self.history.get(self.acked_sequence, {})
+        present_ids = set(present_ids)
+        return [entity_id for entity_id in baseline if entity_id not in present_ids]
+
+    def encode(self, entity_states: List[Tuple], present_ids: Iterable[int] = None) -> Tuple[int, int, List[int], List[Tuple]]:
+        """encode the current entity states, returns
+        (sequence, baseline_sequence, removed_ids, entity_updates)
+
+        present_ids are all entities which still exist for this client,
+        when given only baseline entities missing from it are removed"""
+        self.sequence += 1
+        baseline = self.history.get(self.acked_sequence)
+        baseline_sequence = self.acked_sequence if baseline is not None else 0
+        if baseline is None:
+            baseline = {}
+
+        states = {}
+        entity_updates = []
+        for state in entity_states:
+            states[state[0]] = state
+            update = self.delta(state)
+            if update is not None:
+                entity_updates.append(update)
+
+        if present_ids is None:
+            removed_ids = [entity_id for entity_id in baseline if entity_id not in states]
+        else:
+            present_ids = set(present_ids)
+            removed_ids = [entity_id for entity_id in baseline if entity_id not in present_ids]
+            # the client's decoder builds its next baseline from this one plus
+            # the updates, so entities which were not sent keep their baseline
+            # value in history (it is never shown, the client keeps its newest)
+            for entity_id, old in baseline.items():
+                if entity_id in present_ids and entity_id not in states:
+                    states[entity_id] = old
+
+        self.history[self.sequence] = states
+        if len(self.history) > self.history_size:
+            del self.history[next(iter(self.history))]
+
+        return self.sequence, baseline_sequence, removed_ids, entity_updates
+
+
+class SnapshotScheduler:
+    """Picks which entities go into a client's next snapshot.
+
+    Every tick each entity's priority grows by an amount based on its
+    distance to the viewer and its speed, so entities which were skipped
+    climb until they get sent. The highest priorities are sent first
+    until budget bytes are used, sent entities start again from zero.
+    Entities the client has never seen are sent before anything else.
+    """
+
+    def __init__(self, budget: int = 2400, falloff_distance: float = 150.0, speed_scale: float = 100.0):
+        # bytes of entity updates per tick
+        self.budget = budget
+        # distance at which an entity gains half the priority of one at the viewer
+        self.falloff_distance = falloff_distance
+        # speed at which an entity gains twice the priority of a still one
+        self.speed_scale = speed_scale
+        self.priorities: Dict[int, float] = {}
+        self.sent_bytes = 0
+
+    def select(self, entity_states: List[Tuple], viewer: Tuple[float, float], update_size: Callable[[Tuple], Union[None, int]]) -> List[Tuple]:
+        """states to send this tick, in priority order. update_size returns
+        the bytes an entity's update would take, None if it needs no update"""
+        priorities = self.priorities
+        vx, vy = viewer
+        falloff = self.falloff_distance
+        speed_scale = self.speed_scale
+        candidates = []
+        for state in entity_states:
+            entity_id = state[0]
+            size = update_size(state)
+            if size is None:
+                priorities[entity_id] = 0.0 # client is up to date
+                continue
+            priority = priorities.get(entity_id)
+            if priority is None:
+                priority = math.inf # never sent
+            else:
+                distance = math.hypot(state[1]-vx, state[2]-vy)
+                speed = math.hypot(state[3], state[4])
+                priority += (1 + speed/speed_scale) * falloff/(falloff+distance)
+            priorities[entity_id] = priority
+            candidates.append((priority, entity_id, size, state))
+
+        candidates.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+        selected = []
+        room = self.budget
+        for priority, entity_id, size, state in candidates:
+            if size > room: continue
+            room -= size
+            selected.append(state)
+            priorities[entity_id] = 0.0
+        self.sent_bytes = self.budget-room
+
+        if len(priorities) > len(entity_states):
+            # forget entities which are gone (or out of scope)
+            present = {state[0] for state in entity_states}
+            for entity_id in [entity_id for entity_id in priorities if entity_id not in present]:
+                del priorities[entity_id]
+        return selected
+
+
+class DeltaSnapshotDecoder:
+    """Client side counterpart of DeltaSnapshotEncoder, rebuilds
+    full entity states from delta snapshots.
+
+    Baselines (history) are rebuilt exactly like the encoder does. The
+    states handed out are the newest ones received for each entity, so
+    an entity the server left out of a snapshot (it was not selected, or
+    its part was lost) holds its last position instead of snapping back
+    to an older baseline value or disappearing."""
+
+    def __init__(self, history_size: int = 32):
+        self.history_size = history_size
+        self.history: Dict[int, Dict[int, Tuple]] = {}
+        self.sequence = 0
+        # newest decoded state of every entity, see forget
+        self.latest: Dict[int, Tuple] = {}
+
+    def forget(self, entity_id: int):
+        """drop the newest state of a destroyed entity"""
+        self.latest.pop(entity_id, None)
+
+    def decode(
+            self,
+            sequence: int,
+            baseline_sequence: int,
+            removed_ids: List[int],
+            entity_updates: List[Tuple],
+            complete: bool = True) -> Union[None, Dict[int, Tuple]]:
+        """rebuild the full states of a snapshot, returns the newest state
+        of every entity, or None if the snapshot is older than the latest
+        decoded one or its baseline is unknown
+
+        an incomplete snapshot (some of its parts were lost) is never used
+        as a baseline"""
+        if sequence <= self.sequence:
+            return None
+        if baseline_sequence == 0:
+            baseline = {}
+        else:
+            baseline = self.history.get(baseline_sequence)
+            if baseline is None:
+                return None
+
+        states = dict(baseline) if complete else {}
+        latest = self.latest
+        for entity_id in removed_ids:
+            states.pop(entity_id, None)
+            latest.pop(entity_id, None)
+        for update in entity_updates:
+            entity_id = update[0]
+            old = states.get(entity_id) if complete else baseline.get(entity_id)
+            if old is None:
+                if None in update: continue # delta against an entity we never had
+                state = update
+            else:
+                state = tuple(
+                    old_value if new_value is None else new_value
+                    for new_value, old_value in zip(update, old))
+            states[entity_id] = state
+            latest[entity_id] = state
+
+        self.sequence = sequence
+        if not complete:
+            return dict(latest)
+        self.history[sequence] = states
+        # the server never goes back to a baseline older than this one
+        for old_sequence in [s for s in self.history if s < baseline_sequence]:
+            del self.history[old_sequence]
+        if len(self.history) > self.history_size:
+            del self.history[next(iter(self.history))]
+        return dict(latest)
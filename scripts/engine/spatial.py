@@ -0,0 +1,162 @@
+import math
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+import pygame
+
+from .entity_state import np
+
+Cell = Tuple[int, int]
+
+
+class SpatialHash:
+    """Uniform grid index of entity positions.
+
+    Entities are bucketed into square cells of cell_size world units,
+    moving an entity only touches the cell buckets when it crosses into
+    a different cell. Queries look at the cells overlapping the query
+    area and then check the exact positions.
+    """
+
+    def __init__(self, cell_size: float = 64.0):
+        self.cell_size = cell_size
+        self.cells: Dict[Cell, Set[int]] = {}
+        self.cell_of: Dict[int, Cell] = {}
+        self.positions: Dict[int, Tuple[float, float]] = {}
+        # id -> cell for update_arrays, allocated on first use
+        self._cell_array = None
+        # (min_x, min_y, max_x, max_y) of the occupied cells, grown as cells
+        # are added, None once an edge cell was emptied (recomputed by nearest)
+        self._bounds: Union[None, Tuple[int, int, int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.cell_of)
+
+    def __contains__(self, entity_id: int) -> bool:
+        return entity_id in self.cell_of
+
+    def _cell(self, x: float, y: float) -> Cell:
+        return (math.floor(x/self.cell_size), math.floor(y/self.cell_size))
+
+    def _drop_cell(self, cell: Cell):
+        """forget an emptied cell bucket"""
+        del self.cells[cell]
+        bounds = self._bounds
+        if bounds is not None and (cell[0] in (bounds[0], bounds[2]) or cell[1] in (bounds[1], bounds[3])):
+            self._bounds = None
+
+    def _move_cell(self, entity_id: int, cell: Cell):
+        old = self.cell_of.get(entity_id)
+        if old == cell: return
+        if old is not None:
+            bucket = self.cells[old]
+            bucket.discard(entity_id)
+            if not bucket: self._drop_cell(old)
+        bucket = self.cells.get(cell)
+        if bucket is None:
+            bucket = self.cells[cell] = set()
+            bounds = self._bounds
+            if bounds is not None:
+                x, y = cell
+                self._bounds = (min(bounds[0], x), min(bounds[1], y), max(bounds[2], x), max(bounds[3], y))
+        bucket.add(entity_id)
+        self.cell_of[entity_id] = cell
+        if self._cell_array is not None:
+            self._cell_array[entity_id] = cell
+
+    def update(self, entity_id: int, x: float, y: float):
+        """insert or move an entity"""
+        self.positions[entity_id] = (x, y)
+        self._move_cell(entity_id, self._cell(x, y))
+
+    def update_arrays(self, entity_ids: "np.ndarray", positions: "np.ndarray"):
+        """update for many entities at once, entity_ids must be u16 ids.
+        only entities which changed cell are handled one by one"""
+        if self._cell_array is None:
+            self._cell_array = np.full((65536, 2), np.iinfo(np.int64).min, np.int64)
+            for entity_id, cell in self.cell_of.items():
+                self._cell_array[entity_id] = cell
+        self.positions.update(zip(entity_ids.tolist(), map(tuple, positions.tolist())))
+        cells = np.floor(positions/self.cell_size).astype(np.int64)
+        moved = np.flatnonzero((cells != self._cell_array[entity_ids]).any(axis=1))
+        for entity_id, cell in zip(entity_ids[moved].tolist(), cells[moved].tolist()):
+            self._move_cell(entity_id, tuple(cell))
+
+    def remove(self, entity_id: int):
+        cell = self.cell_of.pop(entity_id, None)
+        if cell is None: return
+        del self.positions[entity_id]
+        bucket = self.cells[cell]
+        bucket.discard(entity_id)
+        if not bucket: self._drop_cell(cell)
+        if self._cell_array is not None:
+            self._cell_array[entity_id] = np.iinfo(np.int64).min
+
+    def _cells_in(self, left: float, top: float, right: float, bottom: float) -> Iterable[Set[int]]:
+        min_x, min_y = self._cell(left, top)
+        max_x, max_y = self._cell(right, bottom)
+        cells = self.cells
+        if (max_x-min_x+1)*(max_y-min_y+1) > len(cells):
+            # the area covers more cells than are in use
+            return [bucket for (x, y), bucket in cells.items()
+                    if min_x <= x <= max_x and min_y <= y <= max_y]
+        return [cells[(x, y)] for x in range(min_x, max_x+1) for y in range(min_y, max_y+1) if (x, y) in cells]
+
+    def query_rect(self, rect: pygame.Rect) -> List[int]:
+        """ids of entities whose position is inside rect"""
+        left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+        positions = self.positions
+        result = []
+        for bucket in self._cells_in(left, top, right, bottom):
+            for entity_id in bucket:
+                x, y = positions[entity_id]
+                if left <= x < right and top <= y < bottom:
+                    result.append(entity_id)
+        return result
+
+    def query_radius(self, center: Tuple[float, float], radius: float) -> List[int]:
+        """ids of entities within radius of center"""
+        cx, cy = center
+        radius_squared = radius*radius
+        positions = self.positions
+        result = []
+        for bucket in self._cells_in(cx-radius, cy-radius, cx+radius, cy+radius):
+            for entity_id in bucket:
+                x, y = positions[entity_id]
+                if (x-cx)*(x-cx) + (y-cy)*(y-cy) <= radius_squared:
+                    result.append(entity_id)
+        return result
+
+    def nearest(self, center: Tuple[float, float], max_radius: float = math.inf, exclude: Iterable[int] = ()) -> Union[None, int]:
+        """id of the entity closest to center, searching rings of cells
+        outwards until no closer entity can exist, None if there is none
+        within max_radius"""
+        if not self.cell_of: return None
+        exclude = set(exclude)
+        cx, cy = center
+        origin_x, origin_y = self._cell(cx, cy)
+        best, best_squared = None, max_radius*max_radius
+        positions, cells = self.positions, self.cells
+        if self._bounds is None:
+            self._bounds = (
+                min(x for x, _ in cells), min(y for _, y in cells),
+                max(x for x, _ in cells), max(y for _, y in cells))
+        min_x, min_y, max_x, max_y = self._bounds
+        # no occupied cell is further than this many rings away
+        max_ring = max(origin_x-min_x, max_x-origin_x, origin_y-min_y, max_y-origin_y, 0)
+        if max_radius != math.inf:
+            max_ring = min(max_ring, math.ceil(max_radius/self.cell_size)+1)
+        for ring in range(max_ring+1):
+            # everything in this ring is at least (ring-1)*cell_size away
+            if best is not None and ((ring-1)*self.cell_size)**2 > best_squared: break
+            if (ring-1)*self.cell_size > max_radius: break
+            for x in range(origin_x-ring, origin_x+ring+1):
+                for y in ((origin_y-ring, origin_y+ring) if abs(x-origin_x) != ring else range(origin_y-ring, origin_y+ring+1)):
+                    bucket = cells.get((x, y))
+                    if not bucket: continue
+                    for entity_id in bucket:
+                        if entity_id in exclude: continue
+                        px, py = positions[entity_id]
+                        distance_squared = (px-cx)*(px-cx) + (py-cy)*(py-cy)
+                        if distance_squared <= best_squared:
+                            best, best_squared = entity_id, distance_squared
+        return best
@@ -0,0 +1,139 @@
+from collections import deque
+from contextlib import contextmanager
+import math
+import time
+from typing import Callable, Deque, Dict, Iterator, List
+
+
+def _nearest_rank(ordered: List[float], p: float) -> float:
+    return ordered[max(math.ceil(p/100*len(ordered)), 1)-1]
+
+
+class RollingHistogram:
+    """The last size samples of a value (tick phase durations in seconds)."""
+
+    def __init__(self, size: int = 600):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, value: float):
+        self.samples.append(value)
+
+    def percentile(self, p: float) -> float:
+        """nearest rank percentile, p from 0 to 100"""
+        if not self.samples: return 0.0
+        return _nearest_rank(sorted(self.samples), p)
+
+    def summary(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+        return {
+            'count': len(ordered),
+            'mean': sum(ordered)/len(ordered),
+            'p50': _nearest_rank(ordered, 50),
+            'p95': _nearest_rank(ordered, 95),
+            'p99': _nearest_rank(ordered, 99),
+            'max': ordered[-1]}
+
+
+class TickScheduler:
+    """Fixed rate game loop timing on a monotonic clock.
+
+    wait sleeps until the next simulation tick is due and returns how many
+    ticks to run, time which is not consumed by whole ticks is carried over
+    so sleep jitter does not add up to drift. After a stall at most
+    max_catch_up ticks are run, the rest are dropped and counted.
+
+    Snapshots are sent at their own rate, should_send is true once every
+    send_interval of simulated time. Loop phases can be timed with phase,
+    each phase keeps a rolling histogram of its durations.
+    """
+
+    def __init__(
+            self,
+            tick_rate: float = 20.0,
+            send_rate: float = None,
+            max_catch_up: int = 5,
+            clock: Callable[[], float] = time.monotonic):
+        self.tick_rate = tick_rate
+        self.dt = 1/tick_rate
+        self.send_interval = 1/(send_rate or tick_rate)
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+
+        self.accumulator = 0.0
+        self._send_accumulator = 0.0
+        self._last_time = clock()
+        self._tick_started = self._last_time
+
+        self.tick_count = 0
+        # ticks skipped because the loop fell more than max_catch_up behind
+        self.dropped_ticks = 0
+        # loop iterations which took longer than one tick
+        self.overruns = 0
+        self.phases: Dict[str, RollingHistogram] = {}
+        self.tick_durations = RollingHistogram()
+
+    def advance(self) -> int:
+        """add the time since the last call, returns how many ticks are due"""
+        now = self.clock()
+        self.accumulator += now - self._last_time
+        self._last_time = now
+        ticks = int(self.accumulator // self.dt)
+        if ticks > self.max_catch_up:
+            self.dropped_ticks += ticks - self.max_catch_up
+            ticks = self.max_catch_up
+            self.accumulator = ticks*self.dt # the rest of the backlog is dropped
+        self.accumulator -= ticks*self.dt
+        self.tick_count += ticks
+        self._send_accumulator += ticks*self.dt
+        return ticks
+
+    def wait(self) -> int:
+        """sleep until at least one tick is due, returns how many ticks to run"""
+        while True:
+            ticks = self.advance()
+            if ticks:
+                self._tick_started = self.clock()
+                return ticks
+            time.sleep(self.dt - self.accumulator)
+
+    def should_send(self) -> bool:
+        """true if a snapshot is due, call once per loop iteration"""
+        if self._send_accumulator < self.send_interval:
+            return False
+        # never send more than once per iteration, even after catching up
+        self._send_accumulator = min(self._send_accumulator-self.send_interval, self.send_interval)
+        return True
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """time the body into the histogram of name"""
+        histogram = self.phases.get(name)
+        if histogram is None:
+            histogram = self.phases[name] = RollingHistogram()
+        start = self.clock()
+        try:
+            yield
+        finally:
+            histogram.add(self.clock()-start)
+
+    def end_tick(self):
+        """call at the end of each loop iteration"""
+        duration = self.clock()-self._tick_started
+        self.tick_durations.add(duration)
+        if duration > self.dt:
+            self.overruns += 1
+
+    def report(self) -> str:
+        """phase breakdown in milliseconds, as text"""
+        lines = [f'ticks {self.tick_count} dropped {self.dropped_ticks} overruns {self.overruns} (tick {self.dt*1000:.1f}ms)']
+        for name, histogram in list(self.phases.items()) + [('total', self.tick_durations)]:
+            summary = histogram.summary()
+            lines.append(
+                f'{name:>10}  mean {summary["mean"]*1000:7.3f}  p50 {summary["p50"]*1000:7.3f}'
+                f'  p95 {summary["p95"]*1000:7.3f}  p99 {summary["p99"]*1000:7.3f}  max {summary["max"]*1000:7.3f}')
+        return '\n'.join(lines)
@@ -1,32 +1,84 @@
-from collections import deque
+from contextlib import contextmanager
+import math
 import random
 import time
-from typing import Dict, List, Set, Tuple, Union
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Set, Tuple, Union
 
 import pygame
 
 from . import Snapshot
+from .snapshot import DeltaSnapshotDecoder, DeltaSnapshotEncoder, IdleSuppressor, SnapshotAssembler, SnapshotBuffer, SnapshotScheduler, interpolate_arrays
 
 from . import network
 from .. import packets
 from . import EntityRegistry
 from .entity import Entity, EntityRenderer
-from .particle import Particle
+from .entity_state import EntityStateStore, HAS_NUMPY
+from .history import StateHistory
+from .particle import Particle, ParticleSystem
+from .spatial import SpatialHash
+
+# snapshot part and part_count are sent as u8
+MAX_SNAPSHOT_PARTS = 255
 
 class World():
     entities: Dict[str, Entity]
     local_entities: Set[str]
     
-    def __init__(self, entity_registry: EntityRegistry, is_server: bool = False):
+    def __init__(
+            self,
+            entity_registry: EntityRegistry,
+            is_server: bool = False,
+            quantize_snapshots: bool = False,
+            delta_snapshots: bool = False,
+            columnar_state: bool = HAS_NUMPY):
         self.is_server = is_server
+        # send physics as EntityUpdatePhysMultiQuantized instead of full precision,
+        # both packet types are always accepted by handle_network_event. both
+        # leave idle entities out (see idle_suppressor and request_keyframe).
+        # only for the physics of pump_network_events, with delta_snapshots
+        # the server sends EntityUpdatePhysDelta which is not quantized
+        self.quantize_snapshots = quantize_snapshots
+        # server only, physics is not broadcast by pump_network_events,
+        # build_delta_snapshot_event is used per client instead
+        self.delta_snapshots = delta_snapshots
+        # snapshots are split into datagrams of at most this many bytes
+        self.snapshot_payload_budget = network.Constants.UDP_SAFE_PAYLOAD
+        self._snapshot_sequence = 0
+        # entities which did not fit in MAX_SNAPSHOT_PARTS last time, sent first next time
+        self._deferred_ids: Set[int] = set()
+        # entities which have not changed are left out of pump_network_events
+        # physics, None sends every entity every time. a delta snapshot server
+        # has none, its per client snapshots already leave out whatever the
+        # client has acknowledged
+        self.idle_suppressor: Union[None, IdleSuppressor] = None if is_server and delta_snapshots else IdleSuppressor()
         self.entity_registry: EntityRegistry = entity_registry
         self.entities = {}
         self.local_entities = set()
-        self.snapshot_buffer: deque[Snapshot] = deque()
+        # local entities moved by input prediction (see PredictionBuffer)
+        # instead of update, their physics is not sent to the server either
+        self.predicted_entities: Set[int] = set()
+        # entities with replicated attributes changed since the last
+        # pump_network_events, see Entity.mark_dirty
+        self.dirty_entities: Set[int] = set()
+        # entity physics state in numpy arrays, None keeps it on each entity
+        self.state_store = EntityStateStore() if columnar_state else None
+        # entity positions, kept current by update, apply_snapshot and phys events
+        self.spatial_hash = SpatialHash()
+        # server only, the state of every entity at the end of each update
+        # for lag compensation, see rewound
+        self.state_history = StateHistory() if is_server and self.state_store is not None else None
+        self.snapshot_buffer = SnapshotBuffer()
+        self.snapshot_assembler = SnapshotAssembler()
+        self.delta_assembler = SnapshotAssembler()
+        self.delta_decoder = DeltaSnapshotDecoder()
+        self._snapshot_ack = 0
         self.render_delay = 0.2 if not self.is_server else 0
         
         self.reference_time = time.time()
         
+        # pooled particles when numpy is available, Particle objects otherwise
+        self.particle_system = ParticleSystem() if HAS_NUMPY else None
         self.particles: List[Particle] = []
         
         self._s1_time = 0
@@ -43,27 +95,89 @@ class World():
             id, = event.args
             self.destroy_entity(id)
     
+        elif event.type == packets.PacketDefinitions.EntityUpdateAttr:
+            updates, = event.args
+            for id, mask, data in updates:
+                entity = self.entities.get(id)
+                if entity is None: continue
+                entity.unpack_attributes(mask, data)
+    
         elif event.type == packets.PacketDefinitions.EntityUpdatePhys:
-            id, position, velocity, rotation, rotational_velocity = event.args
-            if not self.is_server and id in self.local_entities:
+            if not self.is_server and packets.peek_entity_id(event) in self.local_entities:
                 return # Do not update if this is client-controlled
+            id, position, velocity, rotation, rotational_velocity = event.args
             entity = self.entities.get(id)
             if entity is None: return
             entity.position = position
+            self.update_spatial_index([id])
             entity.velocity = velocity
             entity.rotation = rotation
             entity.rotational_velocity = rotational_velocity
             # These attributes should be saved to the snapshot buffer instead of immediately applied
     
-        elif event.type == packets.PacketDefinitions.EntityUpdatePhysMulti:
-            reference_time, updates = event.args
-            snapshot = Snapshot(reference_time, time.time(), updates)
+        elif event.type in (packets.PacketDefinitions.EntityUpdatePhysMulti,
+                            packets.PacketDefinitions.EntityUpdatePhysMultiQuantized):
+            reference_time, sequence, part, part_count, updates = event.args
             if self.is_server:
-                self.apply_snapshot(snapshot)
-            else:
-                self.snapshot_buffer.append(snapshot)
-                if len(self.snapshot_buffer) > 60: # TODO: Base on render time instead of arbitrary
-                    self.snapshot_buffer.popleft()
+                # parts are self-contained, apply each one as it arrives
+                self.apply_snapshot(Snapshot(reference_time, time.time(), updates))
+                return
+            for _, parts, _ in self.snapshot_assembler.add(sequence, part, part_count, (reference_time, updates)):
+                self.push_snapshot(Snapshot(
+                    parts[0][0], time.time(),
+                    self._carry_over([update for _, part_updates in parts for update in part_updates])))
+        
+        elif event.type == packets.PacketDefinitions.EntityUpdatePhysDelta:
+            sequence, baseline_sequence, reference_time, part, part_count, removed_ids, updates = event.args
+            finished = self.delta_assembler.add(
+                sequence, part, part_count, (baseline_sequence, reference_time, removed_ids, updates))
+            for sequence, parts, complete in finished:
+                baseline_sequence, reference_time, _, _ = parts[0]
+                states = self.delta_decoder.decode(
+                    sequence, baseline_sequence,
+                    [entity_id for part in parts for entity_id in part[2]],
+                    [update for part in parts for update in part[3]],
+                    complete)
+                if states is None: continue
+                if complete:
+                    self._snapshot_ack = sequence
+                self.push_snapshot(Snapshot(reference_time, time.time(), list(states.values())))
+    
+    def _carry_over(self, updates: List[Tuple]) -> List[Tuple]:
+        """idle entities are left out of EntityUpdatePhysMulti(Quantized)
+        (see IdleSuppressor), take them from the previous snapshot. entities
+        this receiver never got a record of only show up with the sender's
+        next keyframe, see request_keyframe"""
+        if not len(self.snapshot_buffer): return updates
+        sent = {update[0] for update in updates}
+        entities = self.entities
+        return updates + [
+            state for state in self.snapshot_buffer[-1].entity_states
+            if state[0] not in sent and state[0] in entities]
+    
+    def request_keyframe(self, entity_ids: Iterable[int] = None):
+        """send every entity (or entity_ids) in the next physics snapshot
+        of pump_network_events even if it is idle, for receivers which join
+        or first see them. nothing to do for delta snapshots, a new client's
+        encoder has no baseline and gets every entity in full"""
+        if self.idle_suppressor is not None:
+            self.idle_suppressor.forget(entity_ids)
+    
+    def push_snapshot(self, snapshot: Snapshot):
+        self.snapshot_buffer.push(snapshot)
+    
+    def spawn_particle(
+            self,
+            position: pygame.Vector2,
+            velocity: pygame.Vector2,
+            lifetime: float = 1,
+            drag: float = 1,
+            linear_acceleration: pygame.Vector2 = None,
+            color: Tuple[int, int, int] = (255, 255, 255)):
+        if self.particle_system is not None:
+            self.particle_system.spawn(position, velocity, lifetime, drag, linear_acceleration, color)
+        else:
+            self.particles.append(Particle(position, velocity, lifetime, drag, linear_acceleration, color))
     
     def assign_new_entity_id(self) -> int:
         id = -1
@@ -72,29 +186,71 @@ class World():
         return id
     
     def create_entity(self, entity: Entity, is_local: bool = False):
+        old = self.entities.get(entity.id)
+        if old is not None and old is not entity:
+            old.detach_state_store() # replaced by an entity with the same id
         self.entities[entity.id] = entity
+        if entity.state_store is not self.state_store:
+            entity.detach_state_store()
+            if self.state_store is not None:
+                entity.attach_state_store(self.state_store)
         if is_local:
             self.local_entities.add(entity.id)
+        self.update_spatial_index([entity.id])
         
     def destroy_entity(self, entity_id: int):
         if not entity_id in self.entities: return
-        del self.entities[entity_id]
+        self.entities.pop(entity_id).detach_state_store()
         self.local_entities.discard(entity_id)
+        self.predicted_entities.discard(entity_id)
+        self.spatial_hash.remove(entity_id)
+        self.delta_decoder.forget(entity_id)
+    
+    def update_spatial_index(self, entity_ids: Iterable[int] = None):
+        """move entities in spatial_hash to their current positions,
+        every entity or only entity_ids"""
+        store = self.state_store
+        if store is not None and entity_ids is None:
+            self.spatial_hash.update_arrays(store.ids[:store.count], store.position[:store.count])
+            return
+        for entity_id in (self.entities if entity_ids is None else entity_ids):
+            entity = self.entities.get(entity_id)
+            if entity is None: continue
+            position = entity.position
+            self.spatial_hash.update(entity_id, position.x, position.y)
     
     def set_entity_local(self, entity_id: int, value: bool):
         if value: self.local_entities.add(entity_id)
         else: self.local_entities.discard(entity_id)
     
-    def pump_network_events(self) -> Tuple[List[network.Event], List[network.Event]]:
-        events_tcp = []
-        events_udp = []
+    def set_entity_predicted(self, entity_id: int, value: bool):
+        """predicted entities are local as well, so snapshots skip them"""
+        if value:
+            self.local_entities.add(entity_id)
+            self.predicted_entities.add(entity_id)
+        else: self.predicted_entities.discard(entity_id)
+    
+    def get_network_time(self) -> float:
+        return time.time() - self.reference_time
+    
+    def get_phys_states(self, entity_ids: Iterable[int] = None) -> List[Tuple]:
+        """physics state tuples (id, x, y, vx, vy, angle, vangle) of every
+        entity this side is authoritative over, or of entity_ids"""
+        if self.state_store is not None:
+            if entity_ids is not None:
+                return self.state_store.get_state_tuples(self.state_store.slots_of(entity_ids))
+            if self.is_server:
+                return self.state_store.get_state_tuples()
+            return self.state_store.get_state_tuples(self.state_store.slots_of(self.local_entities - self.predicted_entities))
         
         phys_updates = []
         
-        if self.is_server:
+        if entity_ids is not None:
+            update_entities = [e for e in [self.entities.get(entity_id) for entity_id in entity_ids] if e]
+        elif self.is_server:
             update_entities = self.entities.values()
         else:
-            update_entities = [e for e in [self.entities.get(entity_id) for entity_id in self.local_entities] if e]
+            update_entities = [e for e in [self.entities.get(entity_id) for entity_id in self.local_entities - self.predicted_entities] if e]
         
         for entity in update_entities:
             entity_id = entity.id
@@ -109,17 +265,158 @@ class World():
                 entity.rotation,
                 entity.rotational_velocity
             ),)
+        
+        return phys_updates
+    
+    def split_by_budget(self, items: List[Any], item_size: Callable[[Any], int], header_size: int) -> Tuple[List[List[Any]], List[Any]]:
+        """split items into at most MAX_SNAPSHOT_PARTS parts which each fit
+        in snapshot_payload_budget bytes, always at least one (possibly
+        empty) part. returns (parts, the items which did not fit)"""
+        room = self.snapshot_payload_budget - network.TYPE_STRUCT.size - header_size
+        parts = [[]]
+        used = 0
+        for i, item in enumerate(items):
+            size = item_size(item)
+            if used + size > room and parts[-1]:
+                if len(parts) == MAX_SNAPSHOT_PARTS:
+                    return parts, items[i:]
+                parts.append([])
+                used = 0
+            parts[-1].append(item)
+            used += size
+        return parts, []
+    
+    def build_delta_snapshot_events(
+            self,
+            encoder: DeltaSnapshotEncoder,
+            phys_states: List[Tuple],
+            scheduler: SnapshotScheduler = None,
+            viewer: Tuple[float, float] = (0, 0)) -> List[network.Event]:
+        """encode phys_states against the baseline of one client's encoder,
+        split into datagrams which fit in snapshot_payload_budget
+
+        with a scheduler only the highest priority entities (seen from
+        viewer) which fit in its byte budget are sent, the rest are left
+        out and the client keeps its newest state of them. entities which do not fit in
+        MAX_SNAPSHOT_PARTS datagrams are left for the next snapshot too"""
+        present_ids = [state[0] for state in phys_states]
+        if scheduler is not None:
+            phys_states = scheduler.select(phys_states, viewer, lambda state: self._delta_update_size(encoder, state))
+        # removed ids are plain ints, updates / states are tuples
+        def update_size(item) -> int:
+            if isinstance(item, int): return packets.ENTITY_ID.size
+            return packets.phys_delta_update_size(item)
+        def state_size(item) -> int:
+            if isinstance(item, int): return packets.ENTITY_ID.size
+            return self._delta_update_size(encoder, item) or 0
+        # find the states which fit before encoding, so the encoder's
+        # history only has the ones which are really sent
+        _, deferred = self.split_by_budget(
+            encoder.removed_ids(present_ids) + phys_states, state_size, packets.PHYS_DELTA_HEADER.size)
+        if deferred:
+            deferred_ids = {item[0] for item in deferred if not isinstance(item, int)}
+            phys_states = [state for state in phys_states if state[0] not in deferred_ids]
+        sequence, baseline_sequence, removed_ids, updates = encoder.encode(phys_states, present_ids)
+        reference_time = self.get_network_time()
+        parts, _ = self.split_by_budget(removed_ids + updates, update_size, packets.PHYS_DELTA_HEADER.size)
+        return [network.Event(
+            packets.PacketDefinitions.EntityUpdatePhysDelta,
+            sequence, baseline_sequence, reference_time, i, len(parts),
+            [item for item in part if isinstance(item, int)],
+            [item for item in part if not isinstance(item, int)]
+        ) for i, part in enumerate(parts)]
+    
+    def _delta_update_size(self, encoder: DeltaSnapshotEncoder, state: Tuple) -> Union[None, int]:
+        update = encoder.delta(state)
+        return None if update is None else packets.phys_delta_update_size(update)
+    
+    def take_attribute_updates(self) -> Dict[int, Tuple[int, bytes]]:
+        """entity id -> (change mask, packed fields) of the replicated
+        fields changed since the last call, and clear the dirty bits.
+        each entity is packed once, build_attribute_event picks the ones
+        in a client's scope out of it"""
+        updates = {}
+        for entity_id in self.dirty_entities:
+            entity = self.entities.get(entity_id)
+            if entity is None or not entity.dirty_attributes: continue
+            updates[entity_id] = (entity.dirty_attributes, entity.pack_attributes(entity.dirty_attributes))
+            entity.dirty_attributes = 0
+        self.dirty_entities.clear()
+        return updates
+    
+    def build_attribute_event(
+            self,
+            entity_ids: Iterable[int],
+            full: bool = False,
+            updates: Dict[int, Tuple[int, bytes]] = None) -> Union[None, network.Event]:
+        """one EntityUpdateAttr with the dirty replicated fields of
+        entity_ids (taken from updates if given, see take_attribute_updates),
+        or all of their fields if full (for clients which just got
+        EntityCreate). None if there is nothing to send"""
+        records = []
+        for entity_id in entity_ids:
+            if updates is not None and not full:
+                update = updates.get(entity_id)
+                if update is not None:
+                    records.append((entity_id,) + update)
+                continue
+            entity = self.entities.get(entity_id)
+            if entity is None: continue
+            mask = entity.replicated_mask if full else entity.dirty_attributes
+            if mask:
+                records.append((entity_id, mask, entity.pack_attributes(mask)))
+        if not records: return None
+        return network.Event(packets.PacketDefinitions.EntityUpdateAttr, records)
+    
+    def pump_network_events(self) -> Tuple[List[network.Event], List[network.Event]]:
+        events_tcp = []
+        events_udp = []
+        
+        if self.dirty_entities and not self.is_server:
+            # attributes are only replicated from the server, which sends
+            # them per client (see take_attribute_updates)
+            self.take_attribute_updates()
+        
+        if self._snapshot_ack:
+            events_udp.append(network.Event(packets.PacketDefinitions.SnapshotAck, self._snapshot_ack))
+            self._snapshot_ack = 0
+        
+        phys_updates = [] if self.is_server and self.delta_snapshots else self.get_phys_states()
+        if phys_updates and self.idle_suppressor is not None:
+            phys_updates = self.idle_suppressor.filter(phys_updates, self.get_network_time())
+        if self._deferred_ids:
+            deferred_ids = self._deferred_ids
+            phys_updates = sorted(phys_updates, key=lambda update: update[0] not in deferred_ids)
 
         if len(phys_updates) > 0:
-            events_udp.append(network.Event(
-                packets.PacketDefinitions.EntityUpdatePhysMulti,
-                time.time() - self.reference_time, phys_updates
-            ))
+            self._snapshot_sequence += 1
+            reference_time = self.get_network_time()
+            record_size = (packets.PHYS_QUANTIZED_RECORD if self.quantize_snapshots else packets.PHYS_RECORD).size
+            parts, deferred = self.split_by_budget(phys_updates, lambda update: record_size, packets.PHYS_MULTI_HEADER.size)
+            # too many entities for one snapshot, the rest go first in the next one
+            self._deferred_ids = {update[0] for update in deferred}
+            if deferred and self.idle_suppressor is not None:
+                self.idle_suppressor.forget(self._deferred_ids)
+            for i, part in enumerate(parts):
+                events_udp.append(network.Event(
+                    packets.PacketDefinitions.EntityUpdatePhysMultiQuantized if self.quantize_snapshots
+                    else packets.PacketDefinitions.EntityUpdatePhysMulti,
+                    reference_time, self._snapshot_sequence, i, len(parts), part
+                ))
         
         return events_tcp, events_udp
     
     def apply_snapshot(self, snapshot: Snapshot):
         # Used by server to instantly process snapshot
+        if self.state_store is not None:
+            skip = None if self.is_server else list(self.local_entities)
+            slots = self.state_store.apply_state_tuples(snapshot.entity_states, skip)
+            self.spatial_hash.update_arrays(self.state_store.ids[slots], self.state_store.position[slots])
+            entities = self.state_store.entities
+            for slot in slots.tolist():
+                entities[slot].update_visuals(0.0)
+            return
+        
         for update in snapshot.entity_states:
             entity_id = update[0]
             
@@ -130,6 +427,7 @@ class World():
             
             entity.update_from_snapshot(update)
             entity.update_visuals(0.0)
+            self.spatial_hash.update(entity_id, update[1], update[2])
     
     def update(self, dt: float):
         # some entities should be interpolated not use proper physics
@@ -140,7 +438,11 @@ class World():
             render_time = current_time - self.render_delay
             snapshot = self.interpolate_snapshot(render_time)
         
-            if snapshot:
+            if snapshot and self.state_store is not None and snapshot.ids is not None:
+                self.state_store.apply_states(snapshot.ids, snapshot.states, list(self.local_entities))
+            elif snapshot and self.state_store is not None:
+                self.state_store.apply_state_tuples(snapshot.entity_states, list(self.local_entities))
+            elif snapshot:
                 for update in snapshot.entity_states:
                     entity_id = update[0]
                     
@@ -154,57 +456,127 @@ class World():
             for entity in self.entities.values():
                 entity.update_visuals(dt)
         
-        # Update local entities directly
-        for entity_id in self.local_entities:
-            entity = self.entities[entity_id]
-            entity.update(dt)
+        # Update local entities directly, predicted ones were already moved
+        updated = self.local_entities - self.predicted_entities
+        if self.state_store is not None:
+            # entities using the base Entity.update are integrated in one go
+            bulk = [entity_id for entity_id in updated
+                    if type(self.entities[entity_id]).update is Entity.update]
+            self.state_store.integrate(dt, self.state_store.slots_of(bulk))
+            for entity_id in updated:
+                entity = self.entities[entity_id]
+                if type(entity).update is Entity.update: entity.update_visuals(dt)
+                else: entity.update(dt)
+        else:
+            for entity_id in updated:
+                entity = self.entities[entity_id]
+                entity.update(dt)
+        
+        self.update_spatial_index()
+        
+        if self.state_history is not None:
+            self.state_history.record(self.get_network_time(), self.state_store)
         
         # Update particles
-        self.particles = [p for p in self.particles if p.update(dt)]
+        if self.particle_system is not None:
+            self.particle_system.update(dt)
+        if self.particles:
+            self.particles = [p for p in self.particles if p.update(dt)]
+    
+    def get_client_view_time(self, rtt: float, render_delay: float = 0.2) -> float:
+        """network time of what a client with rtt had on screen when the
+        action it sent just now was taken: snapshots reach it rtt/2 late,
+        it renders render_delay behind them and its action takes rtt/2"""
+        return self.get_network_time() - rtt - render_delay
+    
+    def rewind(self, time: float, entity_ids: Iterable[int] = None) -> Tuple:
+        """move every entity, or entity_ids, back to where state_history
+        has them at network time, interpolated between ticks. returns the
+        state to give to restore. entities which did not exist then are
+        left where they are"""
+        ids, states = self.state_history.sample(time, entity_ids)
+        store = self.state_store
+        slots = store.slot_by_id[ids]
+        ids, states, slots = ids[slots >= 0], states[slots >= 0], slots[slots >= 0]
+        saved = (ids, store.get_states(slots))
+        self._set_states(ids, states)
+        return saved
+    
+    def restore(self, saved: Tuple):
+        """undo a rewind"""
+        self._set_states(*saved)
+    
+    def _set_states(self, ids, states):
+        slots = self.state_store.apply_states(ids, states)
+        self.spatial_hash.update_arrays(ids, self.state_store.position[slots])
+        entities = self.state_store.entities
+        for slot in slots.tolist():
+            entities[slot].update_visuals(0.0)
+    
+    @contextmanager
+    def rewound(self, time: float, entity_ids: Iterable[int] = None) -> Iterator[None]:
+        """rewind for the body, for hit tests against what a client saw.
+        positions, rects and spatial_hash queries are all rewound"""
+        saved = self.rewind(time, entity_ids)
+        try:
+            yield
+        finally:
+            self.restore(saved)
     
     def interpolate_snapshot(self, render_time: float) -> Union[None, Snapshot]:
-        if len(self.snapshot_buffer) < 2: return None
-        
-        for i in range(len(self.snapshot_buffer) - 1):
-            s1 = self.snapshot_buffer[i]
-            s2 = self.snapshot_buffer[i+1]
-            if s1.time <= render_time <= s2.time:
-                # snapshots surround render_time
-                t = (render_time - s1.time) / (s2.time - s1.time)
-                
-                self._s1_time = s1.time
-                self._s2_time = s2.time
-                
-                updates_by_id = {}
-                for update in s1.entity_states:
-                    updates_by_id[update[0]] = update
-                
-                interpolated_updates = []
-                
-                for update in s2.entity_states:
-                    entity_id = update[0]
-                    if entity_id not in updates_by_id: continue
-                    
-                    old = updates_by_id[entity_id]
-                    new = update
-                    
-                    pos_x = old[1]*(1-t) + new[1]*t
-                    pos_y = old[2]*(1-t) + new[2]*t
-                    vel_x = old[3]*(1-t) + new[3]*t
-                    vel_y = old[4]*(1-t) + new[4]*t
-                    rotation = old[5]*(1-t) + new[5]*t
-                    rotational_velocity = old[6]*(1-t) + new[6]*t
-                    
-                    interpolated_updates.append((
-                        entity_id,
-                        pos_x, pos_y,
-                        vel_x, vel_y,
-                        rotation, rotational_velocity
-                    ))
-                
-                return Snapshot(0, render_time, interpolated_updates)
+        # snapshots older than render_delay are never needed again
+        self.snapshot_buffer.evict_before(render_time)
+        bracket = self.snapshot_buffer.bracket(render_time)
+        if bracket is None:
+            # past the newest snapshot (nothing changed since), hold it so
+            # the last interpolation step does not leave entities short of it
+            if len(self.snapshot_buffer) and render_time > self.snapshot_buffer[-1].time:
+                return self.snapshot_buffer[-1]
+            return None
+        
+        s1, s2 = bracket
+        # snapshots surround render_time
+        t = (render_time - s1.time) / (s2.time - s1.time) if s2.time > s1.time else 1.0
+        
+        self._s1_time = s1.time
+        self._s2_time = s2.time
+        
+        if s1.ids is not None:
+            ids, states = interpolate_arrays(s1, s2, t)
+            return Snapshot(0, render_time, ids=ids, states=states)
+        
+        old_states = s1.entity_states
+        old_rows = s1.index
+        interpolated_updates = []
+        
+        for update in s2.entity_states:
+            entity_id = update[0]
+            row = old_rows.get(entity_id)
+            if row is None: continue
+            
+            old = old_states[row]
+            new = update
+            
+            pos_x = old[1]*(1-t) + new[1]*t
+            pos_y = old[2]*(1-t) + new[2]*t
+            vel_x = old[3]*(1-t) + new[3]*t
+            vel_y = old[4]*(1-t) + new[4]*t
+            # quantized snapshots wrap the angle, so take the shortest arc
+            rotation = old[5] + ((new[5]-old[5]+math.pi) % math.tau - math.pi)*t
+            rotational_velocity = old[6]*(1-t) + new[6]*t
+            
+            interpolated_updates.append((
+                entity_id,
+                pos_x, pos_y,
+                vel_x, vel_y,
+                rotation, rotational_velocity
+            ))
+        
+        return Snapshot(0, render_time, interpolated_updates)
     
     def draw(self, surface: pygame.Surface):
         for entity in self.entities.values():
             entity.draw(surface)
+        if self.particle_system is not None:
+            self.particle_system.draw(surface)
         [p.draw(surface) for p in self.particles]
\ No newline at end of file
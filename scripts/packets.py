@@ -1,8 +1,14 @@
+import math
 import struct
-from typing import List, Tuple
+from typing import Dict, List, Tuple, Union
 import pygame
 from . import engine
 
+try:
+    import numpy as np
+except ImportError: # optional, the quantized snapshot packer falls back to a loop
+    np = None
+
 class PacketDefinitions:
     NetInitTCP = 1
     NetInitUDP = 2
@@ -14,9 +20,124 @@ class PacketDefinitions:
     EntityUpdateAttr = 303
     EntityUpdatePhys = 304
     EntityUpdatePhysMulti = 305
+    EntityUpdatePhysMultiQuantized = 306
+    EntityUpdatePhysDelta = 307
+    SnapshotAck = 308
+    PlayerInput = 309
+    InputAck = 310
     
     ClientSetLocalEntity = 401
 
+# custom packers write their packet after this many bytes, which
+# PacketHandler fills with the event type (reserves_type_prefix)
+TYPE_PREFIX_SIZE = engine.network.TYPE_STRUCT.size
+
+# EntityUpdatePhysMulti layout: header (reference_time, sequence, part, part_count, count)
+# followed by count records of id, vec2(x, y), vec2(vx, vy), angle, vangle.
+# Large snapshots are split into parts which share a sequence number
+PHYS_MULTI_HEADER = struct.Struct('<dIBBH')
+PHYS_RECORD = struct.Struct('<H2d4f')
+
+# EntityUpdatePhysMultiQuantized uses the same header, records are
+# id, u16 x, u16 y, i16 vx, i16 vy, u8 angle, i8 vangle (12 bytes instead of 34)
+PHYS_QUANTIZED_RECORD = struct.Struct('<HHHhhBb')
+PHYS_QUANTIZED_DTYPE = None if np is None else np.dtype([
+    ('id', '<u2'), ('position', '<u2', (2,)), ('velocity', '<i2', (2,)), ('angle', 'u1'), ('angular_velocity', 'i1')])
+
+# EntityUpdatePhysDelta layout: header (sequence, baseline_sequence, reference_time,
+# part, part_count, removed_count, count), removed_count entity ids, then count
+# records of (id, change mask) followed by only the fields whose mask bit is set
+PHYS_DELTA_HEADER = struct.Struct('<IIdBBHH')
+PHYS_DELTA_RECORD = struct.Struct('<HB')
+PHYS_DELTA_FIELDS = (
+    struct.Struct('<d'), struct.Struct('<d'),   # x, y
+    struct.Struct('<f'), struct.Struct('<f'),   # vx, vy
+    struct.Struct('<f'), struct.Struct('<f'))   # angle, vangle
+ENTITY_ID = struct.Struct('<H')
+
+# EntityUpdateAttr layout: header (count) followed by count records of
+# (id, change mask, data length) and the entity's packed replicated fields,
+# see Entity.pack_attributes. Only the entity knows its field formats
+ATTR_HEADER = struct.Struct('<H')
+ATTR_RECORD = struct.Struct('<HHB')
+# by data length, at most replication.MAX_REPLICATED_SIZE of them
+ATTR_RECORDS_WITH_DATA: Dict[int, struct.Struct] = {}
+
+def attr_record_with_data(length: int) -> struct.Struct:
+    """ATTR_RECORD followed by length bytes of data"""
+    record = ATTR_RECORDS_WITH_DATA.get(length)
+    if record is None:
+        record = ATTR_RECORDS_WITH_DATA[length] = struct.Struct(f'{ATTR_RECORD.format}{length}s')
+    return record
+
+def check_packet_size(data: bytes, size: int):
+    """custom unpackers reject packets which are not exactly size bytes,
+    so a truncated or padded packet is dropped as malformed"""
+    if len(data) != size:
+        raise struct.error(f"unpack requires a buffer of {size} bytes")
+
+def phys_delta_update_size(update: Tuple) -> int:
+    """size in bytes of one EntityUpdatePhysDelta record"""
+    size = PHYS_DELTA_RECORD.size
+    for value, field in zip(update[1:], PHYS_DELTA_FIELDS):
+        if value is not None:
+            size += field.size
+    return size
+
+# packets whose first arg is an entity id, see peek_entity_id
+ENTITY_ID_PACKETS = frozenset((
+    PacketDefinitions.EntityCreate,
+    PacketDefinitions.EntityDestroy,
+    PacketDefinitions.EntityUpdatePhys,
+    PacketDefinitions.ClientSetLocalEntity))
+
+def peek_entity_id(event: engine.network.Event) -> Union[int, None]:
+    """entity id of an ENTITY_ID_PACKETS event, read straight from the
+    payload of a lazy event without decoding the other args"""
+    if event.type not in ENTITY_ID_PACKETS:
+        return None
+    if event.payload is None:
+        return event.args[0]
+    return ENTITY_ID.unpack_from(event.payload, 2)[0]
+
+class PhysQuantization:
+    """Fixed-point ranges used by EntityUpdatePhysMultiQuantized.
+
+    Positions are spread over the full u16 range between the world bounds,
+    velocities are stored in int16 steps of 1/VELOCITY_SCALE, and the angle
+    is stored as a u8 (256 steps, well above the 16 rendered rotation
+    frames). Values outside a range are clamped."""
+    BOUNDS_MIN = (-100.0, -100.0)
+    BOUNDS_MAX = (300.0, 240.0)
+    VELOCITY_SCALE = 64.0         # +-512 units/s
+    ANGULAR_VELOCITY_SCALE = 16.0 # +-8 rad/s
+
+# PlayerInput layout: header (sequence of the newest command, count) followed by
+# count commands oldest first, each i8 x, i8 y, u8 flags, u8 dt in milliseconds.
+# Commands are consecutive, the last few unacknowledged ones are resent every
+# packet so a lost datagram does not lose input
+PLAYER_INPUT_HEADER = struct.Struct('<IB')
+PLAYER_INPUT_RECORD = struct.Struct('<bbBB')
+PLAYER_INPUT_BOOST = 1
+
+class InputQuantization:
+    """Fixed-point steps used by PlayerInput. The client predicts with the
+    quantized command, so it simulates exactly what the server will."""
+    AXIS_SCALE = 127    # input vector components in -1..1
+    DT_SCALE = 1000     # milliseconds
+    MAX_DT = 0.255
+
+def quantize_input(sequence: int, input_vector: pygame.Vector2, boost: bool, dt: float) -> Tuple[int, float, float, bool, float]:
+    """input command (sequence, x, y, boost, dt) as it will arrive on the server"""
+    axis = InputQuantization.AXIS_SCALE
+    dt_scale = InputQuantization.DT_SCALE
+    return (
+        sequence,
+        min(max(round(input_vector.x*axis), -axis), axis)/axis,
+        min(max(round(input_vector.y*axis), -axis), axis)/axis,
+        bool(boost),
+        min(max(round(dt*dt_scale), 1), round(InputQuantization.MAX_DT*dt_scale))/dt_scale)
+
 def get_packet_handler():
     packet_handler = engine.network.get_default_hybrid_packet_handler()
     
@@ -36,8 +157,38 @@ def get_packet_handler():
     
     @packet_handler.register(PacketDefinitions.EntityUpdateAttr)
     def entity_update_attr():
-        # id, hp, hpmax
-        return '<HII', None, None
+        # updates of (id, change mask, packed fields)
+        def packer(updates: List[Tuple[int, int, bytes]]):
+            # the packet, type prefix included, is written into one buffer of exactly the right size
+            record_size = ATTR_RECORD.size
+            offset = TYPE_PREFIX_SIZE + ATTR_HEADER.size
+            result = bytearray(offset + len(updates)*record_size + sum([len(data) for _, _, data in updates]))
+            ATTR_HEADER.pack_into(result, TYPE_PREFIX_SIZE, len(updates))
+            # consecutive records are usually the same entity class
+            length = -1
+            for id, mask, data in updates:
+                if len(data) != length:
+                    length = len(data)
+                    pack_into = attr_record_with_data(length).pack_into
+                pack_into(result, offset, id, mask, length, data)
+                offset += record_size + length
+            return result
+        
+        def unpacked(data: bytes):
+            count, = ATTR_HEADER.unpack_from(data)
+            offset = ATTR_HEADER.size
+            updates = []
+            for _ in range(count):
+                id, mask, length = ATTR_RECORD.unpack_from(data, offset)
+                offset += ATTR_RECORD.size
+                if offset+length > len(data):
+                    raise struct.error("EntityUpdateAttr record data is truncated")
+                updates.append((id, mask, bytes(data[offset:offset+length])))
+                offset += length
+            check_packet_size(data, offset)
+            return (updates,)
+        
+        return packer, unpacked, True
 
     @packet_handler.register(PacketDefinitions.EntityUpdatePhys)
     def entity_update_phys():
@@ -50,24 +201,194 @@ def get_packet_handler():
 
     @packet_handler.register(PacketDefinitions.EntityUpdatePhysMulti)
     def entity_update_phys_multi():
-        # id, vec2(x, y), vec2(vx, vy), angle, vangle
-        def packer(reference_time: float, entity_updates: List[Tuple[int, pygame.Vector2, pygame.Vector2, float, float]]):
-            result = b''
-            result += struct.pack('<dH', reference_time, len(entity_updates))
+        # reference_time, sequence, part, part_count, updates of (id, x, y, vx, vy, angle, vangle)
+        def packer(reference_time: float, sequence: int, part: int, part_count: int, entity_updates: List[Tuple[int, float, float, float, float, float, float]]):
+            # the packet, type prefix included, is written into one buffer of exactly the right size
+            record_size = PHYS_RECORD.size
+            offset = TYPE_PREFIX_SIZE + PHYS_MULTI_HEADER.size
+            result = bytearray(offset + len(entity_updates)*record_size)
+            PHYS_MULTI_HEADER.pack_into(result, TYPE_PREFIX_SIZE, reference_time, sequence, part, part_count, len(entity_updates))
+            pack_into = PHYS_RECORD.pack_into
             for update in entity_updates:
-                result += struct.pack('<H2d4f', update[0], update[1], update[2], update[3], update[4], update[5], update[6])
+                pack_into(result, offset, *update)
+                offset += record_size
             return result
         
         def unpacked(data: bytes):
+            reference_time, sequence, part, part_count, count = PHYS_MULTI_HEADER.unpack_from(data)
+            offset = PHYS_MULTI_HEADER.size
+            check_packet_size(data, offset + count*PHYS_RECORD.size)
+            records = memoryview(data)[offset:]
+            return (reference_time, sequence, part, part_count, list(PHYS_RECORD.iter_unpack(records)))
+        
+        return packer, unpacked, True
+    
+    @packet_handler.register(PacketDefinitions.EntityUpdatePhysMultiQuantized)
+    def entity_update_phys_multi_quantized():
+        # id, x, y, vx, vy, angle, vangle - same args as EntityUpdatePhysMulti
+        min_x, min_y = PhysQuantization.BOUNDS_MIN
+        max_x, max_y = PhysQuantization.BOUNDS_MAX
+        scale_x = 65535/(max_x-min_x)
+        scale_y = 65535/(max_y-min_y)
+        scale_v = PhysQuantization.VELOCITY_SCALE
+        scale_va = PhysQuantization.ANGULAR_VELOCITY_SCALE
+        scale_a = 256/math.tau
+        if np is not None:
+            # per field of (x, y, vx, vy, angle, vangle), the angle wraps instead of clamping
+            field_offset = np.array((min_x, min_y, 0, 0, 0, 0))
+            field_scale = np.array((scale_x, scale_y, scale_v, scale_v, scale_a, scale_va))
+            field_min = np.array((0, 0, -32768, -32768, -np.inf, -128))
+            field_max = np.array((65535, 65535, 32767, 32767, np.inf, 127))
+        
+        def packer(reference_time: float, sequence: int, part: int, part_count: int, entity_updates: List[Tuple[int, float, float, float, float, float, float]]):
+            record_size = PHYS_QUANTIZED_RECORD.size
+            offset = TYPE_PREFIX_SIZE + PHYS_MULTI_HEADER.size
+            result = bytearray(offset + len(entity_updates)*record_size)
+            PHYS_MULTI_HEADER.pack_into(result, TYPE_PREFIX_SIZE, reference_time, sequence, part, part_count, len(entity_updates))
+            if np is not None and entity_updates:
+                # every field of every record at once, written straight into result
+                states = np.array(entity_updates, np.float64)
+                fields = states[:, 1:] - field_offset
+                fields *= field_scale
+                np.rint(fields, out=fields)
+                np.maximum(fields, field_min, out=fields)
+                np.minimum(fields, field_max, out=fields)
+                records = np.frombuffer(result, PHYS_QUANTIZED_DTYPE, len(entity_updates), offset)
+                records['id'] = states[:, 0]
+                records['position'] = fields[:, 0:2]
+                records['velocity'] = fields[:, 2:4]
+                records['angle'] = np.mod(fields[:, 4], 256)
+                records['angular_velocity'] = fields[:, 5]
+                return result
+            
+            pack_into = PHYS_QUANTIZED_RECORD.pack_into
+            for id, x, y, vx, vy, a, va in entity_updates:
+                pack_into(
+                    result, offset, id,
+                    min(max(round((x-min_x)*scale_x), 0), 65535),
+                    min(max(round((y-min_y)*scale_y), 0), 65535),
+                    min(max(round(vx*scale_v), -32768), 32767),
+                    min(max(round(vy*scale_v), -32768), 32767),
+                    round(a*scale_a) & 0xFF,
+                    min(max(round(va*scale_va), -128), 127))
+                offset += record_size
+            return result
+        
+        def unpacked(data: bytes):
+            reference_time, sequence, part, part_count, count = PHYS_MULTI_HEADER.unpack_from(data)
+            offset = PHYS_MULTI_HEADER.size
+            check_packet_size(data, offset + count*PHYS_QUANTIZED_RECORD.size)
+            records = memoryview(data)[offset:]
+            return (reference_time, sequence, part, part_count, [
+                (id, min_x + x/scale_x, min_y + y/scale_y,
+                 vx/scale_v, vy/scale_v, a/scale_a, va/scale_va)
+                for id, x, y, vx, vy, a, va in PHYS_QUANTIZED_RECORD.iter_unpack(records)])
+        
+        return packer, unpacked, True
+    
+    @packet_handler.register(PacketDefinitions.EntityUpdatePhysDelta)
+    def entity_update_phys_delta():
+        # sequence, baseline_sequence, reference_time, part, part_count, removed ids,
+        # updates of (id, x, y, vx, vy, angle, vangle) where unchanged fields are None
+        def packer(sequence: int, baseline_sequence: int, reference_time: float, part: int, part_count: int, removed_ids: List[int], entity_updates: List[Tuple]):
+            masks = []
+            size = TYPE_PREFIX_SIZE + PHYS_DELTA_HEADER.size + len(removed_ids)*ENTITY_ID.size
+            for update in entity_updates:
+                mask = 0
+                size += PHYS_DELTA_RECORD.size
+                for i, field in enumerate(PHYS_DELTA_FIELDS):
+                    if update[i+1] is not None:
+                        mask |= 1 << i
+                        size += field.size
+                masks.append(mask)
+            
+            result = bytearray(size)
+            PHYS_DELTA_HEADER.pack_into(result, TYPE_PREFIX_SIZE, sequence, baseline_sequence, reference_time, part, part_count, len(removed_ids), len(entity_updates))
+            offset = TYPE_PREFIX_SIZE + PHYS_DELTA_HEADER.size
+            for id in removed_ids:
+                ENTITY_ID.pack_into(result, offset, id)
+                offset += ENTITY_ID.size
+            for update, mask in zip(entity_updates, masks):
+                PHYS_DELTA_RECORD.pack_into(result, offset, update[0], mask)
+                offset += PHYS_DELTA_RECORD.size
+                for i, field in enumerate(PHYS_DELTA_FIELDS):
+                    if mask & (1 << i):
+                        field.pack_into(result, offset, update[i+1])
+                        offset += field.size
+            return result
+        
+        def unpacked(data: bytes):
+            sequence, baseline_sequence, reference_time, part, part_count, removed_count, count = PHYS_DELTA_HEADER.unpack_from(data)
+            offset = PHYS_DELTA_HEADER.size
+            if len(data) < offset + removed_count*ENTITY_ID.size:
+                raise struct.error("EntityUpdatePhysDelta removed ids are truncated")
+            ids = memoryview(data)[offset:offset + removed_count*ENTITY_ID.size]
+            removed_ids = [id for id, in ENTITY_ID.iter_unpack(ids)]
+            offset += removed_count*ENTITY_ID.size
             updates = []
-            reference_time, count, = struct.unpack_from('<dH', data)
-            offset = 8+2
             for _ in range(count):
-                updates.append(struct.unpack_from('<H2d4f', data, offset))
-                offset += 2 + 2*8 + 4*4 # one unsigned short, 2 doubles, 4 floats
-            return (reference_time, updates)
+                id, mask = PHYS_DELTA_RECORD.unpack_from(data, offset)
+                offset += PHYS_DELTA_RECORD.size
+                update = [id]
+                for i, field in enumerate(PHYS_DELTA_FIELDS):
+                    if mask & (1 << i):
+                        update.append(field.unpack_from(data, offset)[0])
+                        offset += field.size
+                    else:
+                        update.append(None)
+                updates.append(tuple(update))
+            check_packet_size(data, offset)
+            return (sequence, baseline_sequence, reference_time, part, part_count, removed_ids, updates)
+        
+        return packer, unpacked, True
+    
+    @packet_handler.register(PacketDefinitions.SnapshotAck)
+    def snapshot_ack():
+        # sequence
+        return '<I', None, None
+    
+    @packet_handler.register(PacketDefinitions.PlayerInput)
+    def player_input():
+        # commands of (sequence, x, y, boost, dt), consecutive sequences oldest first
+        axis = InputQuantization.AXIS_SCALE
+        dt_scale = InputQuantization.DT_SCALE
         
-        return packer, unpacked
+        def packer(commands: List[Tuple[int, float, float, bool, float]]):
+            record_size = PLAYER_INPUT_RECORD.size
+            offset = TYPE_PREFIX_SIZE + PLAYER_INPUT_HEADER.size
+            result = bytearray(offset + len(commands)*record_size)
+            PLAYER_INPUT_HEADER.pack_into(result, TYPE_PREFIX_SIZE, commands[-1][0] if commands else 0, len(commands))
+            pack_into = PLAYER_INPUT_RECORD.pack_into
+            for _, x, y, boost, dt in commands:
+                pack_into(
+                    result, offset,
+                    min(max(round(x*axis), -axis), axis),
+                    min(max(round(y*axis), -axis), axis),
+                    PLAYER_INPUT_BOOST if boost else 0,
+                    min(max(round(dt*dt_scale), 1), 255))
+                offset += record_size
+            return result
+        
+        def unpacked(data: bytes):
+            sequence, count = PLAYER_INPUT_HEADER.unpack_from(data)
+            offset = PLAYER_INPUT_HEADER.size
+            # the count gives every command its sequence, it has to match
+            check_packet_size(data, offset + count*PLAYER_INPUT_RECORD.size)
+            if count > sequence:
+                raise struct.error("PlayerInput has more commands than sequence numbers")
+            records = memoryview(data)[offset:]
+            first = sequence-count+1
+            return ([
+                (first+i, x/axis, y/axis, bool(flags & PLAYER_INPUT_BOOST), dt/dt_scale)
+                for i, (x, y, flags, dt) in enumerate(PLAYER_INPUT_RECORD.iter_unpack(records))],)
+        
+        return packer, unpacked, True
+    
+    @packet_handler.register(PacketDefinitions.InputAck)
+    def input_ack():
+        # last processed input sequence, then the state it left the
+        # client's entity in: vec2(x, y), vec2(vx, vy), angle, vangle
+        return '<I2d4f', None, None
     
     @packet_handler.register(PacketDefinitions.ClientSetLocalEntity)
     def client_set_local_entity():
@@ -81,9 +402,10 @@ def test():
     
     bytes_ = p.pack(engine.network.Event(
         PacketDefinitions.EntityUpdatePhysMulti,
+        1.5, 1, 0, 1,
         [
-            (0, pygame.Vector2(2, 3), pygame.Vector2(0.1, 0.5), 45, 0),
-            (1, pygame.Vector2(8, 2), pygame.Vector2(0.0, -5), -90, 0)
+            (0, 2, 3, 0.1, 0.5, 45, 0),
+            (1, 8, 2, 0.0, -5, -90, 0)
         ]
     ))
     
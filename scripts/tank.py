@@ -5,6 +5,9 @@ import pygame
 from . import engine
 
 class TankEntity(engine.Entity):
+    hp = engine.Replicated('i', 100)
+    hp_max = engine.Replicated('i', 100)
+    
     def __init__(self, id: int, world: engine.World, position: pygame.Vector2, with_renderer: bool = True):
         super().__init__(
             id,
@@ -24,7 +27,10 @@ class TankEntity(engine.Entity):
         return pygame.Vector2(math.sin(-self.rotation), math.cos(-self.rotation))
     
     def process_inputs(self, dt: float, input_vector: pygame.Vector2, keys_held: pygame.key.ScancodeWrapper):
-        movement_speed = 800 if not keys_held[pygame.K_LSHIFT] else 1400
+        self.apply_input(dt, input_vector, keys_held[pygame.K_LSHIFT])
+    
+    def apply_input(self, dt: float, input_vector: pygame.Vector2, boost: bool):
+        movement_speed = 800 if not boost else 1400
         self.rotation += input_vector.x*5*dt
         self.velocity = pygame.Vector2(
             math.sin(-self.rotation)*input_vector.y*movement_speed*dt,
@@ -38,13 +44,13 @@ class TankEntity(engine.Entity):
         self.timer_smoke_particle.timeout_max = tick_duration
         if self.timer_smoke_particle.tick(dt):
             c = random.randint(60, 110)
-            self.world.particles.append(engine.Particle(
+            self.world.spawn_particle(
                 self.position+pygame.Vector2(0, -15),
                 pygame.Vector2(random.uniform(-18, 18), -16+random.uniform(-18, 18)),
                 drag=2,
                 lifetime=random.uniform(0.5, 1),
                 linear_acceleration=pygame.Vector2(0, -10),
-                color=(c, c, c)))
+                color=(c, c, c))
 
 class TankRenderer(engine.entity.EntityRenderer):
     def __init__(self, entity_id: int):
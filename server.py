@@ -10,6 +10,13 @@ from scripts.tank import TankEntity
 class ClientModel():
     def __init__(self):
         self.entity_id: str = None
+        self.snapshot_encoder = engine.DeltaSnapshotEncoder()
+        # bounds the snapshot bytes per tick, nearby / fast entities go first
+        self.snapshot_scheduler = engine.SnapshotScheduler()
+        # entities this client has been sent EntityCreate for
+        self.interest = engine.InterestScope()
+        # PlayerInput commands already simulated for this client's tank
+        self.inputs = engine.InputReceiver()
 
 packet_handler = packets.get_packet_handler()
 server_ip = engine.network.Utility.get_local_ip()
@@ -19,72 +26,150 @@ system = engine.network.HSystem(server_ip, server_port_tcp, server_port_udp, Cli
 
 print(f'Server running on {server_ip}:{server_port_tcp}')
 
-world = engine.world.World(get_entity_registry(), is_server=True)
+world = engine.world.World(get_entity_registry(), is_server=True, delta_snapshots=True)
 # server_entity = engine.Entity(world, pygame.Vector2(50, 50), pygame.Vector2(32, 32), None)
 # server_entity.id = 1
 # world.create_entity(server_entity, True)
 
-elapsed = 0
+# 20 simulation ticks per second, snapshots go out at 10 per second
+scheduler = engine.TickScheduler(tick_rate=20, send_rate=10)
+# seconds between the tick and traffic reports
+report_interval = 30
+next_report = time.monotonic() + report_interval
+
 ct = 0.0
 while True:
-    now = time.time()
-    dt = 0.1
-    ct += dt
+    ticks = scheduler.wait()
     
-    # server_entity.position.x = 100+math.sin(ct*10)*20
+    # server_entity.position = pygame.Vector2(100+math.sin(ct*10)*20, server_entity.position.y)
     
-    r = system.pump()
+    with scheduler.phase('pump'):
+        r = system.pump()
     
-    for client in r.new_clients:
-        print('Connected:', client.addr_tcp)
-        
-        client_entity = TankEntity(-1, world, pygame.Vector2(0, 0), False)
-        
-        client_model: ClientModel = client.model
-        client_model.entity_id = client_entity.id
-        
-        # Send entities to this new client
-        for entity in world.entities.values():
-            e = engine.network.Event(packets.PacketDefinitions.EntityCreate, entity.id, entity.type_id)
+    with scheduler.phase('events'):
+        for client in r.new_clients:
+            print('Connected:', client.addr_tcp)
+            
+            client_entity = TankEntity(-1, world, pygame.Vector2(0, 0), False)
+            
+            client_model: ClientModel = client.model
+            client_model.entity_id = client_entity.id
+            
+            world.create_entity(client_entity, False)
+            
+            # the client's own tank is always in scope, other entities
+            # are sent as they come into view (see the interest update below)
+            client_model.interest.in_scope.add(client_entity.id)
+            e = engine.network.Event(packets.PacketDefinitions.EntityCreate, client_entity.id, client_entity.type_id)
             system.send_event_tcp(e, client.conn)
+            e = world.build_attribute_event((client_entity.id,), full=True)
+            if e is not None: system.send_event_tcp(e, client.conn)
             
-        world.create_entity(client_entity, False)
+            system.send_event_tcp(engine.network.Event(packets.PacketDefinitions.ClientSetLocalEntity, client_entity.id, True), client.conn)
+            # full (non delta) snapshots leave parked entities out, the new
+            # client has never seen them. delta snapshots send it everything
+            # against an empty baseline
+            if not world.delta_snapshots:
+                world.request_keyframe()
         
-        # Alert all clients of this new entity
-        for other_client in system.clients.values():
-            e = engine.network.Event(packets.PacketDefinitions.EntityCreate, client_entity.id, client_entity.type_id)
-            system.send_event_tcp(e, other_client.conn)
+        for client in r.disconnected_clients:
+            print('Disconnected:', client.addr_tcp)
+            client_model: ClientModel = client.model
+            entity_id = client_model.entity_id
+            # clients which had it in scope are sent EntityDestroy by the interest update
+            world.destroy_entity(entity_id)
+            
+        for client, event in r.events_tcp:
+            # print('tcp:', event)
+            world.handle_network_event(event)
+            
+            if event.type == packets.PacketDefinitions.RTTPing and not event.args[0]:
+                system.send_event_tcp(engine.network.Event(packets.PacketDefinitions.RTTPing, True), event.from_connection)
         
-        system.send_event_tcp(engine.network.Event(packets.PacketDefinitions.ClientSetLocalEntity, client_entity.id, True), client.conn)
+        # clients only send inputs and acks, physics they send is not trusted
+        for client, event in r.events_udp:
+            # print('udp:', event)
+            if event.type == packets.PacketDefinitions.SnapshotAck:
+                client.model.snapshot_encoder.acknowledge(event.args[0])
+                continue
+            if event.type == packets.PacketDefinitions.PlayerInput:
+                # tanks only move by the inputs they are sent, the same
+                # simulate_input the client predicts with
+                client_entity = world.entities.get(client.model.entity_id)
+                if client_entity is None: continue
+                commands, = event.args
+                for _, x, y, boost, dt in client.model.inputs.receive(commands):
+                    client_entity.simulate_input(dt, pygame.Vector2(x, y), boost)
     
-    for client in r.disconnected_clients:
-        print('Disconnected:', client.addr_tcp)
-        client_model: ClientModel = client.model
-        entity_id = client_model.entity_id
-        world.destroy_entity(entity_id)
-        system.send_event_tcp(engine.network.Event(packets.PacketDefinitions.EntityDestroy, entity_id))
-        
-    for client, event in r.events_tcp:
-        # print('tcp:', event)
-        world.handle_network_event(event)
-        
-        if event.type == packets.PacketDefinitions.RTTPing and not event.args[0]:
-            system.send_event_tcp(engine.network.Event(packets.PacketDefinitions.RTTPing, True), event.from_connection)
+    with scheduler.phase('update'):
+        for _ in range(ticks):
+            world.update(scheduler.dt)
+            ct += scheduler.dt
+        # inputs may only simulate as much time as the server did
+        for client in system.clients.values():
+            client.model.inputs.tick(ticks*scheduler.dt)
+    
+    if scheduler.should_send():
+        with scheduler.phase('snapshot'):
+            world_events = world.pump_network_events()
+            for event in world_events[0]:
+                system.send_event_tcp(event)
+            for event in world_events[1]:
+                system.send_event_udp(event)
+            # changed replicated attributes, packed once and sent to the
+            # clients which have the entity in scope
+            attribute_updates = world.take_attribute_updates()
+            
+            for client in system.clients.values():
+                client_model: ClientModel = client.model
+                client_entity = world.entities.get(client_model.entity_id)
+                if client_entity is None: continue
+                
+                # entities entering / leaving this client's view
+                entered, left = client_model.interest.update(
+                    world.spatial_hash, client_entity.position, (client_entity.id,))
+                for entity_id in entered:
+                    e = engine.network.Event(packets.PacketDefinitions.EntityCreate, entity_id, world.entities[entity_id].type_id)
+                    system.send_event_tcp(e, client.conn)
+                # changes before they came into view were not applied by the client
+                e = world.build_attribute_event(entered, full=True)
+                if e is not None: system.send_event_tcp(e, client.conn)
+                entered_ids = set(entered)
+                e = world.build_attribute_event(
+                    [entity_id for entity_id in attribute_updates
+                     if entity_id in client_model.interest.in_scope and entity_id not in entered_ids],
+                    updates=attribute_updates)
+                if e is not None: system.send_event_tcp(e, client.conn)
+                for entity_id in left:
+                    system.send_event_tcp(engine.network.Event(packets.PacketDefinitions.EntityDestroy, entity_id), client.conn)
+                
+                if client.addr_udp is None: continue
+                
+                # the state of its tank after the last input command, for
+                # the client to check its prediction against
+                if client_model.inputs.last_sequence:
+                    system.send_event_udp(engine.network.Event(
+                        packets.PacketDefinitions.InputAck,
+                        client_model.inputs.last_sequence, *client_entity.get_phys_state()[1:]), client.addr_udp)
+                
+                # every client gets its own delta of the entities in its scope,
+                # against the last snapshot it acknowledged
+                phys_states = world.get_phys_states(client_model.interest.in_scope)
+                for event in world.build_delta_snapshot_events(
+                        client_model.snapshot_encoder, phys_states,
+                        client_model.snapshot_scheduler, client_entity.position):
+                    system.send_event_udp(event, client.addr_udp)
     
-    for client, event in r.events_udp:
-        # print('udp:', event)
-        world.handle_network_event(event)
+    with scheduler.phase('send'):
+        system.flush()
     
-    world.update(dt)
-    world_events = world.pump_network_events()
-    for event in world_events[0]:
-        system.send_event_tcp(event)
-    for event in world_events[1]:
-        system.send_event_udp(event)
+    scheduler.end_tick()
     
-    elapsed = time.time() - now
-    added_delay = 0.1 - elapsed
-    if added_delay > 0:
-        time.sleep(added_delay)
-    else:
-        ... # Server is running slow, log this?
\ No newline at end of file
+    if time.monotonic() > next_report:
+        next_report += report_interval
+        print(scheduler.report())
+        # counted since the last report
+        udp = system.take_udp_send_stats()
+        print(
+            f'udp sent {udp.datagrams_sent} datagrams {udp.bytes_sent/1024:.1f} KiB'
+            f' ({udp.bytes_sent/1024/report_interval:.2f} KiB/s) dropped {udp.datagrams_dropped}')
@@ -0,0 +1,38 @@
+import asyncio
+from scripts import engine, packets
+
+class ClientModel():
+    def __init__(self):
+        ...
+
+server_ip = engine.network.Utility.get_local_ip()
+server_port_tcp = 9183
+server_port_udp = 9184
+
+async def main():
+    system = engine.network_async.AsyncHSystem(
+        server_ip,
+        server_port_tcp,
+        server_port_udp,
+        ClientModel,
+        packets.get_packet_handler()
+    )
+    await system.start()
+
+    # no polling, each iteration wakes up only when something happened
+    async for r in system:
+        for c in r.new_clients:
+            print('new client', c.addr_tcp)
+
+        for c in r.disconnected_clients:
+            print('disconnected client', c.addr_tcp)
+
+        for c, e in r.events_tcp:
+            print('tcp', e.type, e.args)
+            if e.type == 4 and not e.args[0]: # rtt_ping request
+                await system.send_event_tcp(engine.network.Event(4, True), e.from_connection)
+
+        for c, e in r.events_udp:
+            print('udp', e.type, e.args)
+
+asyncio.run(main())
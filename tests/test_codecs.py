@@ -0,0 +1,245 @@
+import math
+import random
+import struct
+
+import pygame
+import pytest
+
+from scripts import packets
+from scripts.engine.network import Event, PacketHandler, TYPE_STRUCT
+from scripts.packets import PacketDefinitions
+
+packet_handler = packets.get_packet_handler()
+
+
+def round_trip(type_: int, *args) -> tuple:
+    data = packet_handler.pack(Event(type_, *args))
+    return packet_handler.unpack(bytes(data)).args
+
+
+def test_simple_round_trips():
+    assert round_trip(PacketDefinitions.NetInitFinal) == ()
+    assert round_trip(PacketDefinitions.EntityDestroy, 812) == (812,)
+    assert round_trip(PacketDefinitions.EntityCreate, 812, 'tank') == (812, 'tank')
+    id, position, velocity, angle, angular_velocity = round_trip(
+        PacketDefinitions.EntityUpdatePhys, 812, pygame.Vector2(100.5, 70.25), pygame.Vector2(3, -2), 1.5, 0.0)
+    assert (id, position, velocity, angle, angular_velocity) == (812, (100.5, 70.25), (3, -2), 1.5, 0.0)
+
+
+def test_type_prefix_is_part_of_the_packed_event():
+    data = packet_handler.pack(Event(PacketDefinitions.EntityDestroy, 812))
+    assert data == struct.pack('<HH', PacketDefinitions.EntityDestroy, 812)
+
+
+def test_other_byte_orders():
+    handler = PacketHandler()
+    handler.add_handler(7, '!I')
+    data = handler.pack(Event(7, 1))
+    assert data == struct.pack('<H', 7)+struct.pack('!I', 1)
+    assert handler.unpack(data).args == (1,)
+
+
+def test_wrong_size_is_rejected():
+    data = packet_handler.pack(Event(PacketDefinitions.EntityDestroy, 812))
+    with pytest.raises(struct.error):
+        packet_handler.unpack(data[:-1])
+    with pytest.raises(struct.error):
+        packet_handler.unpack(data+b'\x00')
+
+
+def test_unknown_type_is_rejected():
+    with pytest.raises(ValueError):
+        packet_handler.pack(Event(999))
+    with pytest.raises(ValueError):
+        packet_handler.unpack(struct.pack('<H', 999))
+
+
+def assert_malformed(data: bytes):
+    with pytest.raises((ValueError, struct.error)):
+        packet_handler.unpack(data)
+
+
+def truncations(data: bytes):
+    """data cut short at every length past the type prefix, and padded"""
+    for length in range(TYPE_STRUCT.size, len(data)):
+        yield data[:length]
+    yield data+b'\x00'
+
+
+PHYS_RECORDS = [
+    (1, 2.5, -3.0, 0.5, -0.25, 1.0, 0.0),
+    (65535, 100.125, 200.0, -5.0, 4.0, -2.0, 0.75)]
+
+CODEC_EVENTS = [
+    (PacketDefinitions.EntityUpdatePhysMulti, (1.5, 7, 0, 1, PHYS_RECORDS)),
+    (PacketDefinitions.EntityUpdatePhysMultiQuantized, (1.5, 7, 0, 1, PHYS_RECORDS)),
+    (PacketDefinitions.EntityUpdatePhysDelta, (9, 4, 1.5, 0, 1, [3, 5], [(1, 2.5, None, None, 1.0, None, 0.5)])),
+    (PacketDefinitions.PlayerInput, ([(4, 1.0, -1.0, True, 0.016), (5, 0.0, 0.5, False, 0.255)],)),
+    (PacketDefinitions.EntityUpdateAttr, ([(1, 3, b'\x01\x00\x00\x00\x02\x00\x00\x00'), (2, 1, b'')],)),
+]
+
+
+def test_phys_multi_round_trip():
+    reference_time, sequence, part, part_count, records = round_trip(
+        PacketDefinitions.EntityUpdatePhysMulti, 1.5, 7, 2, 3, PHYS_RECORDS)
+    assert (reference_time, sequence, part, part_count) == (1.5, 7, 2, 3)
+    # positions are f64, the rest f32
+    for record, expected in zip(records, PHYS_RECORDS):
+        assert record[:3] == expected[:3]
+        assert record[3:] == pytest.approx(expected[3:])
+
+
+def test_phys_multi_size():
+    data = packet_handler.pack(Event(PacketDefinitions.EntityUpdatePhysMulti, 0.0, 1, 0, 1, PHYS_RECORDS))
+    assert len(data) == 2 + packets.PHYS_MULTI_HEADER.size + len(PHYS_RECORDS)*packets.PHYS_RECORD.size
+    assert round_trip(PacketDefinitions.EntityUpdatePhysMulti, 0.0, 1, 0, 1, []) == (0.0, 1, 0, 1, [])
+
+
+def angle_error(a: float, b: float) -> float:
+    return abs((a-b+math.pi) % math.tau - math.pi)
+
+
+def test_phys_multi_quantized_round_trip():
+    *header, records = round_trip(PacketDefinitions.EntityUpdatePhysMultiQuantized, 1.5, 7, 0, 1, PHYS_RECORDS)
+    assert header == [1.5, 7, 0, 1]
+    for record, expected in zip(records, PHYS_RECORDS):
+        assert record[0] == expected[0]
+        assert record[1:5] == pytest.approx(expected[1:5], abs=0.01)
+        assert record[6] == pytest.approx(expected[6], abs=0.04)
+        # the angle is wrapped into one turn
+        assert angle_error(record[5], expected[5]) < 0.02
+
+
+def test_phys_multi_quantized_clamps():
+    _, _, _, _, records = round_trip(
+        PacketDefinitions.EntityUpdatePhysMultiQuantized, 0.0, 1, 0, 1, [(1, -1e6, 1e6, 1e6, -1e6, 0.0, 1e6)])
+    _, x, y, vx, vy, _, va = records[0]
+    assert (x, y) == pytest.approx((packets.PhysQuantization.BOUNDS_MIN[0], packets.PhysQuantization.BOUNDS_MAX[1]))
+    assert vx > 0 > vy and va > 0
+
+
+
+def random_phys_records(count: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    (min_x, min_y), (max_x, max_y) = packets.PhysQuantization.BOUNDS_MIN, packets.PhysQuantization.BOUNDS_MAX
+    return [(
+        entity_id, rng.uniform(min_x, max_x), rng.uniform(min_y, max_y), rng.uniform(-500, 500),
+        rng.uniform(-500, 500), rng.uniform(-10, 10), rng.uniform(-7.9, 7.9)) for entity_id in range(count)]
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_phys_multi_quantized_precision(monkeypatch, use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(packets, 'np', None)
+    quantization = packets.PhysQuantization
+    (min_x, min_y), (max_x, max_y) = quantization.BOUNDS_MIN, quantization.BOUNDS_MAX
+    expected = random_phys_records(500)
+    *_, records = round_trip(PacketDefinitions.EntityUpdatePhysMultiQuantized, 0.0, 1, 0, 1, expected)
+    # every field is within half a step of its original value
+    for record, state in zip(records, expected):
+        assert record[0] == state[0]
+        assert abs(record[1]-state[1]) <= (max_x-min_x)/65535/2 + 1e-9
+        assert abs(record[2]-state[2]) <= (max_y-min_y)/65535/2 + 1e-9
+        assert abs(record[3]-state[3]) <= 0.5/quantization.VELOCITY_SCALE + 1e-9
+        assert abs(record[4]-state[4]) <= 0.5/quantization.VELOCITY_SCALE + 1e-9
+        assert angle_error(record[5], state[5]) <= math.pi/256 + 1e-9
+        assert abs(record[6]-state[6]) <= 0.5/quantization.ANGULAR_VELOCITY_SCALE + 1e-9
+
+
+def test_phys_multi_quantized_numpy_matches_loop(monkeypatch):
+    pytest.importorskip('numpy')
+    # in range, out of range and negative angles
+    states = random_phys_records(200) + [(1, -1e6, 1e6, 1e6, -1e6, -100.0, 1e6), (2, 1e6, -1e6, -1e6, 1e6, 100.0, -1e6)]
+    args = (0.0, 1, 0, 1, states)
+    vectorized = packet_handler.pack(Event(PacketDefinitions.EntityUpdatePhysMultiQuantized, *args))
+    monkeypatch.setattr(packets, 'np', None)
+    assert vectorized == packet_handler.pack(Event(PacketDefinitions.EntityUpdatePhysMultiQuantized, *args))
+
+def test_phys_delta_round_trip():
+    args = (9, 4, 1.5, 0, 1, [3, 5], [(1, 2.5, None, None, 1.0, None, 0.5), (2, None, None, None, None, None, None)])
+    assert round_trip(PacketDefinitions.EntityUpdatePhysDelta, *args) == args
+
+
+def test_phys_delta_carries_only_changed_fields():
+    full = packet_handler.pack(Event(PacketDefinitions.EntityUpdatePhysDelta, 1, 0, 0.0, 0, 1, [], [(1, 2.5, 1.0, 0.0, 0.0, 1.0, 0.5)]))
+    delta = packet_handler.pack(Event(PacketDefinitions.EntityUpdatePhysDelta, 1, 0, 0.0, 0, 1, [], [(1, 2.5, None, None, None, None, None)]))
+    assert len(full)-len(delta) == 8 + 4*4
+
+
+def test_phys_delta_update_size_matches_packet():
+    update = (1, 2.5, None, None, 1.0, None, 0.5)
+    data = packet_handler.pack(Event(PacketDefinitions.EntityUpdatePhysDelta, 1, 0, 0.0, 0, 1, [], [update]))
+    assert len(data) == 2 + packets.PHYS_DELTA_HEADER.size + packets.phys_delta_update_size(update)
+
+
+def test_player_input_round_trip():
+    commands = [(4, 1.0, -1.0, True, 0.016), (5, 0.0, 0.5, False, 0.255)]
+    (result,) = round_trip(PacketDefinitions.PlayerInput, commands)
+    assert [command[0] for command in result] == [4, 5]
+    assert result[0][3] is True and result[1][3] is False
+    for command, expected in zip(result, commands):
+        assert command[1:] == pytest.approx(expected[1:], abs=1/127)
+
+
+def test_player_input_count_must_match_records():
+    data = bytearray(packet_handler.pack(Event(PacketDefinitions.PlayerInput, [(5, 1.0, 0.0, False, 0.016)])))
+    # count=3 with a single record would label the command 3 instead of 5
+    packets.PLAYER_INPUT_HEADER.pack_into(data, TYPE_STRUCT.size, 5, 3)
+    assert_malformed(bytes(data))
+    # more commands than sequence numbers
+    packets.PLAYER_INPUT_HEADER.pack_into(data, TYPE_STRUCT.size, 0, 1)
+    assert_malformed(bytes(data))
+
+def test_entity_update_attr_round_trip():
+    updates = [(1, 3, b'\x01\x00\x00\x00\x02\x00\x00\x00'), (2, 1, b'')]
+    assert round_trip(PacketDefinitions.EntityUpdateAttr, updates) == (updates,)
+
+
+def test_entity_update_attr_size():
+    updates = [(entity_id, 1, bytes([entity_id])*(entity_id % 3)) for entity_id in range(10)]
+    data = packet_handler.pack(Event(PacketDefinitions.EntityUpdateAttr, updates))
+    assert len(data) == TYPE_STRUCT.size + packets.ATTR_HEADER.size + sum(
+        packets.ATTR_RECORD.size + len(record[2]) for record in updates)
+    assert packet_handler.unpack(bytes(data)).args == (updates,)
+
+
+def test_fixed_size_packets_are_length_checked_lazily():
+    data = packet_handler.pack(Event(PacketDefinitions.SnapshotAck, 12))
+    assert packet_handler.unpack_lazy(data).args == (12,)
+    with pytest.raises(struct.error):
+        packet_handler.unpack_lazy(data[:-1])
+
+
+def test_lazy_args_are_decoded_once():
+    data = packet_handler.pack(Event(PacketDefinitions.EntityCreate, 812, 'tank'))
+    event = packet_handler.unpack_lazy(data)
+    assert event.type == PacketDefinitions.EntityCreate and event.payload == data
+    assert event.args == (812, 'tank')
+    # the payload is released once decoded
+    assert event.payload is None
+
+
+def test_peek_entity_id_does_not_decode():
+    data = packet_handler.pack(Event(
+        PacketDefinitions.EntityUpdatePhys, 42, pygame.Vector2(1, 2), pygame.Vector2(0, 0), 0.0, 0.0))
+    event = packet_handler.unpack_lazy(data)
+    assert packets.peek_entity_id(event) == 42
+    assert event.payload is not None
+    assert event.args[0] == 42
+    assert packets.peek_entity_id(Event(PacketDefinitions.SnapshotAck, 1)) is None
+
+
+@pytest.mark.parametrize('type_, args', CODEC_EVENTS)
+def test_truncated_and_padded_packets_are_rejected(type_, args):
+    data = bytes(packet_handler.pack(Event(type_, *args)))
+    for malformed in truncations(data):
+        assert_malformed(malformed)
+
+
+@pytest.mark.parametrize('type_, args', CODEC_EVENTS)
+def test_packers_reserve_the_type_prefix(type_, args):
+    data = packet_handler.pack(Event(type_, *args))
+    assert TYPE_STRUCT.unpack_from(data, 0)[0] == type_
+    assert packet_handler.unpack(bytes(data)).type == type_
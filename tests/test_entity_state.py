@@ -0,0 +1,103 @@
+import pygame
+import pytest
+
+from scripts.engine import Entity, EntityRegistry
+from scripts.engine.entity_state import EntityStateStore
+from scripts.engine.world import World
+
+
+class Crate(Entity):
+    def __init__(self, id: int, world: World, position: pygame.Vector2):
+        super().__init__(id, world, 'crate', position, pygame.Vector2(4, 4), None)
+
+
+def make_world(**kwargs) -> World:
+    registry = EntityRegistry()
+    registry.register_entity('crate', Crate)
+    return World(registry, is_server=True, **kwargs)
+
+
+def test_entities_read_and_write_their_slot():
+    world = make_world()
+    crate = Crate(7, world, pygame.Vector2(1, 2))
+    crate.velocity = pygame.Vector2(3, 4)
+    world.create_entity(crate)
+    store = world.state_store
+    slot = store.slot_by_id[7]
+    assert store.position[slot].tolist() == [1, 2] and store.velocity[slot].tolist() == [3, 4]
+    crate.position += pygame.Vector2(1, 1)
+    crate.rotation = 0.5
+    assert store.position[slot].tolist() == [2, 3] and store.rotation[slot] == 0.5
+    assert crate.position == (2, 3)
+
+
+
+def test_in_place_changes_write_through_to_the_store():
+    world = make_world()
+    crate = Crate(7, world, pygame.Vector2(1, 2))
+    world.create_entity(crate)
+    crate.position.x = 10
+    crate.velocity[1] = 5
+    crate.velocity.scale_to_length(10)
+    position = crate.position
+    position.update(3, 4)
+    assert crate.position == (3, 4)
+    assert tuple(crate.velocity) == pytest.approx((0, 10))
+    # computed vectors are not attached
+    moved = crate.position + pygame.Vector2(1, 1)
+    moved.x = 100
+    assert crate.position == (3, 4)
+    # the vector follows the entity when its slot moves
+    world.create_entity(Crate(8, world, pygame.Vector2(0, 0)))
+    world.destroy_entity(8)
+    position.y = 6
+    store = world.state_store
+    assert store.position[store.slot_by_id[7]].tolist() == [3, 6]
+
+def test_remove_moves_the_last_slot_into_the_hole():
+    world = make_world()
+    crates = [Crate(entity_id, world, pygame.Vector2(entity_id, 0)) for entity_id in range(3)]
+    for crate in crates:
+        world.create_entity(crate)
+    world.destroy_entity(0)
+    store = world.state_store
+    assert len(store) == 2 and 0 not in store
+    assert sorted(store.ids[:2].tolist()) == [1, 2]
+    assert crates[2].position == (2, 0)
+    # the destroyed entity keeps its state
+    assert crates[0].state_store is None and crates[0].position == (0, 0)
+
+
+def test_store_grows():
+    store = EntityStateStore(capacity=2)
+    world = make_world(columnar_state=False)
+    for entity_id in range(5):
+        crate = Crate(entity_id, world, pygame.Vector2(entity_id, 0))
+        crate.attach_state_store(store)
+    assert store.capacity >= 5
+    assert [state[1] for state in store.get_state_tuples()] == [0, 1, 2, 3, 4]
+
+
+def test_columnar_state_matches_entity_state():
+    worlds = [make_world(), make_world(columnar_state=False)]
+    for world in worlds:
+        for entity_id in range(4):
+            crate = Crate(entity_id, world, pygame.Vector2(entity_id*10, 5))
+            crate.velocity = pygame.Vector2(entity_id, -entity_id)
+            world.create_entity(crate, is_local=True)
+        world.is_server = False
+        for _ in range(10):
+            world.update(0.1)
+    columnar, plain = (sorted(world.get_phys_states()) for world in worlds)
+    for a, b in zip(columnar, plain):
+        assert a == pytest.approx(b)
+
+
+def test_apply_state_tuples_skips_unknown_and_local_entities():
+    world = make_world()
+    for entity_id in range(2):
+        world.create_entity(Crate(entity_id, world, pygame.Vector2(0, 0)))
+    slots = world.state_store.apply_state_tuples(
+        [(0, 1.0, 2.0, 0.0, 0.0, 0.0, 0.0), (1, 3.0, 4.0, 0.0, 0.0, 0.0, 0.0), (9, 5.0, 5.0, 0.0, 0.0, 0.0, 0.0)], [1])
+    assert len(slots) == 1
+    assert world.entities[0].position == (1, 2) and world.entities[1].position == (0, 0)
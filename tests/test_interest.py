@@ -0,0 +1,32 @@
+from scripts.engine.interest import InterestScope
+from scripts.engine.spatial import SpatialHash
+
+
+def test_scope_enters_and_leaves_with_hysteresis():
+    spatial_hash = SpatialHash()
+    scope = InterestScope(view_radius=100, hysteresis=20)
+    spatial_hash.update(1, 50, 0)
+    spatial_hash.update(2, 110, 0)
+    assert scope.update(spatial_hash, (0, 0)) == ([1], [])
+    # 2 comes into view
+    spatial_hash.update(2, 90, 0)
+    assert scope.update(spatial_hash, (0, 0)) == ([2], [])
+    # just outside the view radius, but inside the hysteresis band
+    spatial_hash.update(2, 115, 0)
+    assert scope.update(spatial_hash, (0, 0)) == ([], [])
+    spatial_hash.update(2, 125, 0)
+    assert scope.update(spatial_hash, (0, 0)) == ([], [2])
+    # back inside the band is not enough to enter again
+    spatial_hash.update(2, 115, 0)
+    assert scope.update(spatial_hash, (0, 0)) == ([], [])
+
+
+def test_always_and_destroyed_entities():
+    spatial_hash = SpatialHash()
+    scope = InterestScope(view_radius=100)
+    spatial_hash.update(1, 5000, 0)
+    spatial_hash.update(2, 10, 0)
+    assert sorted(scope.update(spatial_hash, (0, 0), always=[1, 3])[0]) == [1, 2]
+    spatial_hash.remove(2)
+    assert scope.update(spatial_hash, (0, 0), always=[1]) == ([], [2])
+    assert scope.in_scope == {1}
@@ -0,0 +1,349 @@
+import socket
+import struct
+import time
+
+import pytest
+
+from scripts.engine import mmsg
+from scripts.engine.network import (
+    ConnException, Constants, Event, FrameBuffer, Framing, HSystem, OutboundQueue, TCPServer, TCPSystem, UDPServer, Utility,
+    get_default_hybrid_packet_handler)
+
+
+def frame(data: bytes, framing: int = Framing.BINARY_V1) -> bytes:
+    return Utility.get_frame_header(data, framing)+data
+
+
+def decode_varint(header: bytes) -> int:
+    assert header[0] == Framing.BINARY_V1_TAG
+    value = 0
+    for i, byte in enumerate(header[1:]):
+        value |= (byte & 0x7F) << (7*i)
+    return value
+
+
+@pytest.mark.parametrize('length', [0, 1, 127, 128, 300, 16383, 16384, 1 << 21])
+def test_binary_header_varint(length):
+    header = Utility.get_binary_header(bytes(length))
+    assert decode_varint(header) == length
+    # 7 bits per byte after the tag, the last byte has no continuation bit
+    assert len(header) == 1 + max(1, (length.bit_length()+6) // 7)
+    assert header[-1] < 0x80
+
+
+def test_binary_header_never_looks_like_legacy():
+    assert not chr(Framing.BINARY_V1_TAG).isdigit()
+
+
+def test_frames_split_at_every_byte():
+    payloads = [b'', b'x', b'y'*200, b'z'*5000]
+    data = b''.join(frame(payload, framing) for payload in payloads for framing in (Framing.LEGACY, Framing.BINARY_V1))
+    sender, receiver = socket.socketpair()
+    frame_buffer = FrameBuffer(8)
+    frames = []
+    try:
+        for i in range(len(data)):
+            sender.sendall(data[i:i+1])
+            frame_buffer.recv_from(receiver)
+            frames += frame_buffer.pop_frames()
+    finally:
+        sender.close()
+        receiver.close()
+    assert frames == [payload for payload in payloads for _ in range(2)]
+    assert frame_buffer.start == frame_buffer.end == 0
+
+
+def test_many_frames_from_one_read():
+    payloads = [bytes([i])*i for i in range(20)]
+    sender, receiver = socket.socketpair()
+    frame_buffer = FrameBuffer()
+    try:
+        sender.sendall(b''.join(frame(payload) for payload in payloads))
+        frame_buffer.recv_from(receiver)
+        assert frame_buffer.pop_frames() == payloads
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_recv_from_closed_peer():
+    sender, receiver = socket.socketpair()
+    sender.close()
+    try:
+        with pytest.raises(ConnException):
+            FrameBuffer().recv_from(receiver)
+    finally:
+        receiver.close()
+
+
+def test_feed_frames():
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(frame(b'abc')+frame(b'de', Framing.LEGACY)+frame(b'f')[:1])
+    assert frame_buffer.pop_frames() == [b'abc', b'de']
+    frame_buffer.feed(frame(b'f')[1:])
+    assert frame_buffer.pop_frames() == [b'f']
+
+
+def test_feed_larger_than_buffer():
+    payload = bytes(range(256))*256 # 64 KiB
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(frame(payload))
+    assert frame_buffer.pop_frames() == [payload]
+
+
+def test_feed_chunk_larger_than_free_space_after_partial_frame():
+    frame_buffer = FrameBuffer(16)
+    first, second = b'a'*10, b'b'*65536
+    data = frame(first)+frame(second)
+    frame_buffer.feed(data[:5])
+    assert frame_buffer.pop_frames() == []
+    frame_buffer.feed(data[5:])
+    assert frame_buffer.pop_frames() == [first, second]
+
+def test_overlong_varint_is_rejected():
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(bytes((Framing.BINARY_V1_TAG,)) + b'\xff'*6)
+    with pytest.raises(ValueError):
+        frame_buffer.pop_frames()
+
+
+
+@pytest.mark.parametrize('header', [
+    b'-000000000000005', b'             123', b'00000000000001_0', b'0000000000000x12'])
+def test_malformed_legacy_header_is_rejected(header):
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(header + b'x'*8)
+    with pytest.raises(ValueError):
+        frame_buffer.pop_frames()
+
+
+@pytest.mark.parametrize('framing', [Framing.LEGACY, Framing.BINARY_V1])
+def test_frame_size_limit(framing):
+    limit = Constants.TCP_MAX_FRAME_SIZE
+    frame_buffer = FrameBuffer()
+    # only the header is fed, a frame at the limit waits for its payload
+    frame_buffer.feed(Utility.get_frame_header(bytes(limit), framing))
+    assert frame_buffer.pop_frames() == []
+    frame_buffer = FrameBuffer()
+    frame_buffer.feed(Utility.get_frame_header(bytes(limit+1), framing))
+    with pytest.raises(ValueError):
+        frame_buffer.pop_frames()
+
+
+def pump_until(system: TCPSystem, done, timeout: float = 2.0):
+    """pump system until done(new_clients, new_events, disconnected) over
+    everything pumped so far is true"""
+    results = ([], [], [])
+    deadline = time.monotonic()+timeout
+    while not done(*results) and time.monotonic() < deadline:
+        for result, new in zip(results, system.pump()):
+            result.extend(new)
+    return results
+
+
+@pytest.fixture
+def tcp_system():
+    packet_handler = get_default_hybrid_packet_handler()
+    system = TCPSystem(TCPServer(('127.0.0.1', 0), packet_handler))
+    yield system
+    for connection in list(system.clients):
+        system.remove_client(connection)
+    system.server.connection.close()
+
+
+def connect(system: TCPSystem) -> socket.socket:
+    return socket.create_connection(system.server.connection.getsockname())
+
+
+def test_tcp_system_accepts_and_reads_many_clients(tcp_system):
+    clients = [connect(tcp_system) for _ in range(50)]
+    try:
+        ping = frame(tcp_system.packet_handler.pack(Event(4, True)))
+        for client in clients:
+            client.sendall(ping*3)
+        new_clients, new_events, _ = pump_until(tcp_system, lambda c, e, d: len(e) == 150)
+        assert len(new_clients) == 50
+        assert len(new_events) == 150
+        assert {event.from_connection for event in new_events} == set(tcp_system.clients)
+        assert all((event.type, event.args) == (4, (True,)) for event in new_events)
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_tcp_system_reports_closed_clients(tcp_system):
+    client = connect(tcp_system)
+    pump_until(tcp_system, lambda c, e, d: c)
+    client.close()
+    _, _, disconnected = pump_until(tcp_system, lambda c, e, d: d)
+    assert len(disconnected) == 1
+    assert not tcp_system.clients
+
+
+def test_oversized_frame_fails_the_tcp_client(tcp_system):
+    client = connect(tcp_system)
+    try:
+        pump_until(tcp_system, lambda c, e, d: c)
+        client.sendall(Utility.get_binary_header(bytes(Constants.TCP_MAX_FRAME_SIZE+1)))
+        _, _, disconnected = pump_until(tcp_system, lambda c, e, d: d)
+        assert len(disconnected) == 1
+    finally:
+        client.close()
+
+
+@pytest.mark.parametrize('last_frame', [b'', frame(struct.pack('<H', 999))])
+def test_tcp_system_keeps_events_read_before_a_failure(tcp_system, last_frame):
+    client = connect(tcp_system)
+    pump_until(tcp_system, lambda c, e, d: c)
+    # a ping followed by the peer closing, or by an undecodable packet
+    client.sendall(frame(tcp_system.packet_handler.pack(Event(4, False)))+last_frame)
+    client.close()
+    _, new_events, disconnected = pump_until(tcp_system, lambda c, e, d: d)
+    assert [(event.type, event.args) for event in new_events] == [(4, (False,))]
+    assert len(disconnected) == 1 and not tcp_system.clients
+
+def test_outbound_queue_gather_write_keeps_order():
+    sender, receiver = socket.socketpair()
+    sender.setblocking(False)
+    queue = OutboundQueue()
+    try:
+        frames = [bytes([i % 256])*i for i in range(1, 300)]
+        for data in frames:
+            queue.append(data)
+        expected = b''.join(frames)
+        assert queue.queued_bytes == len(expected)
+        queue.flush(sender)
+        assert queue.queued_bytes == 0 and not queue.buffers
+        received = bytearray()
+        while len(received) < len(expected):
+            received += receiver.recv(1 << 16)
+        assert received == expected
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_tcp_system_queues_output_the_socket_cannot_take(tcp_system):
+    client = connect(tcp_system)
+    try:
+        (connection, _), = pump_until(tcp_system, lambda c, e, d: c)[0]
+        data = bytes(range(256))*(1 << 14) # 4 MiB, more than the socket buffers hold
+        tcp_system.send_bytes_to(connection, data)
+        # nothing is written before the flush
+        assert tcp_system.outbound_queues[connection].bytes_sent == 0
+        tcp_system.flush()
+        assert connection in tcp_system.backlogged_connections
+        assert tcp_system.get_backpressure_stats()['partial_writes'] >= 1
+        received = bytearray()
+        client.settimeout(2)
+        while len(received) < len(data):
+            received += client.recv(1 << 16)
+            tcp_system.pump()
+        assert received == data
+        assert not tcp_system.backlogged_connections
+    finally:
+        client.close()
+
+
+def test_tcp_system_drops_clients_above_high_water(tcp_system):
+    tcp_system.high_water_mark = 1 << 16
+    tcp_system.high_water_timeout = 0.0
+    client = connect(tcp_system)
+    try:
+        (connection, _), = pump_until(tcp_system, lambda c, e, d: c)[0]
+        tcp_system.send_bytes_to(connection, bytes(1 << 23))
+        _, _, disconnected = pump_until(tcp_system, lambda c, e, d: d)
+        assert [c for c, _ in disconnected] == [connection]
+        assert tcp_system.high_water_disconnects == 1
+    finally:
+        client.close()
+
+
+@pytest.mark.parametrize('use_sendmmsg', [False, True])
+def test_udp_send_event_many(use_sendmmsg):
+    packet_handler = get_default_hybrid_packet_handler()
+    server = UDPServer(('127.0.0.1', 0), packet_handler)
+    receivers = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(3)]
+    try:
+        server.use_sendmmsg = use_sendmmsg and mmsg.AVAILABLE
+        for receiver in receivers:
+            receiver.bind(('127.0.0.1', 0))
+            receiver.settimeout(2)
+        server.send_event_many(Event(4, True), [receiver.getsockname() for receiver in receivers])
+        data = packet_handler.pack(Event(4, True))
+        assert [receiver.recv(64) for receiver in receivers] == [data]*3
+        stats = server.take_send_stats()
+        assert (stats.datagrams_sent, stats.bytes_sent, stats.datagrams_dropped) == (3, 3*len(data), 0)
+        # the counters start over after each take
+        assert server.take_send_stats().datagrams_sent == 0
+    finally:
+        for receiver in receivers:
+            receiver.close()
+        server.close()
+
+
+
+def test_hsystem_udp_send_stats():
+    packet_handler = get_default_hybrid_packet_handler()
+    system = HSystem('127.0.0.1', 0, 0, object, packet_handler)
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(2)
+        system.send_event_udp(Event(4, True), receiver.getsockname())
+        receiver.recv(64)
+        stats = system.take_udp_send_stats()
+        assert (stats.datagrams_sent, stats.bytes_sent) == (1, len(packet_handler.pack(Event(4, True))))
+        assert system.take_udp_send_stats().datagrams_sent == 0
+    finally:
+        receiver.close()
+        system.server_udp.close()
+        system.server_tcp.connection.close()
+
+def receive_all(server: UDPServer, count: int, timeout: float = 2.0) -> list:
+    events = []
+    deadline = time.monotonic()+timeout
+    while len(events) < count and time.monotonic() < deadline:
+        events += server.pump()
+    return events
+
+
+@pytest.mark.parametrize('use_recvmmsg', [False, True])
+def test_udp_pump_drops_malformed_datagrams(use_recvmmsg):
+    packet_handler = get_default_hybrid_packet_handler()
+    server = UDPServer(('127.0.0.1', 0), packet_handler)
+    server.use_recvmmsg = use_recvmmsg and mmsg.AVAILABLE
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        address = server.getsockname()
+        # an RTTPing without its body, and an unknown type
+        sender.sendto(struct.pack('<H', 4), address)
+        sender.sendto(struct.pack('<H', 999), address)
+        sender.sendto(packet_handler.pack(Event(4, True)), address)
+        events = receive_all(server, 1)
+        assert [(event.type, event.args) for event, _ in events] == [(4, (True,))]
+        assert events[0][1][1] == sender.getsockname()[1]
+        assert server.datagrams_malformed == 2
+    finally:
+        sender.close()
+        server.close()
+
+
+@pytest.mark.parametrize('use_recvmmsg', [False, True])
+def test_udp_pump_reads_at_most_max_datagrams(use_recvmmsg):
+    packet_handler = get_default_hybrid_packet_handler()
+    server = UDPServer(('127.0.0.1', 0), packet_handler)
+    server.use_recvmmsg = use_recvmmsg and mmsg.AVAILABLE
+    server.max_datagrams_per_pump = 40
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for i in range(100):
+            sender.sendto(packet_handler.pack(Event(2, i)), server.getsockname())
+        time.sleep(0.05)
+        first = server.pump()
+        assert len(first) == 40
+        events = first + receive_all(server, 60)
+        assert [event.args[0] for event, _ in events] == list(range(100))
+    finally:
+        sender.close()
+        server.close()
@@ -0,0 +1,51 @@
+import asyncio
+
+from scripts.engine.network import Event, get_default_hybrid_packet_handler
+from scripts.engine.network_async import AsyncHClient, AsyncHSystem
+
+
+class ClientModel:
+    def __init__(self):
+        ...
+
+
+async def pump_until(peer, done, timeout: float = 2.0) -> list:
+    results = []
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()+timeout
+    while not done(results) and loop.time() < deadline:
+        results.append(await peer.pump(deadline-loop.time()))
+    return results
+
+
+def test_async_handshake_and_events():
+    async def main():
+        packet_handler = get_default_hybrid_packet_handler()
+        system = AsyncHSystem('127.0.0.1', 0, 0, ClientModel, packet_handler)
+        await system.start()
+        port_tcp = system.server_tcp.sockets[0].getsockname()[1]
+        port_udp = system.protocol_udp.transport.get_extra_info('sockname')[1]
+        client = AsyncHClient('127.0.0.1', port_tcp, port_udp, packet_handler)
+        try:
+            assert await client.connect(retry_interval=0.2)
+            results = await pump_until(system, lambda results: any(r.new_clients for r in results))
+            (server_client,) = [c for r in results for c in r.new_clients]
+            assert server_client.cid == client.cid
+
+            await client.send_event_tcp(Event(4, False))
+            results = await pump_until(system, lambda results: any(r.events_tcp for r in results))
+            (_, event), = [e for r in results for e in r.events_tcp]
+            assert (event.type, event.args) == (4, (False,))
+
+            await system.send_event_tcp(Event(4, True))
+            results = await pump_until(client, lambda results: any(r.events_tcp for r in results))
+            assert [(e.type, e.args) for r in results for e in r.events_tcp] == [(4, (True,))]
+
+            await client.close()
+            results = await pump_until(system, lambda results: any(r.disconnected_clients for r in results))
+            assert not system.clients
+        finally:
+            await client.close()
+            await system.close()
+
+    asyncio.run(main())
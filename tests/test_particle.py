@@ -0,0 +1,45 @@
+import pygame
+import pytest
+
+from scripts.engine.particle import Particle, ParticleSystem
+
+
+def test_update_matches_particle():
+    system = ParticleSystem()
+    particles = []
+    for i in range(5):
+        args = (pygame.Vector2(i, 2*i), pygame.Vector2(10, -i), 1.0+i, 0.5, pygame.Vector2(0, 9.8))
+        system.spawn(*args)
+        particles.append(Particle(pygame.Vector2(args[0]), pygame.Vector2(args[1]), *args[2:]))
+    for _ in range(10):
+        system.update(0.05)
+        for particle in particles:
+            particle.update(0.05)
+    for i, particle in enumerate(particles):
+        assert system.position[i].tolist() == pytest.approx(list(particle.position))
+        assert system.velocity[i].tolist() == pytest.approx(list(particle.velocity))
+
+
+def test_dead_particles_are_removed():
+    system = ParticleSystem()
+    for lifetime in (0.5, 2.0, 0.5, 2.0, 0.5):
+        system.spawn(pygame.Vector2(lifetime, 0), pygame.Vector2(0, 0), lifetime)
+    system.update(1.0)
+    assert len(system) == 2
+    assert system.lifetime_max[:2].tolist() == [2.0, 2.0]
+
+
+def test_full_pool_drops_new_particles():
+    system = ParticleSystem(capacity=2)
+    assert system.spawn(pygame.Vector2(0, 0), pygame.Vector2(0, 0))
+    assert system.spawn(pygame.Vector2(0, 0), pygame.Vector2(0, 0))
+    assert not system.spawn(pygame.Vector2(0, 0), pygame.Vector2(0, 0))
+    assert len(system) == 2
+
+
+def test_draw():
+    surface = pygame.Surface((32, 32))
+    system = ParticleSystem()
+    system.spawn(pygame.Vector2(16, 16), pygame.Vector2(0, 0), color=(0, 255, 0))
+    system.draw(surface)
+    assert surface.get_at((16, 16))[:3] == (0, 255, 0)
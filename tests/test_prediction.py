@@ -0,0 +1,97 @@
+import pytest
+
+from scripts.engine.prediction import InputReceiver, PredictionBuffer
+
+
+def command(sequence: int, x: float = 1.0, dt: float = 0.1):
+    return (sequence, x, 0.0, False, dt)
+
+
+class Body:
+    """1d stand in for an entity, x moves by input x * dt"""
+
+    def __init__(self):
+        self.x = 0.0
+
+    def state(self):
+        return (0, self.x, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+    def reset(self, state):
+        self.x = state[1]
+
+    def step(self, command):
+        self.x += command[1]*command[4]
+        return self.state()
+
+
+def predict(buffer: PredictionBuffer, body: Body, count: int):
+    for sequence in range(buffer.next_sequence(), buffer.next_sequence()+count):
+        buffer.record(command(sequence), body.step(command(sequence)))
+
+
+def test_matching_ack_is_not_a_correction():
+    buffer, body = PredictionBuffer(), Body()
+    predict(buffer, body, 5)
+    assert not buffer.reconcile(3, (0, 0.3, 0, 0, 0, 0, 0), body.reset, body.step)
+    assert buffer.acked_sequence == 3 and buffer.corrections == 0
+    assert buffer.unacked(10) == [command(4), command(5)]
+
+
+def test_mismatch_replays_unacked_commands():
+    buffer, body = PredictionBuffer(), Body()
+    predict(buffer, body, 5)
+    # the server had the body 1 unit further along after command 3
+    assert buffer.reconcile(3, (0, 1.3, 0, 0, 0, 0, 0), body.reset, body.step)
+    assert buffer.corrections == 1
+    assert body.x == pytest.approx(1.5)
+    # the replayed states are the new predictions
+    assert not buffer.reconcile(5, (0, 1.5, 0, 0, 0, 0, 0), body.reset, body.step)
+
+
+def test_old_and_future_acks_are_ignored():
+    buffer, body = PredictionBuffer(), Body()
+    predict(buffer, body, 3)
+    buffer.reconcile(2, buffer.states[2], body.reset, body.step)
+    assert not buffer.reconcile(1, (0, 9.0, 0, 0, 0, 0, 0), body.reset, body.step)
+    assert not buffer.reconcile(4, (0, 9.0, 0, 0, 0, 0, 0), body.reset, body.step)
+    assert body.x == pytest.approx(0.3) and buffer.acked_sequence == 2
+    assert buffer.corrections == 0
+
+
+def test_ack_past_the_ring_resets():
+    buffer, body = PredictionBuffer(capacity=4), Body()
+    predict(buffer, body, 10)
+    # command 2 was overwritten by command 6
+    assert buffer.reconcile(2, (0, 0.2, 0, 0, 0, 0, 0), body.reset, body.step)
+
+
+def test_receiver_drops_repeats_and_counts_skipped():
+    receiver = InputReceiver()
+    assert [c[0] for c in receiver.receive([command(1, dt=0.01), command(2, dt=0.01)])] == [1, 2]
+    assert [c[0] for c in receiver.receive([command(2, dt=0.01), command(5, dt=0.01)])] == [5]
+    assert receiver.skipped == 2 and receiver.last_sequence == 5
+
+
+def test_receiver_clamps_dt():
+    receiver = InputReceiver(max_dt=0.1, max_buffered_time=1.0)
+    assert receiver.receive([command(1, dt=0.5)])[0][4] == 0.1
+
+
+def test_receiver_rejects_far_ahead_sequence():
+    receiver = InputReceiver()
+    assert receiver.receive([command(0xFFFFFFFF)]) == []
+    assert receiver.rejected == 1
+    # does not lock out the real commands
+    assert len(receiver.receive([command(1, dt=0.01)])) == 1
+    # a long stall allows a bigger jump
+    receiver.tick(1.0)
+    assert len(receiver.receive([command(800, dt=0.01)])) == 1
+
+
+def test_receiver_caps_simulated_time():
+    receiver = InputReceiver(max_buffered_time=0.25)
+    received = receiver.receive([command(sequence, dt=0.1) for sequence in range(1, 11)])
+    assert len(received) == 2
+    receiver.tick(0.1)
+    received = receiver.receive([command(sequence, dt=0.1) for sequence in range(3, 11)])
+    assert [c[0] for c in received] == [3]
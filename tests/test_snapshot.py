@@ -0,0 +1,244 @@
+import math
+
+import pytest
+
+from scripts import packets
+from scripts.engine.snapshot import (
+    DeltaSnapshotDecoder, DeltaSnapshotEncoder, IdleSuppressor, Snapshot, SnapshotAssembler, SnapshotBuffer, SnapshotScheduler,
+    interpolate_arrays)
+
+
+def state(entity_id: int, x: float):
+    return (entity_id, x, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+
+def test_delta_round_trip_against_acked_baseline():
+    encoder = DeltaSnapshotEncoder()
+    decoder = DeltaSnapshotDecoder()
+    first = [state(1, 1.0), state(2, 2.0), state(3, 3.0)]
+    sequence, baseline_sequence, removed_ids, updates = encoder.encode(first)
+    assert baseline_sequence == 0 and len(updates) == 3
+    assert decoder.decode(sequence, baseline_sequence, removed_ids, updates) == {s[0]: s for s in first}
+    encoder.acknowledge(sequence)
+
+    # entity 1 moved, 2 did not, 3 is gone
+    second = [state(1, 1.5), state(2, 2.0)]
+    sequence, baseline_sequence, removed_ids, updates = encoder.encode(second)
+    assert baseline_sequence == 1 and removed_ids == [3]
+    assert updates == [(1, 1.5, None, None, None, None, None)]
+    assert decoder.decode(sequence, baseline_sequence, removed_ids, updates) == {s[0]: s for s in second}
+
+
+def test_unacked_snapshots_stay_against_the_old_baseline():
+    encoder = DeltaSnapshotEncoder()
+    encoder.encode([state(1, 1.0)])
+    encoder.acknowledge(1)
+    encoder.encode([state(1, 2.0)])
+    # snapshot 2 was lost, 3 repeats the change against snapshot 1
+    assert encoder.encode([state(1, 2.0)])[1:] == (1, [], [(1, 2.0, None, None, None, None, None)])
+    # acks of unknown or older snapshots are ignored
+    encoder.acknowledge(9)
+    encoder.acknowledge(0)
+    assert encoder.acked_sequence == 1
+
+
+def test_delta_decode_rejects_old_and_unknown_baselines():
+    encoder = DeltaSnapshotEncoder()
+    decoder = DeltaSnapshotDecoder()
+    old = encoder.encode([state(1, 1.0)])
+    new = encoder.encode([state(1, 2.0)])
+    assert decoder.decode(*new) is not None
+    assert decoder.decode(*old) is None
+    assert decoder.decode(5, 4, [], [(1, 3.0, None, None, None, None, None)]) is None
+
+
+def test_incomplete_snapshot_is_not_a_baseline():
+    decoder = DeltaSnapshotDecoder()
+    decoder.decode(1, 0, [], [state(1, 1.0)], complete=False)
+    assert 1 not in decoder.history
+    assert decoder.decode(2, 1, [], []) is None
+
+
+def test_assembler_hands_out_complete_snapshots():
+    assembler = SnapshotAssembler()
+    assert assembler.add(1, 1, 2, 'b') == []
+    assert assembler.add(1, 0, 2, 'a') == [(1, ['a', 'b'], True)]
+    # a part of an already handed out snapshot, and a bad part index
+    assert assembler.add(1, 0, 2, 'a') == []
+    assert assembler.add(2, 2, 2, 'x') == []
+
+
+def test_assembler_hands_out_partial_snapshot_when_newer_arrives():
+    assembler = SnapshotAssembler()
+    assembler.add(1, 0, 3, 'a')
+    assembler.add(1, 2, 3, 'c')
+    assert assembler.add(2, 0, 1, 'd') == [(1, ['a', 'c'], False), (2, ['d'], True)]
+
+
+def snapshot_at(time: float) -> Snapshot:
+    return Snapshot(0.0, time, [state(1, time)])
+
+
+def test_snapshot_buffer_bracket():
+    buffer = SnapshotBuffer(capacity=4)
+    assert buffer.bracket(1.0) is None
+    for time in (1.0, 2.0, 3.0):
+        buffer.push(snapshot_at(time))
+    assert [s.time for s in buffer.bracket(1.5)] == [1.0, 2.0]
+    assert [s.time for s in buffer.bracket(2.0)] == [2.0, 3.0]
+    # exactly on the newest snapshot, but not past it
+    assert [s.time for s in buffer.bracket(3.0)] == [2.0, 3.0]
+    assert buffer.bracket(3.5) is None
+    assert buffer.bracket(0.5) is None
+
+
+def test_snapshot_buffer_wraps_and_keeps_times_sorted():
+    buffer = SnapshotBuffer(capacity=3)
+    for time in (1.0, 2.0, 3.0, 4.0, 3.5):
+        buffer.push(snapshot_at(time))
+    # the oldest two were overwritten, the clock stepping back is clamped
+    assert [buffer[i].time for i in range(len(buffer))] == [3.0, 4.0, 4.0]
+    with pytest.raises(IndexError):
+        buffer[3]
+
+
+def test_snapshot_buffer_evicts_before_bracket():
+    buffer = SnapshotBuffer()
+    for time in range(10):
+        buffer.push(snapshot_at(float(time)))
+    buffer.evict_before(6.5)
+    assert [buffer[i].time for i in range(len(buffer))] == [6.0, 7.0, 8.0, 9.0]
+    # the newest pair always stays
+    buffer.evict_before(50.0)
+    assert len(buffer) == 2
+
+
+def test_interpolate_arrays_joins_on_id():
+    s1 = Snapshot(0.0, 0.0, [(3, 0.0, 0.0, 0.0, 0.0, 3.0, 0.0), (1, 10.0, 0.0, 0.0, 0.0, 0.0, 0.0)])
+    s2 = Snapshot(0.0, 1.0, [(2, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0), (3, 4.0, 8.0, 2.0, 0.0, -3.0, 1.0), (1, 20.0, 0.0, 0.0, 0.0, 0.0, 0.0)])
+    for snapshot in (s1, s2):
+        snapshot.build_arrays()
+    ids, states = interpolate_arrays(s1, s2, 0.5)
+    assert ids.tolist() == [1, 3]
+    assert states[0].tolist() == [15.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    assert states[1, :4].tolist() == [2.0, 4.0, 1.0, 0.0]
+    # the short way around from 3 to -3 rad
+    assert states[1, 4] == pytest.approx(3.0 + (math.tau-6.0)/2)
+    assert Snapshot(0.0, 0.5, ids=ids, states=states).entity_states[0] == (1, 15.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+
+def test_interpolate_arrays_with_empty_snapshot():
+    s1 = Snapshot(0.0, 0.0, [])
+    s2 = Snapshot(0.0, 1.0, [state(1, 1.0)])
+    for snapshot in (s1, s2):
+        snapshot.build_arrays()
+    ids, states = interpolate_arrays(s1, s2, 0.5)
+    assert len(ids) == 0 and states.shape == (0, 6)
+
+
+def test_encode_keeps_present_entities_which_were_not_sent():
+    encoder = DeltaSnapshotEncoder()
+    encoder.encode([state(1, 1.0), state(2, 2.0)])
+    encoder.acknowledge(1)
+    # only entity 1 was selected, 2 still exists and 3 is gone
+    sequence, _, removed_ids, updates = encoder.encode([state(1, 1.5)], [1, 2])
+    assert removed_ids == [] and updates == [(1, 1.5, None, None, None, None, None)]
+    assert encoder.history[sequence][2] == state(2, 2.0)
+    assert encoder.encode([], [1])[2] == [2]
+
+
+def test_scheduler_fills_the_budget_by_priority():
+    scheduler = SnapshotScheduler(budget=30, falloff_distance=100)
+    states = [state(entity_id, 10.0*entity_id) for entity_id in range(6)]
+    size = lambda s: 10
+    # never sent entities go first, in id order
+    assert [s[0] for s in scheduler.select(states, (0, 0), size)] == [0, 1, 2]
+    assert scheduler.sent_bytes == 30
+    assert [s[0] for s in scheduler.select(states, (0, 0), size)] == [3, 4, 5]
+    # after that the skipped entities climb, nearer ones faster
+    assert [s[0] for s in scheduler.select(states, (0, 0), size)] == [0, 1, 2]
+    assert [s[0] for s in scheduler.select(states, (0, 0), size)] == [3, 4, 5]
+
+
+def test_scheduler_skips_up_to_date_and_forgets_gone_entities():
+    scheduler = SnapshotScheduler(budget=100)
+    states = [state(1, 0.0), state(2, 0.0)]
+    assert scheduler.select(states, (0, 0), lambda s: None if s[0] == 1 else 10) == [state(2, 0.0)]
+    assert scheduler.select(states[1:], (0, 0), lambda s: 10) == [state(2, 0.0)]
+    assert list(scheduler.priorities) == [2]
+
+
+def test_unselected_entities_keep_their_newest_state():
+    # one record per snapshot, acks arrive two snapshots late
+    encoder = DeltaSnapshotEncoder()
+    decoder = DeltaSnapshotDecoder()
+    scheduler = SnapshotScheduler(budget=packets.phys_delta_update_size(state(0, 0.0)))
+    def update_size(s):
+        update = encoder.delta(s)
+        return None if update is None else packets.phys_delta_update_size(update)
+
+    server_x = {1: [5.0, 3.0, 8.0, 7.0, 9.0, 2.0], 2: [501.0, 502.0, 503.0, 504.0, 505.0, 506.0]}
+    shown = {1: [], 2: []}
+    acks = []
+    for tick in range(6):
+        states = [state(entity_id, xs[tick]) for entity_id, xs in server_x.items()]
+        selected = scheduler.select(states, (0, 0), update_size)
+        assert len(selected) == 1
+        sequence, baseline_sequence, removed_ids, updates = encoder.encode(selected, [s[0] for s in states])
+        decoded = decoder.decode(sequence, baseline_sequence, removed_ids, updates)
+        for entity_id, xs in shown.items():
+            if entity_id in decoded: xs.append(decoded[entity_id][1])
+            else: assert not xs, f"entity {entity_id} disappeared"
+        acks.append(sequence)
+        if len(acks) > 2:
+            encoder.acknowledge(acks.pop(0))
+
+    for entity_id, xs in shown.items():
+        # never goes back to an older value
+        sent_at = [server_x[entity_id].index(x) for x in xs]
+        assert sent_at == sorted(sent_at), (entity_id, xs)
+    # entity 2 is first sent on the second tick, before any ack arrived
+    assert len(shown[2]) == 5
+
+
+def test_forget_drops_destroyed_entity():
+    encoder = DeltaSnapshotEncoder()
+    decoder = DeltaSnapshotDecoder()
+    decoder.decode(*encoder.encode([state(1, 1.0), state(2, 2.0)]))
+    decoder.forget(1)
+    assert list(decoder.decode(*encoder.encode([state(2, 3.0)], [1, 2]))) == [2]
+
+
+def test_idle_suppressor_rest_records_and_keyframes():
+    suppressor = IdleSuppressor(keyframe_interval=1.0, rest_repeats=2)
+    moving = (1, 1.0, 1.0, 5.0, 0.0, 0.5, 0.0)
+    assert suppressor.filter([moving], 0.0) == [moving]
+    sent = [suppressor.filter([moving], t/10) for t in range(1, 10)]
+    rest = (1, 1.0, 1.0, 0.0, 0.0, 0.5, 0.0)
+    # two rest records, then nothing until the keyframe
+    assert sent[:2] == [[rest], [rest]]
+    assert all(records == [] for records in sent[2:])
+    assert suppressor.filter([moving], 1.2) == [rest]
+    # any change is sent straight away
+    moved = (1, 2.0, 1.0, 5.0, 0.0, 0.5, 0.0)
+    assert suppressor.filter([moved], 1.3) == [moved]
+
+
+def test_idle_suppressor_forget_sends_in_full():
+    suppressor = IdleSuppressor(rest_repeats=1)
+    parked = (1, 1.0, 1.0, 0.0, 0.0, 0.0, 0.0)
+    for t in range(3):
+        suppressor.filter([parked], t/10)
+    assert suppressor.filter([parked], 0.3) == []
+    suppressor.forget()
+    assert suppressor.filter([parked], 0.4) == [parked]
+    # entities which are gone are dropped
+    suppressor.filter([], 0.5)
+    assert not suppressor.last_sent
+
+
+def test_idle_suppressor_drops_gone_entities():
+    suppressor = IdleSuppressor()
+    suppressor.filter([(1, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0), (2, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)], 0.0)
+    suppressor.filter([(2, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)], 0.1)
+    assert set(suppressor.last_sent) == {2} and set(suppressor.sent_time) == {2}
@@ -0,0 +1,73 @@
+import math
+import random
+
+import numpy as np
+import pygame
+
+from scripts.engine.spatial import SpatialHash
+
+
+def random_hash(count: int = 300, seed: int = 1):
+    rng = random.Random(seed)
+    spatial_hash = SpatialHash(cell_size=32)
+    positions = {}
+    for entity_id in range(count):
+        positions[entity_id] = (rng.uniform(-500, 500), rng.uniform(-500, 500))
+        spatial_hash.update(entity_id, *positions[entity_id])
+    return spatial_hash, positions
+
+
+def test_queries_match_brute_force():
+    spatial_hash, positions = random_hash()
+    rect = pygame.Rect(-100, -50, 230, 170)
+    assert sorted(spatial_hash.query_rect(rect)) == sorted(
+        entity_id for entity_id, (x, y) in positions.items()
+        if rect.left <= x < rect.right and rect.top <= y < rect.bottom)
+    for center, radius in (((0, 0), 120), ((400, -400), 300), ((30, 30), 2000)):
+        assert sorted(spatial_hash.query_radius(center, radius)) == sorted(
+            entity_id for entity_id, position in positions.items() if math.dist(position, center) <= radius)
+
+
+def test_nearest_matches_brute_force():
+    spatial_hash, positions = random_hash()
+    for center in ((0, 0), (480, 480), (-2000, 10), (123.4, -56.7)):
+        expected = min(positions, key=lambda entity_id: math.dist(positions[entity_id], center))
+        assert spatial_hash.nearest(center) == expected
+        assert spatial_hash.nearest(center, exclude=[expected]) != expected
+    assert spatial_hash.nearest((-2000, 10), max_radius=100) is None
+    assert SpatialHash().nearest((0, 0)) is None
+
+
+def test_nearest_after_edge_cells_empty():
+    spatial_hash, positions = random_hash(100)
+    spatial_hash.nearest((0, 0))
+    # empty the outermost cells, then move entities far past the old bounds
+    for entity_id in sorted(positions, key=lambda entity_id: -max(map(abs, positions[entity_id])))[:20]:
+        spatial_hash.remove(entity_id)
+        del positions[entity_id]
+    for entity_id in list(positions)[:5]:
+        positions[entity_id] = (3000.0+entity_id, -3000.0)
+        spatial_hash.update(entity_id, *positions[entity_id])
+    for center in ((0, 0), (5000, -5000), (-480, 480)):
+        expected = min(positions, key=lambda entity_id: math.dist(positions[entity_id], center))
+        assert spatial_hash.nearest(center) == expected
+
+def test_moves_and_removes():
+    spatial_hash = SpatialHash(cell_size=10)
+    spatial_hash.update(1, 5, 5)
+    spatial_hash.update(1, 25, 5)
+    assert spatial_hash.cell_of[1] == (2, 0) and (0, 0) not in spatial_hash.cells
+    spatial_hash.remove(1)
+    assert 1 not in spatial_hash and not spatial_hash.cells
+
+
+def test_update_arrays_matches_update():
+    spatial_hash, positions = random_hash(50)
+    ids = np.arange(50)
+    moved = np.array([positions[entity_id] for entity_id in range(50)]) + 40
+    spatial_hash.update_arrays(ids, moved)
+    expected = SpatialHash(cell_size=32)
+    for entity_id, (x, y) in enumerate(moved.tolist()):
+        expected.update(entity_id, x, y)
+    assert spatial_hash.cell_of == expected.cell_of
+    assert spatial_hash.cells == expected.cells
@@ -0,0 +1,68 @@
+import pytest
+
+from scripts.engine.tick import RollingHistogram, TickScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_advance_carries_leftover_time():
+    clock = FakeClock()
+    scheduler = TickScheduler(tick_rate=8, clock=clock)
+    ticks = 0
+    # uneven steps still add up to one tick per 0.125s
+    for step in (0.0625, 0.09375, 0.125, 0.03125, 0.1875):
+        clock.now += step
+        ticks += scheduler.advance()
+    assert ticks == 4
+    assert scheduler.accumulator == pytest.approx(0.0)
+
+
+def test_stall_is_capped_and_dropped():
+    clock = FakeClock()
+    scheduler = TickScheduler(tick_rate=10, max_catch_up=3, clock=clock)
+    clock.now = 1.05
+    assert scheduler.advance() == 3
+    assert scheduler.dropped_ticks == 7
+    clock.now += 0.05
+    assert scheduler.advance() == 0
+
+
+def test_should_send_at_send_rate():
+    clock = FakeClock()
+    scheduler = TickScheduler(tick_rate=16, send_rate=8, clock=clock)
+    sends = []
+    for _ in range(8):
+        clock.now += 1/16
+        scheduler.advance()
+        sends.append(scheduler.should_send())
+    assert sends == [False, True]*4
+
+
+def test_phases_and_overruns():
+    clock = FakeClock()
+    scheduler = TickScheduler(tick_rate=10, clock=clock)
+    clock.now += 0.1
+    scheduler.wait()
+    with scheduler.phase('update'):
+        clock.now += 0.15
+    scheduler.end_tick()
+    assert scheduler.overruns == 1
+    assert scheduler.phases['update'].summary()['max'] == pytest.approx(0.15)
+    assert 'update' in scheduler.report()
+
+
+def test_histogram_percentiles():
+    histogram = RollingHistogram(size=100)
+    for value in range(1, 201):
+        histogram.add(float(value))
+    # only the last 100 samples are kept
+    assert len(histogram) == 100
+    assert histogram.percentile(50) == 150
+    summary = histogram.summary()
+    assert (summary['p99'], summary['max'], summary['mean']) == (199, 200, 150.5)
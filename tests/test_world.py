@@ -0,0 +1,216 @@
+import math
+import struct
+
+import pygame
+import pytest
+
+from scripts import packets
+from scripts.engine import DeltaSnapshotEncoder, Entity, EntityRegistry, Replicated, Snapshot, StateHistory
+from scripts.engine.world import MAX_SNAPSHOT_PARTS, World
+
+
+class Crate(Entity):
+    hp = Replicated('i', 10)
+
+    def __init__(self, id: int, world: World, position: pygame.Vector2):
+        super().__init__(id, world, 'crate', position, pygame.Vector2(4, 4), None)
+
+
+def make_world(**kwargs) -> World:
+    registry = EntityRegistry()
+    registry.register_entity('crate', Crate)
+    return World(registry, is_server=True, **kwargs)
+
+
+def add_crate(world: World, entity_id: int, x: float = 0.0) -> Crate:
+    crate = Crate(entity_id, world, pygame.Vector2(x, 0))
+    world.create_entity(crate)
+    return crate
+
+
+def test_split_by_budget_keeps_parts_under_budget():
+    world = make_world()
+    world.snapshot_payload_budget = 100
+    items = list(range(20))
+    parts, deferred = world.split_by_budget(items, lambda item: 40, 0)
+    assert deferred == []
+    # 98 bytes of room after the type prefix, two items per part
+    assert [len(part) for part in parts] == [2]*10
+    assert [item for part in parts for item in part] == items
+    assert world.split_by_budget([], lambda item: 40, 0) == ([[]], [])
+
+
+def test_full_snapshot_is_split_into_parts():
+    world = make_world()
+    world.snapshot_payload_budget = packets.PHYS_MULTI_HEADER.size + 2 + 3*packets.PHYS_RECORD.size
+    for entity_id in range(10):
+        add_crate(world, entity_id, float(entity_id))
+    events = world.pump_network_events()[1]
+    assert [len(event.args[4]) for event in events] == [3, 3, 3, 1]
+    assert {event.args[1] for event in events} == {1}
+    assert [event.args[2:4] for event in events] == [(i, 4) for i in range(4)]
+
+
+def test_delta_snapshot_is_split_into_parts():
+    world = make_world(delta_snapshots=True)
+    world.snapshot_payload_budget = 200
+    states = [(entity_id, float(entity_id), 0.0, 0.0, 0.0, 0.0, 0.0) for entity_id in range(20)]
+    events = world.build_delta_snapshot_events(DeltaSnapshotEncoder(), states)
+    assert len(events) > 1
+    for event in events:
+        data = packets.get_packet_handler().pack(event)
+        assert len(data) <= world.snapshot_payload_budget
+    assert sorted(update[0] for event in events for update in event.args[6]) == list(range(20))
+
+
+def test_split_by_budget_defers_past_max_parts():
+    world = make_world()
+    world.snapshot_payload_budget = 100
+    items = list(range(2000))
+    parts, deferred = world.split_by_budget(items, lambda item: 40, 0)
+    assert len(parts) == MAX_SNAPSHOT_PARTS
+    assert [item for part in parts for item in part] + deferred == items
+
+
+def test_full_snapshot_sends_deferred_entities_first():
+    world = make_world()
+    world.snapshot_payload_budget = packets.PHYS_MULTI_HEADER.size + 2 + packets.PHYS_RECORD.size
+    for entity_id in range(MAX_SNAPSHOT_PARTS+5):
+        add_crate(world, entity_id, float(entity_id))
+    sent = [update[0] for event in world.pump_network_events()[1] for update in event.args[4]]
+    assert len(sent) == MAX_SNAPSHOT_PARTS
+    sent_next = [update[0] for event in world.pump_network_events()[1] for update in event.args[4]]
+    assert set(range(MAX_SNAPSHOT_PARTS+5)) - set(sent) <= set(sent_next[:5])
+
+
+def test_delta_snapshot_defers_past_max_parts():
+    world = make_world(delta_snapshots=True)
+    world.snapshot_payload_budget = 100
+    states = [(entity_id, float(entity_id), 0.0, 0.0, 0.0, 0.0, 0.0) for entity_id in range(1000)]
+    events = world.build_delta_snapshot_events(DeltaSnapshotEncoder(), states)
+    assert len(events) == MAX_SNAPSHOT_PARTS
+    assert all(event.args[4] == MAX_SNAPSHOT_PARTS for event in events)
+
+
+
+def test_delta_snapshots_send_parked_entities_to_new_clients():
+    world = make_world(delta_snapshots=True)
+    assert world.idle_suppressor is None
+    for entity_id in range(3):
+        add_crate(world, entity_id, float(entity_id))
+    old_client = DeltaSnapshotEncoder()
+    for _ in range(3):
+        events = world.build_delta_snapshot_events(old_client, world.get_phys_states())
+        old_client.acknowledge(events[0].args[0])
+    # nothing moved since the acknowledged snapshot
+    assert [update for event in events for update in event.args[6]] == []
+    events = world.build_delta_snapshot_events(DeltaSnapshotEncoder(), world.get_phys_states())
+    assert sorted(update[0] for event in events for update in event.args[6]) == [0, 1, 2]
+
+def test_interpolate_snapshot_between_brackets():
+    registry = EntityRegistry()
+    world = World(registry)
+    world.push_snapshot(Snapshot(0.0, 1.0, [(1, 0.0, 0.0, 0.0, 0.0, 3.0, 0.0), (2, 5.0, 5.0, 0.0, 0.0, 0.0, 0.0)]))
+    world.push_snapshot(Snapshot(0.0, 2.0, [(1, 10.0, 20.0, 2.0, 0.0, -3.0, 1.0), (3, 1.0, 1.0, 0.0, 0.0, 0.0, 0.0)]))
+    (state,) = world.interpolate_snapshot(1.25).entity_states
+    # only entities in both snapshots
+    assert state[0] == 1
+    assert state[1:5] == pytest.approx((2.5, 5.0, 0.5, 0.0))
+    assert state[6] == pytest.approx(0.25)
+    # the angle goes the short way around from 3 to -3
+    assert 3.0 < state[5] < 3.0 + (math.tau-6.0)*0.25 + 1e-9
+    # past the newest snapshot it is held
+    assert world.interpolate_snapshot(2.5).entity_states[0][1] == 10.0
+
+
+def test_spatial_hash_follows_entities():
+    world = make_world()
+    crate = add_crate(world, 1, 10.0)
+    assert world.spatial_hash.query_radius((10, 0), 1) == [1]
+    crate.velocity = pygame.Vector2(1000, 0)
+    world.is_server = False
+    world.local_entities.add(1)
+    world.update(1.0)
+    assert world.spatial_hash.query_radius((10, 0), 1) == []
+    assert world.spatial_hash.nearest((900, 0)) == 1
+    world.destroy_entity(1)
+    assert 1 not in world.spatial_hash
+
+
+def test_phys_states_of_entity_ids():
+    for world in (make_world(), make_world(columnar_state=False)):
+        for entity_id in range(3):
+            add_crate(world, entity_id, float(entity_id))
+        assert sorted(state[0] for state in world.get_phys_states([2, 0, 7])) == [0, 2]
+        assert len(world.get_phys_states()) == 3
+
+
+def test_history_sample_interpolates_between_ticks():
+    world = make_world()
+    crate = add_crate(world, 1)
+    history = StateHistory(capacity=4)
+    for tick in range(3):
+        crate.position = pygame.Vector2(tick*10, 0)
+        history.record(tick, world.state_store)
+    ids, states = history.sample(1.5)
+    assert ids.tolist() == [1]
+    assert states[0, 0] == pytest.approx(15)
+    # clamped to the oldest / newest tick
+    assert history.sample(-5)[1][0, 0] == 0
+    assert history.sample(9)[1][0, 0] == 20
+
+
+def test_history_sample_only_entities_in_both_ticks():
+    world = make_world()
+    add_crate(world, 1)
+    history = StateHistory(capacity=4, entity_capacity=1)
+    history.record(0.0, world.state_store)
+    add_crate(world, 2, 5.0)
+    history.record(1.0, world.state_store)
+    assert history.sample(0.5)[0].tolist() == [1]
+    assert history.sample(1.0, [2])[0].tolist() == [2]
+    assert history.sample(1.0, [3])[0].tolist() == []
+
+
+def test_history_wraps_around():
+    world = make_world()
+    crate = add_crate(world, 1)
+    history = StateHistory(capacity=2)
+    for tick in range(5):
+        crate.position = pygame.Vector2(tick, 0)
+        history.record(tick, world.state_store)
+    assert len(history) == 2 and history.oldest_time() == 3
+    assert history.sample(3.5)[1][0, 0] == pytest.approx(3.5)
+
+
+def test_replicated_rejects_values_it_cannot_pack():
+    world = make_world()
+    crate = add_crate(world, 1)
+    crate.hp = -5
+    with pytest.raises(struct.error):
+        crate.hp = 1 << 40
+    assert crate.hp == -5
+    assert world.take_attribute_updates() == {1: (Crate.hp.bit, struct.pack('<i', -5))}
+    assert crate.dirty_attributes == 0 and not world.dirty_entities
+
+
+def test_attribute_event_for_a_scope():
+    world = make_world()
+    add_crate(world, 1).hp = 3
+    add_crate(world, 2).hp = 4
+    updates = world.take_attribute_updates()
+    (records,) = world.build_attribute_event([2], updates=updates).args
+    assert records == [(2, Crate.hp.bit, struct.pack('<i', 4))]
+    assert world.build_attribute_event([7], updates=updates) is None
+    # the server does not broadcast attributes from pump_network_events
+    add_crate(world, 3).hp = 5
+    assert world.pump_network_events()[0] == []
+
+
+def test_full_attribute_event_for_new_clients():
+    world = make_world()
+    add_crate(world, 1)
+    add_crate(world, 2).hp = 4
+    (records,) = world.build_attribute_event([2, 7], full=True).args
+    assert records == [(2, Crate.replicated_mask, struct.pack('<i', 4))]
+    assert world.build_attribute_event([7]) is None